@@ -0,0 +1,50 @@
+"""
+Bulk factories for seeding the benchmark database with large fixtures quickly.
+"""
+import os
+from itertools import count
+
+from django.conf import settings
+
+from busker.models import Artist, Batch, BatchStats, DownloadableWork, DownloadCode, File
+
+_sequence = count(1)
+
+
+def work(published=True):
+    artist = Artist.objects.create(name=f"Benchmark Artist {next(_sequence)}", url="https://example.com")
+    return DownloadableWork.objects.create(artist=artist, title=f"Benchmark Work {next(_sequence)}",
+                                           published=published)
+
+
+def batch(number_of_codes=0, max_uses=1, for_work=None):
+    """
+    Creates a batch with `number_of_codes` randomly generated codes (bulk-inserted by busker's own batch_create).
+    """
+    return Batch.objects.create(work=for_work or work(), label=f"Benchmark Batch {next(_sequence)}",
+                                public_message="", number_of_codes=number_of_codes, max_uses=max_uses)
+
+
+def sequential_codes(for_batch, start, stop, chunk_size=5000):
+    """
+    Bulk-inserts codes '0000000' style numbered from `start` up to (but excluding) `stop` into a batch, for benchmarks
+    that need to control exactly which codes exist.
+    """
+    for chunk_start in range(start, stop, chunk_size):
+        DownloadCode.objects.bulk_create(
+            DownloadCode(id=f"{number:07d}", batch=for_batch, work_id=for_batch.work_id,
+                         is_active=for_batch.work.published, max_uses=for_batch.max_uses)
+            for number in range(chunk_start, min(chunk_start + chunk_size, stop))
+        )
+    BatchStats.rebuild([for_batch.pk])
+
+
+def file(size, for_work=None):
+    """
+    Creates a File of `size` bytes directly in MEDIA_ROOT. The file is sparse where the filesystem supports it, so even
+    multi-gigabyte files are created instantly and take no disk space.
+    """
+    name = f"benchmark-{next(_sequence)}.bin"
+    with open(os.path.join(settings.MEDIA_ROOT, name), 'wb') as f:
+        f.truncate(size)
+    return File.objects.create(work=for_work or work(), description="", file=name)
@@ -0,0 +1,43 @@
+"""
+Django settings for running the busker benchmarks. These are the test settings, with the database chosen by the
+BUSKER_BENCH_DB environment variable:
+
+- 'sqlite' (the default): a temporary SQLite file, so that the concurrent benchmarks can share it between threads
+- 'postgresql': a local PostgreSQL server, configured by the usual PGHOST, PGPORT, PGUSER, PGPASSWORD and PGDATABASE
+  environment variables. The benchmarks run in a 'test_' database that is created and destroyed by the runner.
+"""
+import os
+from tempfile import mkdtemp
+
+from tests.busker_test_settings import *  # noqa: F401,F403
+
+if os.environ.get('BUSKER_BENCH_DB', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('PGDATABASE', 'busker'),
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+            'HOST': os.environ.get('PGHOST', 'localhost'),
+            'PORT': os.environ.get('PGPORT', ''),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(mkdtemp(prefix='busker-bench-'), 'bench.sqlite3'),
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+    DATABASES['default']['TEST'] = {'NAME': DATABASES['default']['NAME']}
+
+# Keep activity logging and Django's own request logging out of the timings
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'loggers': {
+        'busker': {'level': 'WARNING'},
+        'django.request': {'level': 'CRITICAL'},
+    },
+}
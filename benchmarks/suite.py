@@ -0,0 +1,380 @@
+"""
+Benchmarks for busker's hot paths: code generation, batch creation, code validation, concurrent redemption, file
+downloads and CSV export, plus the query plans of busker's most common queries with and without its indexes.
+
+Each benchmark returns a list of results, one per parameter combination, with latency statistics in milliseconds and
+throughput in operations per second. The runner writes them, along with details of the environment (commit, Python,
+Django and database versions), as JSON so that runs can be compared across commits with --compare.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+from secrets import token_hex
+from unittest import mock
+
+import django
+from django.db import DatabaseError, connection, models
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from busker.formatters import format_codes_csv
+from busker.models import Batch, DownloadableWork, DownloadCode, generate_code, valid_codes, validate_code
+
+from . import factories
+
+#: Parameters for each scale; 'full' covers the sizes we care about in production, 'quick' is a smoke test.
+SCALES = {
+    'quick': {
+        'iterations': 20,
+        'keyspace': 10000,
+        'fill_ratios': [0, 0.5, 0.9],
+        'batch_sizes': [1000],
+        'validate_codes': 2000,
+        'threads': [1, 4],
+        'redemptions': 200,
+        'file_sizes': [1024, 16 * 2 ** 20],
+        'csv_sizes': [1000],
+        'plan_codes': 20000,
+    },
+    'full': {
+        'iterations': 200,
+        'keyspace': 100000,
+        'fill_ratios': [0, 0.5, 0.9, 0.99],
+        'batch_sizes': [10000, 100000],
+        'validate_codes': 100000,
+        'threads': [1, 4, 16],
+        'redemptions': 2000,
+        'file_sizes': [1024, 2 * 2 ** 30],
+        'csv_sizes': [10000, 100000],
+        'plan_codes': 1000000,
+    },
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def result(name, params, timings, wall_time=None, **extra):
+    """
+    Summarizes a list of per-operation timings (in seconds) as a result dict.
+    """
+    timings = sorted(timings)
+    count = len(timings)
+    wall_time = wall_time if wall_time is not None else sum(timings)
+    return {
+        'name': name,
+        'params': params,
+        'iterations': count,
+        'mean_ms': round(statistics.mean(timings) * 1000, 4),
+        'median_ms': round(statistics.median(timings) * 1000, 4),
+        'p95_ms': round(timings[max(0, math.ceil(count * 0.95) - 1)] * 1000, 4),
+        'min_ms': round(timings[0] * 1000, 4),
+        'max_ms': round(timings[-1] * 1000, 4),
+        'ops_per_sec': round(count / wall_time, 2) if wall_time else None,
+        **extra,
+    }
+
+
+def timed(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def consume(response):
+    """
+    Reads a response's whole body, the way a client would, and returns its length.
+    """
+    if response.streaming:
+        length = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        length = len(response.content)
+    response.close()
+    return length
+
+
+@benchmark
+def generate_code_fill(scale):
+    """
+    generate_code() when a fraction of the keyspace is already taken. The real keyspace (36^7 codes) can't be filled
+    in a benchmark, so codes are drawn from a keyspace of `keyspace` numbered codes instead.
+    """
+    results = []
+    keyspace = scale['keyspace']
+    for fill_ratio in scale['fill_ratios']:
+        batch = factories.batch()
+        factories.sequential_codes(batch, 0, int(keyspace * fill_ratio))
+        with mock.patch('busker.models.random_code', lambda: f"{random.randrange(keyspace):07d}"):
+            timings = timed(generate_code, scale['iterations'])
+        results.append(result('generate_code', {'fill_ratio': fill_ratio, 'keyspace': keyspace}, timings))
+        batch.delete()
+    return results
+
+
+@benchmark
+def batch_create(scale):
+    """
+    Saving a new Batch, which generates all of its codes.
+    """
+    results = []
+    work = factories.work()
+    for size in scale['batch_sizes']:
+        timings = timed(lambda: factories.batch(size, for_work=work), 1 if size >= 100000 else 3)
+        results.append(result('batch_create', {'codes': size}, timings, codes_per_sec=round(size / min(timings))))
+    work.delete()
+    return results
+
+
+@benchmark
+def validate_code_hit_miss(scale):
+    """
+    validate_code() for codes that exist and are valid (hit) and codes that don't exist (miss).
+    """
+    batch = factories.batch(scale['validate_codes'], max_uses=0)
+    codes = list(batch.codes.values_list('pk', flat=True)[:1000])
+    iterations = scale['iterations']
+    hits = timed(lambda: validate_code(random.choice(codes).lower()), iterations)
+    misses = timed(lambda: validate_code('!' + token_hex(3)), iterations)
+    params = {'codes': scale['validate_codes']}
+    results = [result('validate_code', {**params, 'case': 'hit'}, hits),
+               result('validate_code', {**params, 'case': 'miss'}, misses)]
+    batch.work.delete()
+    return results
+
+
+@benchmark
+def redeem_concurrent(scale):
+    """
+    DownloadCode.redeem() from several threads at once, each redeeming different codes in the same batch (so they
+    contend for the batch's statistics row).
+    """
+    results = []
+    for threads in scale['threads']:
+        batch = factories.batch(scale['redemptions'])
+        codes = list(batch.codes.values_list('pk', flat=True))
+        timings, errors = [], []
+        lock = threading.Lock()
+
+        def redeem(chunk):
+            try:
+                for code_id in chunk:
+                    start = time.perf_counter()
+                    try:
+                        DownloadCode.objects.select_related('batch__work').get(pk=code_id).redeem()
+                    except DatabaseError as e:
+                        with lock:
+                            errors.append(repr(e))
+                        continue
+                    with lock:
+                        timings.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=redeem, args=(codes[index::threads],)) for index in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall_time = time.perf_counter() - start
+        results.append(result('redeem', {'threads': threads}, timings, wall_time,
+                              errors=len(errors)))
+        batch.work.delete()
+    return results
+
+
+@benchmark
+def download(scale):
+    """
+    Requests to DownloadView, reading the whole response body, for small and large files.
+    """
+    results = []
+    client = Client()
+    token = token_hex(16)
+    session = client.session
+    session['busker_download_token'] = token
+    session.save()
+    for size in scale['file_sizes']:
+        file = factories.file(size)
+        url = reverse('busker:download', kwargs={'file_id': file.pk}) + f"?t={token}"
+        iterations = scale['iterations'] if size < 2 ** 26 else 3
+        received = []
+        timings = timed(lambda: received.append(consume(client.get(url))), iterations)
+        assert received[-1] == size, f"Expected {size} bytes, received {received[-1]}"
+        results.append(result('download', {'bytes': size}, timings,
+                              mb_per_sec=round(size * iterations / sum(timings) / 2 ** 20, 2)))
+        file.work.delete()
+    return results
+
+
+@benchmark
+def csv_export(scale):
+    """
+    Exporting every code in a batch as CSV, as the admin's CSV actions do.
+    """
+    results = []
+    for size in scale['csv_sizes']:
+        batch = factories.batch(size)
+        queryset = DownloadCode.objects.filter(batch=batch)
+        timings = timed(lambda: consume(format_codes_csv(queryset)), 3)
+        results.append(result('csv_export', {'codes': size}, timings, rows_per_sec=round(size / min(timings))))
+        batch.work.delete()
+    return results
+
+
+#: The indexes added for query_plans' queries, and the index they replaced, by model
+PLAN_INDEXES = {
+    DownloadCode: ['busker_code_active_upper_idx', 'busker_code_batch_usage_idx', 'busker_code_last_used_idx',
+                   'busker_code_revoked_idx'],
+    Batch: ['busker_batch_created_idx'],
+    DownloadableWork: ['busker_work_published_idx'],
+}
+REPLACED_INDEX = models.Index(fields=['batch'], name='busker_bench_code_batch_idx')
+
+
+def set_plan_indexes(enabled):
+    """
+    Creates or drops busker's query indexes; while they are dropped, the plain index on DownloadCode.batch that
+    busker_code_batch_usage_idx replaced is recreated.
+    """
+    with connection.schema_editor() as editor:
+        for model, names in PLAN_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    (editor.add_index if enabled else editor.remove_index)(model, index)
+        (editor.remove_index if enabled else editor.add_index)(DownloadCode, REPLACED_INDEX)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+@benchmark
+def query_plans(scale):
+    """
+    busker's common queries (code validation, a batch's usable codes, recently used and revoked codes, the Batch
+    changelist and published works) against `plan_codes` codes, with and without busker's indexes. Each result
+    includes the query plan.
+    """
+    total = scale['plan_codes']
+    per_batch = max(total // 100, 1)
+    batches = [factories.batch() for _ in range(0, total, per_batch)]
+    for number, batch in enumerate(batches):
+        factories.sequential_codes(batch, number * per_batch, min((number + 1) * per_batch, total))
+    now = timezone.now()
+    # Use up a tenth of the codes, a hundredth of them recently, and revoke one in a thousand
+    DownloadCode.objects.filter(pk__lt=f"{total // 10:07d}").update(times_used=1, last_used_date=now - timedelta(90))
+    DownloadCode.objects.filter(pk__lt=f"{total // 100:07d}").update(last_used_date=now)
+    DownloadCode.objects.filter(pk__endswith='999').update(revoked=True)
+
+    batch = batches[len(batches) // 2]
+    code = f"{total // 2:07d}"
+    queries = {
+        'validate_code': lambda: valid_codes(code.lower()),
+        'batch_usable_codes': lambda: (DownloadCode.objects.filter(batch=batch, times_used__lt=models.F('max_uses'))
+                                       .order_by().values('pk')),
+        'recently_used_codes': lambda: DownloadCode.objects.filter(last_used_date__gte=now - timedelta(1)),
+        'revoked_codes': lambda: DownloadCode.objects.filter(revoked=True)[:100],
+        'batch_changelist': lambda: Batch.objects.select_related('work__artist')[:100],
+        'published_works': lambda: DownloadableWork.objects.filter(published=True)[:100],
+    }
+    results = []
+    for indexed in (False, True):
+        set_plan_indexes(indexed)
+        for name, queryset in queries.items():
+            timings = timed(lambda: list(queryset()), scale['iterations'])
+            results.append(result(f"query_plan_{name}", {'codes': total, 'indexed': indexed}, timings,
+                                  plan=queryset().explain()))
+    for batch in batches:
+        batch.work.delete()
+    return results
+
+
+def environment(scale_name):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SHOW server_version')
+        else:
+            cursor.execute('SELECT sqlite_version()')
+        database_version = cursor.fetchone()[0]
+    return {
+        'commit': commit,
+        'date': timezone.now().isoformat(),
+        'scale': scale_name,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'database_version': database_version,
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline):
+    """
+    Returns lines comparing the mean latency of each result to the matching result in a baseline run.
+    """
+    def key(item):
+        return item['name'], json.dumps(item['params'], sort_keys=True)
+    previous = {key(item): item for item in baseline['results']}
+    lines = [f"Compared with {baseline['environment'].get('commit') or 'baseline'}:"]
+    for item in results:
+        before = previous.get(key(item))
+        if before is None or not before['mean_ms']:
+            continue
+        change = (item['mean_ms'] - before['mean_ms']) / before['mean_ms'] * 100
+        lines.append(f"  {item['name']} {item['params']}: {before['mean_ms']}ms -> {item['mean_ms']}ms "
+                     f"({change:+.1f}%)")
+    return lines
+
+
+def run(names, scale_name):
+    scale = SCALES[scale_name]
+    results = []
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        results.extend(BENCHMARKS[name](scale))
+    return {'environment': environment(scale_name), 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs busker's benchmarks and writes the results as JSON.")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"Benchmarks to run (default: all). Choices: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--scale', choices=list(SCALES), default='full',
+                        help="Fixture sizes and iteration counts to use. (Default: full)")
+    parser.add_argument('--output', help="Write the results to this file instead of standard output.")
+    parser.add_argument('--compare', help="Print a comparison with the results in this file to standard error.")
+    options = parser.parse_args(argv)
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = run(options.benchmarks or list(BENCHMARKS), options.scale)
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if options.compare:
+        with open(options.compare) as f:
+            print('\n'.join(compare(report['results'], json.load(f))), file=sys.stderr)
+    return 0
@@ -1,6 +1,20 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models
+from django.http import Http404
+from django.template.defaultfilters import pluralize
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from . import deletion, profiling, rollups, webhooks
 from .formatters import format_codes_csv
 from .models import *
+from .paginators import EstimatedCountPaginator
 
 # TODO create admin models, make 'user' field read-only and default to currently logged-in user
 # TODO on Artist admin page, display related works
@@ -9,9 +23,161 @@ from .models import *
 # TODO make codes, batches, works filterable by artist and other related fields
 
 
-class BatchAdmin(admin.ModelAdmin):
-    list_display = ('__str__', 'private_note', 'work_published')
-    actions = ['download_as_csv',]
+def batch_stat(field, description):
+    """
+    Returns a sortable admin list view callback that displays one of a Batch's BatchStats fields.
+    """
+    def display(self, instance):
+        try:
+            return getattr(instance.stats, field)
+        except BatchStats.DoesNotExist:
+            return None
+    display.short_description = description
+    display.admin_order_field = f'stats__{field}'
+    return display
+
+
+def work_stat(field, description):
+    """
+    Returns a sortable admin list view callback that displays the total of one of the BatchStats fields across all of a
+    DownloadableWork's batches. (See DownloadableWorkAdmin.get_queryset)
+    """
+    def display(self, instance):
+        return getattr(instance, f'stats_{field}')
+    display.short_description = description
+    display.admin_order_field = f'stats_{field}'
+    return display
+
+
+class CodeActionForm(ActionForm):
+    """
+    Admin action form with an extra field for the value used by the 'max uses' bulk actions.
+    """
+    value = forms.IntegerField(required=False, min_value=0, label="Value",
+                               help_text="Used by the 'max uses' actions (0 = unlimited)")
+
+
+class BulkCodeActionsMixin:
+    """
+    Admin actions that change the DownloadCodes selected by (or belonging to the objects selected in) a changelist. Each
+    action is a single UPDATE over the selected codes; no DownloadCode objects are loaded. ModelAdmins using it define
+    selected_codes(queryset) and selected_batches(queryset), which return the codes and the batch IDs affected by an
+    action on the selected objects.
+    """
+    action_form = CodeActionForm
+    code_actions = ['set_max_uses', 'increase_max_uses', 'reset_times_used', 'revoke_codes', 'restore_codes']
+
+    def update_codes(self, request, queryset, codes, description, **changes):
+        count = codes.update(**changes)
+        BatchStats.rebuild(self.selected_batches(queryset))
+        self.message_user(request, f"{description} for {count} download code{pluralize(count)}.", messages.SUCCESS)
+
+    def get_action_value(self, request):
+        try:
+            value = self.action_form.base_fields['value'].clean(request.POST.get('value'))
+        except ValidationError:
+            value = None
+        if value is not None:
+            return value
+        self.message_user(request, "Please enter a value of 0 or more for this action.", messages.ERROR)
+        return None
+
+    def set_max_uses(self, request, queryset):
+        value = self.get_action_value(request)
+        if value is not None:
+            self.update_codes(request, queryset, self.selected_codes(queryset), f"Set max uses to {value}",
+                              max_uses=value)
+    set_max_uses.short_description = "Set max uses of download codes to [value]"
+
+    def increase_max_uses(self, request, queryset):
+        """
+        Increases max_uses by the given value; codes with unlimited (0) uses are left as they are.
+        """
+        value = self.get_action_value(request)
+        if value is not None:
+            codes = self.selected_codes(queryset).exclude(max_uses=0)
+            self.update_codes(request, queryset, codes, f"Increased max uses by {value}",
+                              max_uses=models.F('max_uses') + value)
+    increase_max_uses.short_description = "Increase max uses of download codes by [value]"
+
+    def reset_times_used(self, request, queryset):
+        self.update_codes(request, queryset, self.selected_codes(queryset), "Reset times used", times_used=0)
+    reset_times_used.short_description = "Reset times used of download codes to 0"
+
+    def revoke_codes(self, request, queryset):
+        self.update_codes(request, queryset, self.selected_codes(queryset).filter(revoked=False), "Revoked",
+                          revoked=True)
+    revoke_codes.short_description = "Revoke download codes"
+
+    def restore_codes(self, request, queryset):
+        self.update_codes(request, queryset, self.selected_codes(queryset).filter(revoked=True), "Restored",
+                          revoked=False)
+    restore_codes.short_description = "Restore revoked download codes"
+
+
+class FastDeleteMixin:
+    """
+    Deletes batches or works using busker.deletion, so that their codes are deleted in chunks (in the background for
+    large deletions), and summarizes what will be deleted on the confirmation page instead of listing every code.
+    ModelAdmins using it define get_batch_ids(objs), which returns the IDs of the batches deleted along with the given
+    objects, and delete(request, objs), which deletes the objects (by pk) with busker.deletion.
+    """
+    def deletion_counts(self, objs, batch_ids):
+        archived = ArchivedDownloadCode.objects.filter(batch__in=batch_ids).count()
+        return {
+            Batch: len(batch_ids),
+            # BatchStats counts archived codes too
+            DownloadCode: deletion.code_count(batch_ids) - archived,
+            ArchivedDownloadCode: archived,
+        }
+
+    def get_deleted_objects(self, objs, request):
+        batch_ids = self.get_batch_ids(objs)
+        counts = {self.model: len(objs), **self.deletion_counts(objs, batch_ids)}
+        model_count = {model._meta.verbose_name_plural: count for model, count in counts.items() if count}
+        perms_needed = {
+            model._meta.verbose_name for model in counts
+            if counts[model] and not request.user.has_perm(
+                f"{model._meta.app_label}.{get_permission_codename('delete', model._meta)}")
+        }
+        to_delete = [str(obj) for obj in objs]
+        return to_delete, model_count, perms_needed, []
+
+    def delete_model(self, request, obj):
+        self.delete(request, [obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        self.delete(request, queryset.values('pk'))
+
+    def background_message(self, request, thread):
+        if thread:
+            self.message_user(request, "There are a lot of codes to delete, so they are being deleted in the "
+                                       "background. It may take a few minutes to finish.", messages.WARNING)
+
+
+class BatchAdmin(FastDeleteMixin, BulkCodeActionsMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'private_note', 'work_published', 'codes_total', 'codes_used', 'redemptions',
+                    'codes_exhausted', 'last_redeemed_date')
+    list_select_related = ('work__artist', 'stats')
+    actions = ['download_as_csv', 'add_codes'] + BulkCodeActionsMixin.code_actions
+
+    codes_total = batch_stat('codes_total', "Codes")
+    codes_used = batch_stat('codes_used', "Codes used")
+    redemptions = batch_stat('redemptions', "Redemptions")
+    codes_exhausted = batch_stat('codes_exhausted', "Codes exhausted")
+    last_redeemed_date = batch_stat('last_redeemed_date', "Last redeemed")
+
+    def get_batch_ids(self, objs):
+        return [obj.pk for obj in objs]
+
+    def delete(self, request, objs):
+        self.background_message(request, deletion.delete_batches(objs))
+
+    def selected_codes(self, queryset):
+        return DownloadCode.objects.filter(batch__in=queryset.values('pk'))
+
+    def selected_batches(self, queryset):
+        return queryset.values('pk')
 
     def work_published(self, instance):
         """
@@ -20,23 +186,155 @@ class BatchAdmin(admin.ModelAdmin):
         return instance.work.published
     work_published.boolean = True
 
+    def add_codes(self, request, queryset):
+        """
+        Appends [value] new codes to each of the selected batches.
+        """
+        value = self.get_action_value(request)
+        if value == 0:
+            self.message_user(request, "Please enter the number of codes to add.", messages.ERROR)
+        elif value:
+            for batch in queryset:
+                batch.add_codes(value, user=request.user)
+            count = len(queryset)
+            self.message_user(request, f"Added {value} download code{pluralize(value)} to {count} "
+                                       f"batch{pluralize(count, 'es')}.", messages.SUCCESS)
+    add_codes.short_description = "Add [value] download codes to selected batches"
+
     def download_as_csv(self, request, queryset):
         """
         Given the first selected batch, look up all of its codes and return as a CSV.
         TODO: Support for multiple selected batches, or return an error if more than one is selected
         """
-        queryset = DownloadCode.objects.filter(batch__id__in=queryset.only('id'))
-        return format_codes_csv(queryset)
+        codes = DownloadCode.objects.filter(batch__id__in=queryset.only('id'))
+        return format_codes_csv(codes, archived=ArchivedDownloadCode.objects.filter(batch__id__in=queryset.only('id')))
     download_as_csv.short_description = "Export Download Codes for selected batches as CSV"
 
 
-class DownloadableWorkAdmin(admin.ModelAdmin):
-    list_display = ('__str__', 'published')
+class DownloadableWorkAdmin(FastDeleteMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'published', 'codes_total', 'codes_used', 'redemptions', 'codes_exhausted',
+                    'last_redeemed_date')
+
+    codes_total = work_stat('codes_total', "Codes")
+    codes_used = work_stat('codes_used', "Codes used")
+    redemptions = work_stat('redemptions', "Redemptions")
+    codes_exhausted = work_stat('codes_exhausted', "Codes exhausted")
+    last_redeemed_date = work_stat('last_redeemed_date', "Last redeemed")
+
+    def get_batch_ids(self, objs):
+        return list(Batch.objects.filter(work__in=[obj.pk for obj in objs]).values_list('pk', flat=True))
+
+    def deletion_counts(self, objs, batch_ids):
+        return {**super().deletion_counts(objs, batch_ids), File: File.objects.filter(work__in=objs).count()}
+
+    def delete(self, request, objs):
+        self.background_message(request, deletion.delete_works(objs))
+
+    def get_queryset(self, request):
+        """
+        Annotates each work with the totals of its batches' BatchStats.
+        """
+        return super().get_queryset(request).annotate(
+            stats_codes_total=models.Sum('batch__stats__codes_total'),
+            stats_codes_used=models.Sum('batch__stats__codes_used'),
+            stats_redemptions=models.Sum('batch__stats__redemptions'),
+            stats_codes_exhausted=models.Sum('batch__stats__codes_exhausted'),
+            stats_last_redeemed_date=models.Max('batch__stats__last_redeemed_date'),
+        )
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('usage/', self.admin_site.admin_view(self.usage_dashboard), name='%s_%s_usage' % info),
+        ] + super().get_urls()
+
+    def usage_dashboard(self, request):
+        """
+        Displays redemptions, downloads and bytes served per day, work, batch and file over the last `days` days
+        (default 30), optionally for a single `work`. Totals are read only from the daily usage rollups, so they are as
+        current as the last run of the busker_rollup_usage command.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            days = max(1, min(int(request.GET.get('days', 30)), 366))
+        except ValueError:
+            days = 30
+        since = timezone.localdate() - timedelta(days=days - 1)
+        totals = {'redemptions': models.Sum('redemptions'), 'downloads': models.Sum('downloads'),
+                  'bytes_served': models.Sum('bytes_served')}
+
+        works = DailyWorkUsage.objects.filter(date__gte=since)
+        batches = DailyBatchUsage.objects.filter(date__gte=since)
+        files = DailyFileUsage.objects.filter(date__gte=since)
+        work = None
+        if request.GET.get('work'):
+            try:
+                work_id = self.model._meta.pk.to_python(request.GET['work'])
+            except ValidationError:
+                raise Http404
+            work = DownloadableWork.objects.filter(pk=work_id).first()
+            works, batches, files = (qs.filter(work_id=work_id) for qs in (works, batches, files))
+
+        def ranked(queryset, field, model):
+            rows = list(queryset.order_by().values(field).annotate(**totals)
+                        .order_by('-downloads', '-redemptions')[:25])
+            objects = model.objects.in_bulk([row[field] for row in rows])
+            for row in rows:
+                row['object'] = objects.get(row[field])
+            return rows
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Usage for {work}" if work else "Usage",
+            'work': work,
+            'days': days,
+            'since': since,
+            'summary': works.aggregate(**totals),
+            'daily': works.order_by().values('date').annotate(**totals).order_by('-date'),
+            'top_works': None if work else ranked(works, 'work', DownloadableWork),
+            'top_batches': ranked(batches, 'batch', Batch),
+            'top_files': ranked(files, 'file', File),
+            'watermark': RollupWatermark.objects.filter(name=rollups.WATERMARK_NAME).first(),
+        }
+        return TemplateResponse(request, 'admin/busker/usage_dashboard.html', context)
+
+
+class DownloadCodeAdmin(BulkCodeActionsMixin, admin.ModelAdmin):
+    list_display = ('id', 'batch', 'max_uses', 'times_used', 'revoked', 'expires_at', 'work_published')
+    list_filter = ('revoked',)
+    list_select_related = ('batch__work__artist',)
+    # The codes table can grow to millions of rows; avoid COUNT(*) over all of them on every changelist page.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['download_as_csv'] + BulkCodeActionsMixin.code_actions
 
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('profiles/', self.admin_site.admin_view(self.request_profiles), name='%s_%s_profiles' % info),
+        ] + super().get_urls()
 
-class DownloadCodeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'batch', 'max_uses', 'times_used', 'work_published')
-    actions = ['download_as_csv',]
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {'profiling_enabled': profiling.enabled() and request.user.is_superuser,
+                         **(extra_context or {})}
+        return super().changelist_view(request, extra_context)
+
+    def request_profiles(self, request):
+        """
+        Displays the most recent request profiles recorded by busker.profiling.ProfilingMiddleware in this process.
+        """
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Request profiles",
+            'enabled': profiling.enabled(),
+            'profiles': [profile.as_dict() for profile in profiling.recent()],
+        }
+        return TemplateResponse(request, 'admin/busker/request_profiles.html', context)
 
     def work_published(self, instance):
         """
@@ -44,6 +342,31 @@ class DownloadCodeAdmin(admin.ModelAdmin):
         """
         return instance.batch.work.published
     work_published.boolean = True
+    work_published.admin_order_field = 'batch__work__published'
+
+    def selected_codes(self, queryset):
+        return queryset
+
+    def selected_batches(self, queryset):
+        return queryset.order_by().values('batch').distinct()
+
+    def save_model(self, request, obj, form, change):
+        previous_batch_id = getattr(obj, '_loaded_batch_id', None)
+        super().save_model(request, obj, form, change)
+        if change:
+            # Moving a code to another batch changes the stats of the batch it came from too
+            BatchStats.rebuild({obj.batch_id, previous_batch_id or obj.batch_id})
+            # Reactivate the code if its expiry date was extended (or deactivate it if it was brought forward)
+            DownloadCode.refresh_denormalised(DownloadCode.objects.filter(pk=obj.pk))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        BatchStats.rebuild([obj.batch_id])
+
+    def delete_queryset(self, request, queryset):
+        batch_ids = list(queryset.order_by().values_list('batch', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        BatchStats.rebuild(batch_ids)
 
     def download_as_csv(self, request, queryset):
         """
@@ -53,8 +376,81 @@ class DownloadCodeAdmin(admin.ModelAdmin):
     download_as_csv.short_description = "Export Selected Download Codes as CSV"
 
 
+class WebhookEndpointAdmin(admin.ModelAdmin):
+    list_display = ('url', 'active', 'send_redemptions', 'send_downloads', 'pending_events', 'failed_events')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            pending_count=models.Count('events', filter=models.Q(events__status=WebhookEvent.PENDING)),
+            failed_count=models.Count('events', filter=models.Q(events__status=WebhookEvent.DEAD)),
+        )
+
+    def pending_events(self, instance):
+        return instance.pending_count
+    pending_events.short_description = "Pending"
+    pending_events.admin_order_field = 'pending_count'
+
+    def failed_events(self, instance):
+        return instance.failed_count
+    failed_events.short_description = "Failed"
+    failed_events.admin_order_field = 'failed_count'
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'endpoint', 'event_type', 'status', 'attempts', 'created_date', 'next_attempt_date',
+                    'delivered_date')
+    list_filter = ('status', 'event_type')
+    list_select_related = ('endpoint',)
+    readonly_fields = ('event_id', 'endpoint', 'event_type', 'payload', 'created_date', 'status', 'attempts',
+                       'next_attempt_date', 'delivered_date', 'last_error')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['retry_events']
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_events(self, request, queryset):
+        """
+        Makes the selected events due for delivery again, with a fresh set of attempts.
+        """
+        count = webhooks.retry(queryset.exclude(status=WebhookEvent.DELIVERED))
+        self.message_user(request, f"{count} webhook event{pluralize(count)} will be retried.", messages.SUCCESS)
+    retry_events.short_description = "Retry selected webhook events"
+
+
+class ArchivedDownloadCodeAdmin(admin.ModelAdmin):
+    """
+    Read-only view of the codes moved out of the DownloadCode table by the busker_archive_codes command.
+    """
+    list_display = ('id', 'batch', 'max_uses', 'times_used', 'last_used_date', 'revoked', 'archived_date')
+    list_select_related = ('batch__work__artist',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['download_as_csv']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def download_as_csv(self, request, queryset):
+        """
+        Given a queryset of selected ArchivedDownloadCode objects, return them in a CSV file.
+        """
+        return format_codes_csv(queryset)
+    download_as_csv.short_description = "Export Selected Archived Download Codes as CSV"
+
+
 admin.site.register(File)
 admin.site.register(DownloadCode, DownloadCodeAdmin)
+admin.site.register(ArchivedDownloadCode, ArchivedDownloadCodeAdmin)
 admin.site.register(DownloadableWork, DownloadableWorkAdmin)
 admin.site.register(Artist)
 admin.site.register(Batch, BatchAdmin)
+admin.site.register(WebhookEndpoint, WebhookEndpointAdmin)
+admin.site.register(WebhookEvent, WebhookEventAdmin)
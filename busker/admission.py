@@ -0,0 +1,142 @@
+"""
+Contains admission control for busker's redemption and download views, to keep launch-day spikes from overwhelming
+the site's workers.
+
+Admission control is enabled by setting BUSKER_ADMISSION_ENABLED to True. The number of requests each kind of view
+handles at once is then limited by BUSKER_ADMISSION_LIMITS, a dict of limits for 'redeem' (RedeemView, default 100)
+and 'download' (DownloadView, default 50; a download counts until the file has been sent.) Requests over the limit
+get a 503 response with a Retry-After header and a small waiting page that retries automatically after
+BUSKER_ADMISSION_RETRY_AFTER seconds (default 5).
+
+Requests that continue a redemption already under way (i.e. confirming a code) have priority: the last
+BUSKER_ADMISSION_PRIORITY_SHARE (default 0.2) of each limit is kept for them, so that fans who have got as far as
+the confirmation page can finish redeeming their code even while new visitors are waiting.
+
+The number of requests in progress is counted in the BUSKER_ADMISSION_CACHE cache (default 'default'), which must be
+shared by all of the site's processes (e.g. Redis or Memcached) for the limits to apply site-wide. A count is reset
+when no request has been admitted for BUSKER_ADMISSION_COUNT_TIMEOUT seconds (default 300), so that requests lost by
+crashed processes aren't counted forever.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.shortcuts import render
+
+from . import metrics, profiling
+
+#: Default number of requests of each kind handled at once
+DEFAULT_LIMITS = {'redeem': 100, 'download': 50}
+
+
+def enabled():
+    return getattr(settings, 'BUSKER_ADMISSION_ENABLED', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'BUSKER_ADMISSION_CACHE', 'default')]
+
+
+def count_key(scope):
+    return f"busker:admission:{scope}"
+
+
+def limit(scope, priority=False):
+    """
+    Returns the number of requests of the given kind that may be in progress when admitting another one.
+    """
+    scope_limit = {**DEFAULT_LIMITS, **getattr(settings, 'BUSKER_ADMISSION_LIMITS', {})}[scope]
+    if priority:
+        return scope_limit
+    return scope_limit - int(scope_limit * getattr(settings, 'BUSKER_ADMISSION_PRIORITY_SHARE', 0.2))
+
+
+def acquire(scope, priority=False):
+    """
+    Counts a request of the given kind as in progress, if that keeps it within its limit. Returns whether it did.
+    """
+    cache = get_cache()
+    key = count_key(scope)
+    timeout = getattr(settings, 'BUSKER_ADMISSION_COUNT_TIMEOUT', 300)
+    cache.add(key, 0, timeout=timeout)
+    try:
+        count = cache.incr(key)
+    except ValueError:  # Expired between add() and incr()
+        cache.add(key, 1, timeout=timeout)
+        count = 1
+    else:
+        # Keep the count while requests are still being admitted, so it isn't reset under sustained load
+        cache.touch(key, timeout)
+    if count <= limit(scope, priority):
+        return True
+    release(scope)
+    return False
+
+
+def release(scope):
+    """
+    Counts a request of the given kind as no longer in progress.
+    """
+    cache = get_cache()
+    key = count_key(scope)
+    try:
+        if cache.decr(key) < 0:  # The count was reset while the request was in progress
+            cache.incr(key)
+    except ValueError:  # The count has been reset since the request was admitted
+        pass
+
+
+def in_progress(scope):
+    return get_cache().get(count_key(scope), 0)
+
+
+def waiting_page(request, scope):
+    """
+    Returns the response for a request turned away by admission control.
+    """
+    metrics.inc('busker_admission_rejected_total', scope=scope)
+    retry_after = getattr(settings, 'BUSKER_ADMISSION_RETRY_AFTER', 5)
+    with profiling.section('template'):
+        response = render(request, 'busker/waiting.html', {'retry_after': retry_after}, status=503)
+    response['Retry-After'] = retry_after
+    return response
+
+
+def _releasing(response, scope):
+    """
+    Releases the request's place when the response has been sent (and closed), so that downloads count until the
+    whole file has been streamed.
+    """
+    response._resource_closers.append(lambda: release(scope))
+    return response
+
+
+def admit(request, scope, get_response, priority=False):
+    """
+    Returns get_response() if the request is admitted, otherwise the waiting page.
+    """
+    if not enabled():
+        return get_response()
+    if not acquire(scope, priority):
+        return waiting_page(request, scope)
+    try:
+        response = get_response()
+    except BaseException:
+        release(scope)
+        raise
+    return _releasing(response, scope)
+
+
+async def aadmit(request, scope, get_response, priority=False):
+    """
+    Async version of admit(), for a coroutine function get_response.
+    """
+    if not enabled():
+        return await get_response()
+    if not await sync_to_async(acquire)(scope, priority):
+        return await sync_to_async(waiting_page)(request, scope)
+    try:
+        response = await get_response()
+    except BaseException:
+        await sync_to_async(release)(scope)
+        raise
+    return _releasing(response, scope)
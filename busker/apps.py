@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class BuskerConfig(AppConfig):
     name = 'busker'
+
+    def ready(self):
+        from . import events, fragments, webhooks  # Connects the usage event, fragment and webhook signal receivers
+        if getattr(settings, 'BUSKER_ACTIVITY_LOG_ASYNC', False):
+            from .util import start_activity_log_listener
+            start_activity_log_listener()
@@ -0,0 +1,85 @@
+"""
+Contains functions for moving DownloadCodes that can no longer be redeemed to the ArchivedDownloadCode table, and for
+sweeping expired codes.
+
+Most codes in a long-running deployment are fully used codes from old campaigns; archiving them keeps the DownloadCode
+table and its indexes small. Codes are archived a chunk at a time, each chunk copied and deleted in its own short
+transaction, so archiving can run alongside normal traffic (see the ``busker_archive_codes`` management command).
+Redeeming a code doesn't check the archive; only once validation has failed is the archive consulted, to tell the user
+that the code has already been redeemed (or has expired).
+
+Expired codes are rejected by validate_code() as soon as they expire, but remain in the partial index it uses until the
+``busker_expire_codes`` command deactivates them (clears is_active) or archives them, a grace period (default one day)
+after they expired.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ArchivedDownloadCode, DownloadCode
+
+
+def archivable_codes(min_age_days=30):
+    """
+    Returns a queryset of codes that can be archived: codes whose uses are exhausted, last used at least
+    `min_age_days` days ago (so that nobody is still partway through redeeming them), and codes that expired at least
+    `min_age_days` days ago.
+    """
+    cutoff = timezone.now() - timedelta(days=min_age_days)
+    return DownloadCode.objects.filter(Q(max_uses__gt=0, times_used__gte=F('max_uses'), last_used_date__lt=cutoff)
+                                       | Q(expires_at__lt=cutoff))
+
+
+def expired_codes(min_age_days=1):
+    """
+    Returns a queryset of codes that expired at least `min_age_days` days ago. Expired codes are rejected as soon as
+    they expire either way; leaving recently expired codes alone means that an expiry date set too early can still be
+    corrected by editing the batch.
+    """
+    return DownloadCode.objects.filter(expires_at__lte=timezone.now() - timedelta(days=min_age_days))
+
+
+def archive_chunk(codes, chunk_size):
+    """
+    Moves up to chunk_size of the given codes to the archive in a single transaction. Returns the number moved.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(codes.select_for_update(skip_locked=True).order_by()
+                    .values(*ArchivedDownloadCode.COPIED_FIELDS)[:chunk_size])
+        if not rows:
+            return 0
+        ArchivedDownloadCode.objects.bulk_create([ArchivedDownloadCode(archived_date=now, **row) for row in rows])
+        DownloadCode.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_codes(codes=None, chunk_size=1000):
+    """
+    Archives the given codes (default: archivable_codes()) a chunk at a time. Returns the number of codes archived.
+    """
+    codes = archivable_codes() if codes is None else codes
+    archived = 0
+    while True:
+        moved = archive_chunk(codes, chunk_size)
+        if not moved:
+            return archived
+        archived += moved
+
+
+def expire_codes(chunk_size=1000, min_age_days=1):
+    """
+    Deactivates codes that expired at least `min_age_days` days ago and are still active, a chunk at a time, each
+    chunk in its own short transaction so that no locks are held for long. Returns the number of codes deactivated.
+    """
+    deactivated = 0
+    while True:
+        with transaction.atomic():
+            pks = list(expired_codes(min_age_days).filter(is_active=True).select_for_update(skip_locked=True).order_by()
+                       .values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return deactivated
+            DownloadCode.objects.filter(pk__in=pks).update(is_active=False)
+        deactivated += len(pks)
@@ -0,0 +1,11 @@
+from django.urls import path
+from .async_views import AsyncRedeemView, AsyncRedeemFormView, AsyncDownloadView
+from .views import MetricsView
+
+app_name = 'busker'
+urlpatterns = [
+    path('redeem/<str:download_code>/', AsyncRedeemView.as_view(), name='redeem'),
+    path('', AsyncRedeemFormView.as_view(), name='redeem_form'),
+    path('download/<str:file_id>/', AsyncDownloadView.as_view(), name='download'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
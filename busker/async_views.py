@@ -0,0 +1,185 @@
+"""
+Async-native versions of busker's redemption and download views, for sites served over ASGI. Use them by including
+busker.async_urls instead of busker.urls. Requires Django 4.2 or later.
+
+Code validation, redemption and file lookups use the async ORM, and downloads are streamed from storage a block at a
+time without tying up a thread for the duration of the download, so a single worker can serve many slow clients at
+once. Work that is inherently synchronous is handed to a worker thread: loading the session (natively async on Django
+5.0 and later), template rendering (templates may follow relations lazily), opening and reading files, and sending the
+code_post_redeem and file_pre_download signals to their (synchronous) receivers.
+"""
+import logging
+import os
+import time
+from functools import partial
+from secrets import token_hex
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.views.generic import View
+
+from . import admission, dispatch, fragments, metrics, profiling, routers, throttling
+from .forms import AsyncRedeemCodeForm, ConfirmForm
+from .models import DownloadCode, File, acode_archived, avalidate_code, confirmable_codes
+from .signals import file_pre_download
+from .util import error_page, log_activity
+
+logger = logging.getLogger('busker.views')
+
+#: Size of the blocks files are streamed in
+CHUNK_SIZE = 256 * 1024
+
+
+async def aload_session(session):
+    """
+    Loads a session from its backend, so that it can then be read and written in an async view without blocking.
+    """
+    if hasattr(session, 'akeys'):  # Django 5.0+
+        await session.akeys()
+    else:
+        await sync_to_async(session.keys)()
+
+
+async def arender(request, template_name, context, status=200):
+    with profiling.section('template'):
+        return await sync_to_async(render)(request, template_name, context, status=status)
+
+
+async def aerror_page(request, status, title, message):
+    return await sync_to_async(error_page)(request, status, title, message)
+
+
+class AsyncRedeemView(View):
+    """
+    Async version of views.RedeemView
+    """
+    template_name = 'busker/confirm_form.html'
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.started = time.perf_counter()
+        throttled = await sync_to_async(throttling.check)(request, kwargs['download_code'])
+        if throttled:
+            return throttled
+        metrics.inc('busker_redeem_requests_total', method=request.method)
+        with metrics.timer('busker_redeem_request_seconds', method=request.method):
+            return await admission.aadmit(request, 'redeem', partial(super().dispatch, request, *args, **kwargs),
+                                          priority=request.method == 'POST')
+
+    async def get(self, request, *args, **kwargs):
+        """
+        Validates the code provided as URL argument
+        """
+        code = await avalidate_code(kwargs['download_code'])
+        if not code:
+            metrics.inc('busker_invalid_codes_total', source='redeem_view')
+            archived = await acode_archived(kwargs['download_code'])
+            if archived and archived.expired:
+                return await aerror_page(request, 404, "Code Expired",
+                                         f"The code {kwargs['download_code']} has expired.")
+            if archived:
+                return await aerror_page(request, 404, "Code Already Redeemed",
+                                         f"The code {kwargs['download_code']} has already been redeemed.")
+            return await aerror_page(request, 404, "Invalid Code",
+                                     f"The code {kwargs['download_code']} has already been redeemed or is not valid.")
+        return await self.render_form(ConfirmForm(initial={'code': code}), code)
+
+    async def post(self, request, *args, **kwargs):
+        """
+        Once the form has been submitted, increment the usage count and display the list of downloadable files.
+        """
+        form = ConfirmForm(request.POST)
+        if not form.is_valid():
+            return await self.render_form(form, None)
+        try:
+            code = await confirmable_codes(form.cleaned_data['code']).select_related('batch', 'work__artist').aget()
+        except DownloadCode.DoesNotExist:  # e.g. revoked since the form was displayed
+            return await aerror_page(request, 404, "Invalid Code",
+                                     f"The code {form.cleaned_data['code']} is no longer valid.")
+        await code.aredeem(request=request)
+        await aload_session(request.session)
+        # Save a token in the session which will subsequently be used to validate download links:
+        request.session['busker_download_token'] = token_hex(16)
+        # ...and the code, so that downloads can be attributed to it
+        request.session['busker_download_code'] = code.pk
+        request.session['busker_download_batch'] = str(code.batch_id)
+        log_activity(logger, code, "Code Redeemed", request, latency=time.perf_counter() - self.started)
+        with routers.use_replica():
+            return await arender(request, 'busker/file_list.html', {'code': code, 'view': self})
+
+    async def render_form(self, form, code):
+        with routers.use_replica():
+            return await arender(self.request, self.template_name, {'form': form, 'code': code, 'view': self})
+
+
+class AsyncRedeemFormView(View):
+    """
+    Async version of views.RedeemFormView
+    """
+    template_name = 'busker/redeem_form.html'
+
+    async def get(self, request, *args, **kwargs):
+        return await arender(request, self.template_name, {'form': AsyncRedeemCodeForm(), 'view': self})
+
+    async def post(self, request, *args, **kwargs):
+        throttled = await sync_to_async(throttling.check)(request, request.POST.get('code'))
+        if throttled:
+            return throttled
+        form = AsyncRedeemCodeForm(request.POST)
+        if not await form.avalidate():
+            return await arender(request, self.template_name, {'form': form, 'view': self})
+        return HttpResponseRedirect(reverse('busker:redeem', kwargs={'download_code': form.cleaned_data['code']}))
+
+
+def _open(file):
+    """
+    Opens a File for streaming, returning the open file, its size and its MIME type.
+    """
+    handle = file.file.open('rb')
+    return (handle, *fragments.file_metadata(file))
+
+
+async def _stream(handle):
+    read = sync_to_async(handle.read, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(handle.close, thread_sensitive=False)()
+
+
+class AsyncDownloadView(View):
+    """
+    Async version of views.DownloadView
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        return await admission.aadmit(request, 'download', partial(super().dispatch, request, *args, **kwargs))
+
+    async def get(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        await aload_session(request.session)
+        if 'busker_download_token' not in request.session \
+                or request.GET.get('t') != request.session['busker_download_token']:
+            return await aerror_page(request, 401, "Unauthorized",
+                                     "You do not have permission to access this resource.")
+
+        try:
+            file = await File.objects.aget(id=kwargs['file_id'])
+        except File.DoesNotExist:
+            return await aerror_page(request, 404, "No Such File", "The file you requested does not exist.")
+        log_activity(logger, file, "File Downloaded", request, latency=time.perf_counter() - started)
+
+        with profiling.section('file_pre_download'):
+            await sync_to_async(dispatch.send)(file_pre_download, sender=self.__class__, request=request, file=file)
+        handle, size, content_type = await sync_to_async(_open, thread_sensitive=False)(file)
+        response = StreamingHttpResponse(_stream(handle), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file.file.name)}"'
+        response['Content-Length'] = size
+        metrics.inc('busker_download_requests_total', work=file.work_id)
+        metrics.inc('busker_download_bytes_total', size, work=file.work_id)
+        return response
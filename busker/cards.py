@@ -0,0 +1,215 @@
+"""
+Contains functions for rendering printable download cards (QR codes of each code's redeem URI) for a Batch.
+
+QR encoding requires the optional ``qrcode`` package (``pip install django-busker[cards]``).
+"""
+import io
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import qrcode
+except ImportError:  # pragma: no cover
+    qrcode = None
+
+CARD_FORMATS = ('pdf', 'png')
+
+# Letter paper at 300dpi, in a 3x4 grid of 2.5" square cards.
+DEFAULT_LAYOUT = {
+    'dpi': 300,
+    'page_size': (8.5, 11),
+    'columns': 3,
+    'rows': 4,
+    'card_size': 2.5,
+}
+
+_CODE_PLACEHOLDER = '__busker_code__'
+
+
+def get_base_url(base_url=None):
+    """
+    Returns the scheme + host used to build absolute redeem URIs, either as given or from the BUSKER_BASE_URL setting.
+    """
+    base_url = base_url or getattr(settings, 'BUSKER_BASE_URL', None)
+    if not base_url:
+        raise ImproperlyConfigured("An absolute base URL is required to render download cards; set BUSKER_BASE_URL "
+                                   "(for example 'https://example.com') or pass base_url explicitly.")
+    return base_url.rstrip('/')
+
+
+def redeem_url_template(base_url=None):
+    """
+    Resolves the redeem URL once and returns a template string with a placeholder for the code, so that building URLs
+    for a large batch doesn't call reverse() once per code.
+    """
+    path = reverse('busker:redeem', kwargs={'download_code': _CODE_PLACEHOLDER})
+    return get_base_url(base_url) + path
+
+
+def build_redeem_url(template, code):
+    return template.replace(_CODE_PLACEHOLDER, code)
+
+
+def _load_font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # pragma: no cover (Pillow < 10.1 only ships a fixed-size bitmap font)
+        return ImageFont.load_default()
+
+
+def render_card_image(code, url, caption='', size=750):
+    """
+    Renders a single square card (QR code, with the code and an optional caption underneath) as a 1-bit PIL image.
+    Safe to call from a worker process; it does not touch the database or Django settings.
+    """
+    if qrcode is None:
+        raise ImproperlyConfigured("Rendering download cards requires the 'qrcode' package.")
+    text_height = size // 6
+    qr = qrcode.QRCode(border=2, error_correction=qrcode.constants.ERROR_CORRECT_M)
+    qr.add_data(url)
+    qr.make(fit=True)
+    qr_size = size - text_height
+    qr_image = qr.make_image(fill_color='black', back_color='white').get_image().convert('1')
+    qr_image = qr_image.resize((qr_size, qr_size), Image.NEAREST)
+
+    card = Image.new('1', (size, size), 1)
+    card.paste(qr_image, ((size - qr_size) // 2, 0))
+    draw = ImageDraw.Draw(card)
+    lines = [code] + ([caption] if caption else [])
+    font = _load_font(text_height // (len(lines) + 1))
+    y = qr_size
+    for line in lines:
+        draw.text((size // 2, y), line, fill=0, font=font, anchor='ma')
+        y += text_height // len(lines)
+    return card
+
+
+def render_card_png(job):
+    """
+    Process pool worker; given a (code, url, caption, size) tuple returns (code, PNG bytes).
+    """
+    code, url, caption, size = job
+    buffer = io.BytesIO()
+    render_card_image(code, url, caption, size).save(buffer, format='PNG', optimize=True)
+    return code, buffer.getvalue()
+
+
+def render_card_sheet(job):
+    """
+    Process pool worker; given a (cards, caption, layout) tuple, where cards is a list of (code, url) pairs, lays the
+    cards out on a single page and returns (width, height, raw 1-bit pixel data).
+    """
+    cards, caption, layout = job
+    dpi = layout['dpi']
+    page_width, page_height = (int(dimension * dpi) for dimension in layout['page_size'])
+    card_size = int(layout['card_size'] * dpi)
+    gutter_x = (page_width - layout['columns'] * card_size) // (layout['columns'] + 1)
+    gutter_y = (page_height - layout['rows'] * card_size) // (layout['rows'] + 1)
+
+    page = Image.new('1', (page_width, page_height), 1)
+    draw = ImageDraw.Draw(page)
+    for index, (code, url) in enumerate(cards):
+        row, column = divmod(index, layout['columns'])
+        left = gutter_x + column * (card_size + gutter_x)
+        top = gutter_y + row * (card_size + gutter_y)
+        page.paste(render_card_image(code, url, caption, card_size), (left, top))
+        # Light cut marks around each card
+        draw.rectangle((left - 1, top - 1, left + card_size, top + card_size), outline=0)
+    return page.width, page.height, page.tobytes()
+
+
+def _ordered_map(func, jobs, workers, max_pending):
+    """
+    Like Executor.map(), but only keeps max_pending jobs in flight at a time so that a very large (lazy) iterable of
+    jobs is never materialised all at once. With workers=0 the jobs are run serially in the current process.
+    """
+    if not workers:
+        yield from map(func, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(func, job))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def render_batch_cards(batch, card_format='pdf', base_url=None, workers=None, storage=None, name=None,
+                       pages_per_file=50, caption=None, layout=None):
+    """
+    Renders download cards for every code in a Batch and saves them to storage as a single ZIP archive, returning the
+    saved file's name and the number of cards rendered.
+
+    - ``card_format='pdf'``: print-ready sheets, split into PDFs of at most ``pages_per_file`` pages each
+    - ``card_format='png'``: one PNG image per code
+
+    Rendering is spread across a pool of ``workers`` processes (defaults to the machine's CPU count; 0 renders in the
+    current process). Codes are read from the database with a server-side iterator, at most a few pages are held in
+    memory at once and the archive is spooled to a temporary file, so memory use stays flat regardless of batch size.
+    """
+    if card_format not in CARD_FORMATS:
+        raise ValueError(f"card_format must be one of {', '.join(CARD_FORMATS)}")
+    if qrcode is None:
+        raise ImproperlyConfigured("Rendering download cards requires the 'qrcode' package.")
+    if workers is None:
+        workers = getattr(settings, 'BUSKER_CARD_WORKERS', None) or os.cpu_count() or 1
+    layout = dict(DEFAULT_LAYOUT, **(layout or {}))
+    caption = batch.work.title if caption is None else caption
+    template = redeem_url_template(base_url)
+    storage = storage or default_storage
+    name = name or f"busker/cards/{batch.id}.zip"
+    max_pending = max(workers, 1) * 4
+
+    codes = batch.codes.order_by('id').values_list('id', flat=True).iterator(chunk_size=2000)
+    rendered = 0
+
+    def counted():
+        nonlocal rendered
+        for code in codes:
+            rendered += 1
+            yield code, build_redeem_url(template, code)
+
+    cards = counted()
+
+    with tempfile.TemporaryFile() as spool:
+        with zipfile.ZipFile(spool, 'w', compression=zipfile.ZIP_STORED) as archive:
+            if card_format == 'png':
+                card_size = int(layout['card_size'] * layout['dpi'])
+                jobs = ((code, url, caption, card_size) for code, url in cards)
+                for code, png in _ordered_map(render_card_png, jobs, workers, max_pending):
+                    archive.writestr(f"{code}.png", png)
+            else:
+                per_page = layout['columns'] * layout['rows']
+                jobs = ((page, caption, layout) for page in _chunked(cards, per_page))
+                sheets = _ordered_map(render_card_sheet, jobs, workers, max_pending)
+                for file_number, pages in enumerate(_chunked(sheets, pages_per_file), start=1):
+                    images = [Image.frombytes('1', (width, height), data) for width, height, data in pages]
+                    buffer = io.BytesIO()
+                    images[0].save(buffer, format='PDF', save_all=True, append_images=images[1:],
+                                   resolution=layout['dpi'])
+                    archive.writestr(f"cards-{file_number:04d}.pdf", buffer.getvalue())
+        spool.seek(0)
+        return storage.save(name, DjangoFile(spool)), rendered
@@ -0,0 +1,103 @@
+"""
+Contains functions for deleting batches and works with large numbers of codes.
+
+Deleting a Batch or DownloadableWork with Model.delete() or QuerySet.delete() makes Django's deletion collector load
+every related DownloadCode into memory before deleting it, which can take minutes and gigabytes for large batches.
+delete_batches() and delete_works() instead delete the codes (and archived codes) first, with a DELETE per chunk of
+BUSKER_DELETE_CHUNK_SIZE codes (default 5000), and then delete the batches or works themselves with Django's usual
+collector, which now has only a few rows left to collect, so that delete signals still fire for files, batch
+statistics and anything else that listens for them.
+
+Deletions of at least BUSKER_BACKGROUND_DELETE_THRESHOLD codes (default 100000, according to the batches' BatchStats)
+run in a background thread once the current transaction commits, so that the admin doesn't block while they run.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+
+from .models import ArchivedDownloadCode, Batch, BatchStats, DownloadableWork, DownloadCode
+
+logger = logging.getLogger(__name__)
+
+
+def code_count(batch_ids):
+    """
+    Returns the number of codes in the given batches, according to their BatchStats (so without counting them.)
+    """
+    return BatchStats.objects.filter(batch__in=batch_ids).aggregate(total=models.Sum('codes_total'))['total'] or 0
+
+
+def delete_codes(batch_ids, chunk_size=None):
+    """
+    Deletes the codes and archived codes of the given batches, one chunk per DELETE. Returns the number deleted.
+    """
+    chunk_size = chunk_size or getattr(settings, 'BUSKER_DELETE_CHUNK_SIZE', 5000)
+    deleted = 0
+    for model in (DownloadCode, ArchivedDownloadCode):
+        while True:
+            pks = list(model.objects.filter(batch__in=batch_ids).order_by().values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                break
+            # Nothing cascades from codes, so this is a single DELETE without loading the codes
+            model.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+    return deleted
+
+
+def _run(description, func, *args):
+    """
+    Runs func in a background thread once the current transaction commits. Returns the thread.
+    """
+    def target():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Background deletion of %s failed", description)
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=target, name='busker-delete', daemon=False)
+    transaction.on_commit(thread.start)
+    return thread
+
+
+def _delete_batches(batch_ids):
+    delete_codes(batch_ids)
+    Batch.objects.filter(pk__in=batch_ids).delete()
+
+
+def _delete_works(work_ids):
+    delete_codes(list(Batch.objects.filter(work__in=work_ids).values_list('pk', flat=True)))
+    DownloadableWork.objects.filter(pk__in=work_ids).delete()
+
+
+def in_background(batch_ids):
+    return code_count(batch_ids) >= getattr(settings, 'BUSKER_BACKGROUND_DELETE_THRESHOLD', 100000)
+
+
+def delete_batches(batches, background=None):
+    """
+    Deletes the given batches (a queryset or list of Batch IDs) and their codes. If background is None, large
+    deletions are run in the background (see above.) Returns the background thread, if any.
+    """
+    batch_ids = list(Batch.objects.filter(pk__in=batches).values_list('pk', flat=True))
+    if background is None:
+        background = in_background(batch_ids)
+    if background:
+        return _run(f"{len(batch_ids)} batches", _delete_batches, batch_ids)
+    _delete_batches(batch_ids)
+
+
+def delete_works(works, background=None):
+    """
+    Deletes the given works (a queryset or list of DownloadableWork IDs), their batches, codes and files. If background
+    is None, large deletions are run in the background (see above.) Returns the background thread, if any.
+    """
+    work_ids = list(DownloadableWork.objects.filter(pk__in=works).values_list('pk', flat=True))
+    if background is None:
+        background = in_background(Batch.objects.filter(work__in=work_ids).values('pk'))
+    if background:
+        return _run(f"{len(work_ids)} works", _delete_works, work_ids)
+    _delete_works(work_ids)
@@ -0,0 +1,145 @@
+"""
+Contains the dispatcher used to send busker's code_post_redeem and file_pre_download signals.
+
+By default (BUSKER_SIGNAL_DISPATCH = 'sync') signals are sent synchronously, exactly as Signal.send() would, so
+receivers run inside the request and any exception they raise propagates. With BUSKER_SIGNAL_DISPATCH = 'thread',
+signals are instead delivered after the current transaction commits, by a pool of BUSKER_SIGNAL_WORKERS background
+threads (default 4), so slow receivers (CRM syncs, emails, analytics) no longer add to the user's wait. Exceptions
+raised by receivers are logged to the busker.dispatch logger rather than propagated.
+
+The pool's queue holds at most BUSKER_SIGNAL_QUEUE_SIZE signals (default 1000). When it is full, the signal is
+delivered synchronously in the sending thread instead, which slows requests down rather than letting the backlog grow
+without limit or dropping signals.
+
+busker's own receivers (which write usage events and the webhook outbox) are registered with the receiver() decorator
+below rather than connected to the signals, and are always called synchronously, in the sending thread and
+transaction, whichever mode is used.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+#: Signal: list of busker's own receivers for it
+_internal_receivers = {}
+
+
+def receiver(signal):
+    """
+    Decorator registering one of busker's own receivers for a signal, which send() calls synchronously.
+    """
+    def decorator(func):
+        _internal_receivers.setdefault(signal, []).append(func)
+        return func
+    return decorator
+
+
+def mode():
+    return getattr(settings, 'BUSKER_SIGNAL_DISPATCH', 'sync')
+
+
+def deliver(signal, sender, kwargs):
+    """
+    Sends a signal to all of its receivers, logging (rather than raising) any exceptions they raise.
+    """
+    for receiver, response in signal.send_robust(sender=sender, **kwargs):
+        if isinstance(response, Exception):
+            logger.error("Signal receiver %r failed", receiver,
+                         exc_info=(type(response), response, response.__traceback__))
+
+
+class Dispatcher:
+    """
+    A bounded queue of signals waiting to be sent, and the worker threads that send them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._queue = queue.Queue(maxsize=getattr(settings, 'BUSKER_SIGNAL_QUEUE_SIZE', 1000))
+            for index in range(getattr(settings, 'BUSKER_SIGNAL_WORKERS', 4)):
+                thread = threading.Thread(target=self._work, name=f'busker-dispatch-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, signal, sender, kwargs):
+        self.start()
+        try:
+            self._queue.put_nowait((signal, sender, kwargs))
+        except queue.Full:
+            logger.warning("Signal dispatch queue is full; sending %r synchronously", signal)
+            deliver(signal, sender, kwargs)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                deliver(*item)
+            except Exception:
+                logger.exception("Could not deliver signal")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def join(self):
+        """
+        Waits until every queued signal has been delivered.
+        """
+        if self._queue is not None:
+            self._queue.join()
+
+    def stop(self):
+        """
+        Delivers any queued signals, then stops the worker threads.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            for _ in threads:
+                self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+dispatcher = Dispatcher()
+atexit.register(dispatcher.stop)
+
+
+def send_internal(signal, sender, **kwargs):
+    """
+    Calls busker's own receivers for the signal.
+    """
+    for func in _internal_receivers.get(signal, ()):
+        func(sender=sender, signal=signal, **kwargs)
+
+
+def send_external(signal, sender, **kwargs):
+    """
+    Sends the signal to its connected receivers according to the BUSKER_SIGNAL_DISPATCH setting. Returns their
+    responses when sending synchronously, or an empty list when the signal has been queued.
+    """
+    if mode() != 'thread':
+        return signal.send(sender=sender, **kwargs)
+    transaction.on_commit(lambda: dispatcher.submit(signal, sender, kwargs))
+    return []
+
+
+def send(signal, sender, **kwargs):
+    """
+    Calls busker's own receivers for the signal, then sends it to any other receivers (see send_external().)
+    """
+    send_internal(signal, sender, **kwargs)
+    return send_external(signal, sender, **kwargs)
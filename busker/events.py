@@ -0,0 +1,138 @@
+"""
+Contains the buffered writer for busker's append-only UsageEvent table.
+
+Events are only recorded when the BUSKER_EVENTS_ENABLED setting is True. Rather than inserting one row per request,
+events are collected in memory and written with a single bulk_create() by a background thread, once
+BUSKER_EVENT_BUFFER_SIZE events (default 100) have been collected or once the oldest buffered event is
+BUSKER_EVENT_FLUSH_INTERVAL milliseconds old (default 1000), whichever comes first. Any buffered events are written
+when the process exits.
+
+Events are recorded by busker's own receivers of the code_post_redeem and file_pre_download signals, which are
+registered when the app is ready and always run synchronously (see busker.dispatch). An event is only buffered once
+the transaction it was recorded in has been committed, and is never written by the request's own thread, so a
+redemption is neither slowed down nor rolled back by writing events, and isn't recorded if it is itself rolled back.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from . import dispatch
+from .models import UsageEvent
+from .signals import code_post_redeem, file_pre_download
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return getattr(settings, 'BUSKER_EVENTS_ENABLED', False)
+
+
+class EventBuffer:
+    """
+    Thread-safe buffer of unsaved UsageEvent objects, written by a worker thread that runs while there are events in
+    the buffer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._events = []
+        self._oldest = None
+        self._worker = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, event):
+        buffer_size = getattr(settings, 'BUSKER_EVENT_BUFFER_SIZE', 100)
+        with self._lock:
+            self._events.append(event)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._events) >= buffer_size:
+                self._wakeup.set()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='busker-events', daemon=True)
+                self._worker.start()
+
+    def flush(self):
+        """
+        Writes all buffered events to the database with one bulk_create(). Returns the number of events written.
+        """
+        with self._lock:
+            events, self._events, self._oldest = self._events, [], None
+        self._wakeup.set()  # Lets the worker see that the buffer is empty
+        if not events:
+            return 0
+        try:
+            UsageEvent.objects.bulk_create(events)
+        except DatabaseError:
+            logger.exception("Could not save %d busker usage events", len(events))
+            return 0
+        return len(events)
+
+    def _run(self):
+        """
+        Worker thread; flushes the buffer whenever it is full or its oldest event is due, until it is empty.
+        """
+        try:
+            while True:
+                buffer_size = getattr(settings, 'BUSKER_EVENT_BUFFER_SIZE', 100)
+                interval = getattr(settings, 'BUSKER_EVENT_FLUSH_INTERVAL', 1000) / 1000
+                with self._lock:
+                    if not self._events:
+                        self._worker = None
+                        return
+                    wait = self._oldest + interval - time.monotonic()
+                    due = len(self._events) >= buffer_size or wait <= 0
+                    self._wakeup.clear()
+                if due:
+                    self.flush()
+                else:
+                    self._wakeup.wait(wait)
+        finally:
+            connection.close()  # This thread's own connection
+
+
+buffer = EventBuffer()
+atexit.register(buffer.flush)
+
+
+def record_redemption(code):
+    """
+    Buffers a UsageEvent for a DownloadCode that has just been redeemed.
+    """
+    if not enabled():
+        return
+    event = UsageEvent(event_type=UsageEvent.REDEMPTION, timestamp=code.last_used_date or timezone.now(),
+                       work_id=code.work_id, batch_id=code.batch_id, code_id=code.pk)
+    transaction.on_commit(lambda: buffer.add(event))
+
+
+def record_download(file, request=None):
+    """
+    Buffers a UsageEvent for a File that is about to be downloaded. The code and batch are taken from the session, if
+    the code was redeemed in this session.
+    """
+    if not enabled():
+        return
+    session = getattr(request, 'session', {})
+    event = UsageEvent(event_type=UsageEvent.DOWNLOAD, timestamp=timezone.now(), work_id=file.work_id,
+                       batch_id=session.get('busker_download_batch'), code_id=session.get('busker_download_code'),
+                       file_id=file.pk, bytes=file.file.size)
+    transaction.on_commit(lambda: buffer.add(event))
+
+
+@dispatch.receiver(code_post_redeem)
+def code_redeemed(sender, code, **kwargs):
+    record_redemption(code)
+
+
+@dispatch.receiver(file_pre_download)
+def file_downloaded(sender, file, request=None, **kwargs):
+    record_download(file, request)
@@ -5,10 +5,11 @@ Contains functions for formatting Busker data for export
 from djqscsv import render_to_csv_response
 
 
-def format_codes_csv(query_set):
+def format_codes_csv(query_set, archived=None):
     """
     Given a QuerySet of DownloadCode objects, format it as a CSV file. Returns an HttpResponse object containing a
-    CSV file as an attachment.
+    CSV file as an attachment. If a QuerySet of ArchivedDownloadCode objects is given as well, they're included after
+    the DownloadCodes.
     """
     header_map = {
         'id': 'download_code',
@@ -28,8 +29,10 @@ def format_codes_csv(query_set):
         'batch__created_date': (lambda x: x.strftime('%Y/%m/%d')),
     }
 
-    return render_to_csv_response(query_set.values('id', 'created_date', 'batch__work__artist__name',
-                                                   'batch__work__title', 'max_uses', 'times_used', 'last_used_date',
-                                                   'batch__label', 'batch__private_note', 'batch__created_date',
-                                                   'batch__id', 'batch__work__artist__id', 'batch__work__id'),
-                                  field_header_map=header_map, field_serializer_map=serializer_map)
+    fields = ('id', 'created_date', 'batch__work__artist__name', 'batch__work__title', 'max_uses', 'times_used',
+              'last_used_date', 'batch__label', 'batch__private_note', 'batch__created_date', 'batch__id',
+              'batch__work__artist__id', 'batch__work__id')
+    rows = query_set.values(*fields)
+    if archived is not None:
+        rows = rows.order_by().union(archived.values(*fields).order_by(), all=True)
+    return render_to_csv_response(rows, field_header_map=header_map, field_serializer_map=serializer_map)
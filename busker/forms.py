@@ -1,6 +1,7 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import validate_code
+from . import metrics
+from .models import acode_archived, avalidate_code, code_archived, validate_code
 
 
 class ConfirmForm(forms.Form):
@@ -14,6 +15,17 @@ class ConfirmForm(forms.Form):
     # user can just continue on their way.
 
 
+INVALID_CODE_MESSAGE = "The code you entered is not valid, or has already been redeemed."
+REDEEMED_CODE_MESSAGE = "The code you entered has already been redeemed."
+EXPIRED_CODE_MESSAGE = "The code you entered has expired."
+
+
+def archived_code_message(archived):
+    if not archived:
+        return INVALID_CODE_MESSAGE
+    return EXPIRED_CODE_MESSAGE if archived.expired else REDEEMED_CODE_MESSAGE
+
+
 class RedeemCodeForm(forms.Form):
     code = forms.CharField(max_length=7, label="Enter Your Download Code Here")
     code_object = None
@@ -25,6 +37,33 @@ class RedeemCodeForm(forms.Form):
         submitted_code = self.cleaned_data['code']
         validated_code = validate_code(submitted_code)
         if validated_code is False:
-            raise ValidationError("The code you entered is not valid, or has already been redeemed.")
+            metrics.inc('busker_invalid_codes_total', source='redeem_form')
+            raise ValidationError(archived_code_message(code_archived(submitted_code)))
         self.code_object = validated_code
         return submitted_code
+
+
+class AsyncRedeemCodeForm(RedeemCodeForm):
+    """
+    RedeemCodeForm for async views. Cleaning the form only checks the code's format (cleaning can't query the database
+    from an async view); await avalidate() to check the code itself.
+    """
+
+    def clean_code(self):
+        return self.cleaned_data['code']
+
+    async def avalidate(self):
+        """
+        Returns True if the form is valid and the code entered is valid, otherwise adds an error to the form and returns
+        False.
+        """
+        if not self.is_valid():
+            return False
+        validated_code = await avalidate_code(self.cleaned_data['code'])
+        if validated_code is False:
+            metrics.inc('busker_invalid_codes_total', source='redeem_form')
+            archived = await acode_archived(self.cleaned_data['code'])
+            self.add_error('code', ValidationError(archived_code_message(archived)))
+            return False
+        self.code_object = validated_code
+        return True
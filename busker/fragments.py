@@ -0,0 +1,128 @@
+"""
+Contains a cache of the parts of busker's pages that are the same for every code of a work or batch.
+
+The confirmation page and file list are rendered on every redemption, but most of them only depends on the work or
+batch: the work's thumbnail (resolving its URL makes imagekit check its cache file in storage), the batch's public
+message and the list of the work's files (a query per redemption.) These fragments are rendered once and kept in the
+BUSKER_FRAGMENT_CACHE cache (default 'default'; set it to None to disable caching) for
+BUSKER_FRAGMENT_CACHE_TIMEOUT seconds (default 3600), so that only the code-specific parts of a page are rendered per
+request. They are used through the template tags in busker.templatetags.busker_tags.
+
+Fragments are also kept in an in-process LocalCache (holding up to BUSKER_LOCAL_CACHE_SIZE fragments, default 1000),
+so that most pages don't need to fetch them from a shared cache at all.
+
+Each fragment is stored along with the modified_date and generation (see busker.generations) of the object it was
+rendered from, and is re-rendered if they don't match the object's when it is used. The receivers below bump a work's
+or batch's generation, and delete its fragments from the shared cache, when it or one of the work's files is saved or
+deleted, so that changes made on one server take effect on every server straight away. Concurrent misses for the
+same fragment are coalesced (see busker.singleflight), so only one of them renders it.
+
+file_metadata() caches the size and MIME type of downloadable files in the same way, which saves opening each file to
+detect its type on every download.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+import magic
+
+from . import generations, profiling, singleflight
+from .models import Batch, DownloadableWork, File
+
+#: Stands in for the session's download token in the cached file list, which is the same for every session
+TOKEN_PLACEHOLDER = '__busker_download_token__'
+
+#: Fragment names, with the template each is rendered from and whether it is for a work or a batch
+FRAGMENTS = {
+    'work_thumbnail': ('busker/fragments/work_thumbnail.html', DownloadableWork),
+    'batch_message': ('busker/fragments/batch_message.html', Batch),
+    'file_list': ('busker/fragments/file_list.html', DownloadableWork),
+}
+
+#: Fragments cached by this process
+local_cache = generations.LocalCache()
+
+
+def get_cache():
+    alias = getattr(settings, 'BUSKER_FRAGMENT_CACHE', 'default')
+    return caches[alias] if alias else None
+
+
+def fragment_key(name, pk):
+    return f"busker:fragment:{name}:{pk}"
+
+
+def render(name, instance):
+    """
+    Returns the named fragment for the given work or batch, from the cache if it's there and up to date.
+    """
+    template_name, model = FRAGMENTS[name]
+    cache = get_cache()
+    if not cache:
+        return mark_safe(_render(template_name, model, instance))
+    key = fragment_key(name, instance.pk)
+    version = (instance.modified_date, generations.get(model, instance.pk))
+    html = local_cache.get(key, version)
+    if html is not None:
+        return mark_safe(html)
+    html = singleflight.get_or_load(cache, key, lambda: (version, _render(template_name, model, instance)),
+                                    lambda cached: cached is not None and cached[0] == version,
+                                    getattr(settings, 'BUSKER_FRAGMENT_CACHE_TIMEOUT', 3600))[1]
+    local_cache.set(key, version, html)
+    return mark_safe(html)
+
+
+def _render(template_name, model, instance):
+    with profiling.section('fragment'):
+        return render_to_string(template_name, {model._meta.model_name: instance, 'token': TOKEN_PLACEHOLDER})
+
+
+def file_metadata(file):
+    """
+    Returns a (size, MIME type) tuple for a File, from the cache if it's there and up to date.
+    """
+    cache = get_cache()
+    if not cache:
+        return _file_metadata(file)
+    key = f"busker:file:{file.pk}"
+    version = (file.modified_date, file.file.name)
+    return singleflight.get_or_load(cache, key, lambda: (version, _file_metadata(file)),
+                                    lambda cached: cached is not None and cached[0] == version,
+                                    getattr(settings, 'BUSKER_FRAGMENT_CACHE_TIMEOUT', 3600))[1]
+
+
+def _file_metadata(file):
+    return file.file.size, magic.Magic(mime=True).from_file(file.file.path)
+
+
+def invalidate(model, pks):
+    """
+    Invalidates the cached fragments of the given works or batches (by pk), in every process.
+    """
+    cache = get_cache()
+    if cache:
+        generations.bump(model, pks)
+        cache.delete_many([fragment_key(name, pk) for pk in pks
+                           for name, (template_name, fragment_model) in FRAGMENTS.items() if fragment_model is model])
+
+
+@receiver(post_save, sender=DownloadableWork)
+@receiver(post_delete, sender=DownloadableWork)
+@receiver(post_save, sender=Batch)
+@receiver(post_delete, sender=Batch)
+def object_changed(sender, instance, **kwargs):
+    """
+    post_save and post_delete receiver for works and batches; deletes their cached fragments.
+    """
+    invalidate(sender, [instance.pk])
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def file_changed(sender, instance, **kwargs):
+    """
+    post_save and post_delete receiver for File objects; deletes the cached fragments of the file's work.
+    """
+    invalidate(DownloadableWork, [instance.work_id])
@@ -0,0 +1,88 @@
+"""
+Contains generation counters for keeping in-process caches coherent across processes and servers.
+
+Each work and batch has a generation counter in the BUSKER_GENERATION_CACHE cache (default 'default'), which must be
+shared by all of the site's processes (e.g. Redis or Memcached) for this to work across them. bump() increments an
+object's counter whenever it changes (busker.fragments does so from its signal receivers), and LocalCache stores
+values together with the generation of the object they were built from, so a value cached in one process is ignored
+everywhere as soon as any process bumps the generation, at the cost of one cache read per lookup and without
+broadcasting the change to each process.
+
+Counters that are missing from the cache (never bumped, expired or evicted) start again from the current time in
+nanoseconds rather than from zero, so that an old generation can't become current again.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_cache():
+    return caches[getattr(settings, 'BUSKER_GENERATION_CACHE', 'default')]
+
+
+def generation_key(model, pk):
+    return f"busker:generation:{model._meta.model_name}:{pk}"
+
+
+def get(model, pk):
+    """
+    Returns the current generation of the given work or batch (by model and pk).
+    """
+    cache = get_cache()
+    key = generation_key(model, pk)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump(model, pks):
+    """
+    Increments the generations of the given works or batches (by pk), invalidating everything cached from them.
+    """
+    cache = get_cache()
+    for pk in pks:
+        key = generation_key(model, pk)
+        # Adding first (a no-op if the counter exists) means the increment can't be lost to another process starting
+        # the counter at the same time
+        cache.add(key, time.time_ns(), timeout=None)
+        cache.incr(key)
+
+
+class LocalCache:
+    """
+    A size-limited, in-process cache of values that are only returned while the version they were stored with (e.g. an
+    object's generation and modified date) is still current. Least-recently used values are dropped when it is full.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, value):
+        max_size = self.max_size or getattr(settings, 'BUSKER_LOCAL_CACHE_SIZE', 1000)
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
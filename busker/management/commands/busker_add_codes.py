@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from busker.models import Batch
+
+
+class Command(BaseCommand):
+    help = "Appends new download codes to an existing batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_id', help="The ID of the Batch to add codes to.")
+        parser.add_argument('count', type=int, help="The number of codes to add.")
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError("count must be at least 1.")
+        try:
+            batch = Batch.objects.get(pk=options['batch_id'])
+        except (Batch.DoesNotExist, ValueError):
+            raise CommandError(f"Batch {options['batch_id']} does not exist.")
+        created = batch.add_codes(options['count'])
+        self.stdout.write(f"Added {created} codes to batch {batch.id}; it now has {batch.number_of_codes} codes.")
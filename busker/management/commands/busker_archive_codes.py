@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from busker.archive import archivable_codes, archive_codes
+
+
+class Command(BaseCommand):
+    help = "Moves codes whose uses are exhausted to the archive table, a chunk at a time. Archived codes are still " \
+           "shown in the admin and exports, and are reported as already redeemed if entered again."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of codes to archive per transaction. (Default: 1000)")
+        parser.add_argument('--min-age', type=int, default=30,
+                            help="Only archive codes last used at least this many days ago. (Default: 30)")
+
+    def handle(self, *args, **options):
+        archived = archive_codes(archivable_codes(options['min_age']), chunk_size=options['chunk_size'])
+        self.stdout.write(f"Archived {archived} code{'s' if archived != 1 else ''}.")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from busker.webhooks import deliver_webhooks
+
+
+class Command(BaseCommand):
+    help = "Delivers pending webhook events to their endpoints. Run it on a schedule, or continuously with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running, checking for due events every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to wait between checks when running with --loop. (Default: 5)")
+
+    def handle(self, *args, **options):
+        while True:
+            delivered, failed = deliver_webhooks()
+            if delivered or failed or not options['loop']:
+                self.stdout.write(f"Delivered {delivered} webhook event{'s' if delivered != 1 else ''}; "
+                                  f"{failed} failed.")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
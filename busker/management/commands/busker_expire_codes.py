@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from busker.archive import archive_codes, expire_codes, expired_codes
+
+
+class Command(BaseCommand):
+    help = "Deactivates (or with --archive, archives) codes whose expiry date has passed, a chunk at a time. " \
+           "Expired codes can't be redeemed either way; this keeps them out of the index used to validate codes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', action='store_true',
+                            help="Move expired codes to the archive table instead of deactivating them.")
+        parser.add_argument('--min-age', type=int, default=1,
+                            help="Only update codes that expired at least this many days ago. (Default: 1)")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of codes to update per transaction. (Default: 1000)")
+
+    def handle(self, *args, **options):
+        if options['archive']:
+            count = archive_codes(expired_codes(options['min_age']), chunk_size=options['chunk_size'])
+            action = "Archived"
+        else:
+            count = expire_codes(chunk_size=options['chunk_size'], min_age_days=options['min_age'])
+            action = "Deactivated"
+        self.stdout.write(f"{action} {count} expired code{'s' if count != 1 else ''}.")
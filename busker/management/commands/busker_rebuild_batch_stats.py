@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from busker.models import Batch, BatchStats
+
+
+class Command(BaseCommand):
+    help = ("Recalculates the redemption statistics shown in the Batch and DownloadableWork admin from the batches' "
+            "codes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_ids', nargs='*', help="IDs of the batches to rebuild. (Default: all batches)")
+
+    def handle(self, *args, **options):
+        batches = options['batch_ids'] or None
+        BatchStats.rebuild(batches)
+        count = len(batches) if batches else Batch.objects.count()
+        self.stdout.write(f"Rebuilt statistics for {count} batch{'es' if count != 1 else ''}.")
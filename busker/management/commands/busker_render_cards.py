@@ -0,0 +1,30 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from busker.cards import CARD_FORMATS, render_batch_cards
+from busker.models import Batch
+
+
+class Command(BaseCommand):
+    help = "Renders printable QR-code download cards for every code in a batch and saves them to storage as a ZIP."
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_id', help="The ID of the Batch to render cards for.")
+        parser.add_argument('--format', dest='card_format', choices=CARD_FORMATS, default='pdf',
+                            help="'pdf' for print-ready sheets, 'png' for one image per code. (Default: pdf)")
+        parser.add_argument('--base-url', help="Scheme and host for the redeem URIs. (Default: BUSKER_BASE_URL)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of rendering processes; 0 renders in this process. (Default: CPU count)")
+        parser.add_argument('--output', help="Storage name for the ZIP file. (Default: busker/cards/[batch id].zip)")
+        parser.add_argument('--pages-per-file', type=int, default=50,
+                            help="Maximum number of pages in each PDF file. (Default: 50)")
+
+    def handle(self, *args, **options):
+        try:
+            batch = Batch.objects.select_related('work').get(pk=options['batch_id'])
+        except (Batch.DoesNotExist, ValidationError, ValueError):
+            raise CommandError(f"Batch {options['batch_id']} does not exist.")
+        name, count = render_batch_cards(batch, card_format=options['card_format'], base_url=options['base_url'],
+                                         workers=options['workers'], name=options['output'],
+                                         pages_per_file=options['pages_per_file'])
+        self.stdout.write(f"Saved {count} card{'s' if count != 1 else ''} for batch {batch.id} to {name}")
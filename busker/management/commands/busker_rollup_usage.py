@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from busker.rollups import reset_rollups, rollup_usage
+
+
+class Command(BaseCommand):
+    help = "Aggregates usage events recorded since the last run into the daily usage tables. Safe to run on a " \
+           "schedule and to re-run after an interruption."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help="Number of events to aggregate per transaction. (Default: 10000)")
+        parser.add_argument('--settle-seconds', type=int, default=60,
+                            help="Leave events newer than this for the next run. (Default: 60)")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Delete the existing rollups and aggregate every event from the beginning.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            reset_rollups()
+        processed = rollup_usage(chunk_size=options['chunk_size'], settle_seconds=options['settle_seconds'])
+        self.stdout.write(f"Rolled up {processed} usage event{'s' if processed != 1 else ''}.")
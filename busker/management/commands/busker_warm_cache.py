@@ -0,0 +1,26 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from busker.warmup import warm
+
+
+class Command(BaseCommand):
+    help = "Fills busker's caches (rendered page fragments, thumbnails and file metadata) for the given works and " \
+           "batches, e.g. just before announcing a release."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--work', action='append', default=[], metavar='ID',
+                            help="ID of a DownloadableWork to warm. May be given more than once.")
+        parser.add_argument('--batch', action='append', default=[], metavar='ID',
+                            help="ID of a Batch to warm (along with its work.) May be given more than once.")
+
+    def handle(self, *args, **options):
+        if not options['work'] and not options['batch']:
+            raise CommandError("Give at least one --work or --batch.")
+        try:
+            counts = warm(works=options['work'], batches=options['batch'])
+        except (ValidationError, ValueError):
+            raise CommandError("Work and batch IDs must be UUIDs.")
+        fragments, thumbnails, files = counts['fragments'], counts['thumbnails'], counts['files']
+        self.stdout.write(f"Warmed {fragments} fragment{'s' if fragments != 1 else ''}, {thumbnails} "
+                          f"thumbnail{'s' if thumbnails != 1 else ''} and {files} file{'s' if files != 1 else ''}.")
@@ -0,0 +1,230 @@
+"""
+Contains a small, dependency-free metrics registry (counters and latency histograms) for busker's code redemption and
+file download traffic, and functions for exposing it in the Prometheus text format.
+
+Metrics are only recorded when the BUSKER_METRICS_ENABLED setting is True. Each process keeps its own totals in
+memory; to aggregate them across worker processes set BUSKER_METRICS_DIR to a directory shared by all of the workers.
+Each process then periodically writes its totals to a file in that directory (at most once every
+BUSKER_METRICS_FLUSH_INTERVAL seconds, default 5) and the metrics endpoint sums the files of every process.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+#: Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Name: (type, help text) for each metric busker records
+METRICS = {
+    'busker_validate_code_seconds': ('histogram', "Time spent in validate_code(), by result."),
+    'busker_redeem_requests_total': ('counter', "Requests handled by RedeemView, by HTTP method."),
+    'busker_redeem_request_seconds': ('histogram', "RedeemView response time, by HTTP method."),
+    'busker_invalid_codes_total': ('counter', "Codes rejected as invalid or already redeemed, by source."),
+    'busker_download_requests_total': ('counter', "Files served by DownloadView, by work ID."),
+    'busker_download_bytes_total': ('counter', "Bytes served by DownloadView, by work ID."),
+    'busker_throttled_requests_total': ('counter', "Code lookups rejected by the rate limiter, by limit exceeded."),
+    'busker_admission_rejected_total': ('counter', "Requests turned away by admission control, by kind of view."),
+    'busker_single_flight_waits_total': ('counter', "Cache misses that waited for another process to load the value."),
+}
+
+_FILE_PREFIX = 'busker-metrics-'
+
+
+def enabled():
+    return getattr(settings, 'BUSKER_METRICS_ENABLED', False)
+
+
+def _label_string(labels):
+    """
+    Formats a dict of labels the way Prometheus expects them inside the curly braces, e.g. `method="GET",work="1"`
+    """
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+
+
+class Registry:
+    """
+    Thread-safe in-process store of counter and histogram values, keyed by metric name and label string.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.RLock()  # Re-entered by flush(), which takes a snapshot while holding it
+        self._last_flush = time.monotonic()
+        # Unique per process (PIDs get reused) so totals from processes that have exited are kept
+        self.process_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_string(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        key = _label_string(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        """
+        Returns a JSON-serializable copy of the current values. Histogram bucket counts are not cumulative.
+        """
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': {name: dict(series) for name, series in self._counters.items()},
+                'histograms': {name: {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                                      for key, h in series.items()}
+                               for name, series in self._histograms.items()},
+            }
+
+    def maybe_flush(self):
+        if getattr(settings, 'BUSKER_METRICS_DIR', None) and \
+                time.monotonic() - self._last_flush >= getattr(settings, 'BUSKER_METRICS_FLUSH_INTERVAL', 5):
+            self.flush()
+
+    def flush(self):
+        """
+        Atomically writes this process's snapshot to its file in BUSKER_METRICS_DIR. Errors are logged rather than
+        raised, since this is called while recording metrics in the middle of requests.
+        """
+        directory = getattr(settings, 'BUSKER_METRICS_DIR', None)
+        if not directory:
+            return
+        with self._lock:
+            self._last_flush = time.monotonic()
+            path = os.path.join(directory, f"{_FILE_PREFIX}{self.process_id}.json")
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(temp_path, path)
+            except OSError:
+                logger.exception("Couldn't write metrics to %s", directory)
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+
+registry = Registry()
+
+
+def inc(name, amount=1, **labels):
+    if enabled():
+        registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    if enabled():
+        registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Context manager that records the time spent in its block in the named histogram. Labels may be added or changed
+    inside the block via the yielded dict.
+    """
+    if not enabled():
+        yield labels
+        return
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+
+def merge(snapshots):
+    """
+    Sums a list of snapshots (as returned by Registry.snapshot) into one. Histograms recorded with bucket bounds
+    different from the first snapshot's are skipped.
+    """
+    buckets = snapshots[0]['buckets'] if snapshots else list(registry.buckets)
+    merged = {'buckets': buckets, 'counters': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        for name, series in snapshot.get('counters', {}).items():
+            target = merged['counters'].setdefault(name, {})
+            for key, value in series.items():
+                target[key] = target.get(key, 0) + value
+        if snapshot.get('buckets', merged['buckets']) != merged['buckets']:
+            continue  # Written with different bucket bounds; can't be combined
+        for name, series in snapshot.get('histograms', {}).items():
+            target = merged['histograms'].setdefault(name, {})
+            for key, histogram in series.items():
+                existing = target.setdefault(key, {'buckets': [0] * len(merged['buckets']), 'sum': 0.0, 'count': 0})
+                existing['buckets'] = [a + b for a, b in zip(existing['buckets'], histogram['buckets'])]
+                existing['sum'] += histogram['sum']
+                existing['count'] += histogram['count']
+    return merged
+
+
+def collect():
+    """
+    Returns the merged metrics for every process, or just this process if BUSKER_METRICS_DIR isn't set.
+    """
+    directory = getattr(settings, 'BUSKER_METRICS_DIR', None)
+    if not directory:
+        return registry.snapshot()
+    registry.flush()
+    snapshots = []
+    for filename in os.listdir(directory):
+        if filename.startswith(_FILE_PREFIX) and filename.endswith('.json'):
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Removed or being replaced
+    return merge(snapshots)
+
+
+def render_prometheus(snapshot):
+    """
+    Formats a snapshot in the Prometheus text exposition format.
+    """
+    lines = []
+    bounds = [str(bound) for bound in snapshot['buckets']] + ['+Inf']
+    for name, (metric_type, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == 'counter':
+            for key, value in sorted(snapshot['counters'].get(name, {}).items()):
+                lines.append(f"{name}{{{key}}} {value}" if key else f"{name} {value}")
+        else:
+            for key, histogram in sorted(snapshot['histograms'].get(name, {}).items()):
+                cumulative = 0
+                for bound, count in zip(bounds, histogram['buckets'] + [0]):
+                    cumulative += count
+                    labels = f'{key},le="{bound}"' if key else f'le="{bound}"'
+                    lines.append(f"{name}_bucket{{{labels}}} {cumulative if bound != '+Inf' else histogram['count']}")
+                suffix = f"{{{key}}}" if key else ''
+                lines.append(f"{name}_sum{suffix} {histogram['sum']}")
+                lines.append(f"{name}_count{suffix} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
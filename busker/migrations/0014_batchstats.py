@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_batch_stats(apps, schema_editor):
+    Batch = apps.get_model('busker', 'Batch')
+    BatchStats = apps.get_model('busker', 'BatchStats')
+    DownloadCode = apps.get_model('busker', 'DownloadCode')
+    totals = DownloadCode.objects.order_by().values('batch').annotate(
+        codes_total=models.Count('pk'),
+        codes_used=models.Count('pk', filter=models.Q(times_used__gt=0)),
+        redemptions=models.Sum('times_used'),
+        codes_exhausted=models.Count('pk', filter=models.Q(max_uses__gt=0, times_used__gte=models.F('max_uses'))),
+        last_redeemed_date=models.Max('last_used_date'),
+    )
+    totals = {row.pop('batch'): row for row in totals}
+    for batch_id in Batch.objects.values_list('pk', flat=True).iterator():
+        defaults = totals.get(batch_id, {})
+        defaults['redemptions'] = defaults.get('redemptions') or 0
+        BatchStats.objects.create(batch_id=batch_id, **defaults)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0013_auto_20200906_1933'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchStats',
+            fields=[
+                ('batch', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='busker.batch')),
+                ('codes_total', models.IntegerField(default=0, help_text='The number of codes in the batch.')),
+                ('codes_used', models.IntegerField(default=0, help_text='The number of codes redeemed at least once.')),
+                ('redemptions', models.IntegerField(default=0, help_text='The total number of redemptions of all codes in the batch.')),
+                ('codes_exhausted', models.IntegerField(default=0, help_text='The number of codes with no remaining uses.')),
+                ('last_redeemed_date', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Batch stats',
+            },
+        ),
+        migrations.RunPython(populate_batch_stats, migrations.RunPython.noop),
+    ]
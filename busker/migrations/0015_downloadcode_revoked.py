@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0014_batchstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadcode',
+            name='revoked',
+            field=models.BooleanField(default=False, help_text='Revoked codes can no longer be redeemed, regardless of their remaining uses.'),
+        ),
+    ]
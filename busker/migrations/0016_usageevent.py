@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0015_downloadcode_revoked'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_type', models.CharField(choices=[('redeem', 'Code redeemed'), ('download', 'File downloaded')], max_length=8)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bytes', models.BigIntegerField(default=0, help_text='Bytes served (downloads only)')),
+                ('batch', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.batch')),
+                ('code', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.downloadcode')),
+                ('file', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.file')),
+                ('work', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.downloadablework')),
+            ],
+            options={
+                'ordering': ('-timestamp',),
+                'indexes': [models.Index(fields=['work', 'timestamp'], name='busker_event_work_time_idx'), models.Index(fields=['batch', 'timestamp'], name='busker_event_batch_time_idx'), models.Index(fields=['file', 'timestamp'], name='busker_event_file_time_idx'), models.Index(fields=['timestamp'], name='busker_event_time_idx')],
+            },
+        ),
+    ]
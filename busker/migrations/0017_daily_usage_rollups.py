@@ -0,0 +1,90 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0016_usageevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyFileUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('redemptions', models.IntegerField(default=0)),
+                ('downloads', models.IntegerField(default=0)),
+                ('bytes_served', models.BigIntegerField(default=0)),
+                ('file', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.file')),
+                ('work', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.downloadablework')),
+            ],
+            options={
+                'ordering': ('-date',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyBatchUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('redemptions', models.IntegerField(default=0)),
+                ('downloads', models.IntegerField(default=0)),
+                ('bytes_served', models.BigIntegerField(default=0)),
+                ('batch', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.batch')),
+                ('work', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.downloadablework')),
+            ],
+            options={
+                'ordering': ('-date',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyWorkUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('redemptions', models.IntegerField(default=0)),
+                ('downloads', models.IntegerField(default=0)),
+                ('bytes_served', models.BigIntegerField(default=0)),
+                ('work', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='busker.downloadablework')),
+            ],
+            options={
+                'ordering': ('-date',),
+                'abstract': False,
+                'indexes': [models.Index(fields=['date'], name='busker_daily_work_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyworkusage',
+            constraint=models.UniqueConstraint(fields=('work', 'date'), name='busker_daily_work_usage_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyfileusage',
+            index=models.Index(fields=['work', 'date'], name='busker_daily_file_work_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyfileusage',
+            constraint=models.UniqueConstraint(fields=('file', 'date'), name='busker_daily_file_usage_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='dailybatchusage',
+            index=models.Index(fields=['work', 'date'], name='busker_daily_batch_work_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailybatchusage',
+            constraint=models.UniqueConstraint(fields=('batch', 'date'), name='busker_daily_batch_usage_unique'),
+        ),
+    ]
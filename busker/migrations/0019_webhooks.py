@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:01
+
+import busker.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('busker', '0018_rollup_primary_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEndpoint',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('modified_date', models.DateTimeField(auto_now=True)),
+                ('url', models.URLField(max_length=500)),
+                ('secret', models.CharField(default=busker.models.webhook_secret, help_text='Used to sign each delivery (see the X-Busker-Signature header).', max_length=128)),
+                ('send_redemptions', models.BooleanField(default=True)),
+                ('send_downloads', models.BooleanField(default=False)),
+                ('active', models.BooleanField(default=True, help_text='Inactive endpoints are not sent new events.')),
+                ('batch_size', models.IntegerField(default=100, help_text='The maximum number of events sent per request.')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_date',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_id', models.UUIDField(default=uuid.uuid4, editable=False, help_text='Unique ID receivers can use to ignore events delivered more than once.')),
+                ('event_type', models.CharField(choices=[('redeem', 'Code redeemed'), ('download', 'File downloaded')], max_length=8)),
+                ('payload', models.TextField(help_text='JSON-encoded event data')),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('dead', 'Failed')], default='pending', max_length=9)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivered_date', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('endpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='busker.webhookendpoint')),
+            ],
+            options={
+                'ordering': ('-id',),
+                'indexes': [models.Index(fields=['status', 'next_attempt_date'], name='busker_webhook_due_idx'), models.Index(fields=['endpoint', 'status', 'id'], name='busker_webhook_endpoint_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+
+
+def populate_work(apps, schema_editor):
+    Batch = apps.get_model('busker', 'Batch')
+    DownloadCode = apps.get_model('busker', 'DownloadCode')
+    batches = Batch.objects.filter(pk=models.OuterRef('batch_id'))
+    DownloadCode.objects.update(work_id=models.Subquery(batches.values('work_id')),
+                                is_active=models.Exists(batches.filter(work__published=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0019_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadcode',
+            name='is_active',
+            field=models.BooleanField(default=True, editable=False, help_text="Whether this code's work is published."),
+        ),
+        migrations.AddField(
+            model_name='downloadcode',
+            name='work',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='busker.downloadablework'),
+        ),
+        migrations.RunPython(populate_work, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='downloadcode',
+            index=models.Index(django.db.models.functions.text.Upper('id'), condition=models.Q(('is_active', True), ('revoked', False)), name='busker_code_active_upper_idx'),
+        ),
+    ]
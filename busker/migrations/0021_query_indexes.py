@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0020_downloadcode_denormalised_work'),
+    ]
+
+    # The batch FK's own index is only dropped once busker_code_batch_usage_idx, which replaces it, exists
+    operations = [
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['-created_date'], name='busker_batch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadablework',
+            index=models.Index(condition=models.Q(('published', True)), fields=['title'], name='busker_work_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadcode',
+            index=models.Index(fields=['batch', 'times_used', 'max_uses'], name='busker_code_batch_usage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadcode',
+            index=models.Index(condition=models.Q(('last_used_date__isnull', False)), fields=['last_used_date'], name='busker_code_last_used_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadcode',
+            index=models.Index(condition=models.Q(('revoked', True)), fields=['id'], name='busker_code_revoked_idx'),
+        ),
+        migrations.AlterField(
+            model_name='downloadcode',
+            name='batch',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='codes', to='busker.batch'),
+        ),
+    ]
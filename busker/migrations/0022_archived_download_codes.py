@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.text
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('busker', '0021_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDownloadCode',
+            fields=[
+                ('id', models.CharField(max_length=7, primary_key=True, serialize=False)),
+                ('created_date', models.DateTimeField()),
+                ('modified_date', models.DateTimeField()),
+                ('max_uses', models.IntegerField()),
+                ('times_used', models.IntegerField()),
+                ('last_used_date', models.DateTimeField(blank=True, null=True)),
+                ('revoked', models.BooleanField(default=False)),
+                ('archived_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_codes', to='busker.batch')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('work', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='busker.downloadablework')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(django.db.models.functions.text.Upper('id'), name='busker_archived_upper_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('busker', '0022_archived_download_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archiveddownloadcode',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text="Optional date after which this batch's codes can no longer be redeemed. Changing it changes the expiry date of all of the batch's codes.", null=True),
+        ),
+        migrations.AddField(
+            model_name='downloadcode',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text="Optional date after which this code can no longer be redeemed. Defaults to the batch's.", null=True),
+        ),
+        migrations.AlterField(
+            model_name='downloadcode',
+            name='is_active',
+            field=models.BooleanField(default=True, editable=False, help_text="Whether this code's work is published and the code hasn't expired."),
+        ),
+        migrations.AddIndex(
+            model_name='downloadcode',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False)), fields=['expires_at'], name='busker_code_expires_idx'),
+        ),
+    ]
@@ -1,11 +1,14 @@
 import os
 import random
 import string
+from secrets import token_hex
 from uuid import uuid4
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Upper
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
@@ -14,6 +17,7 @@ from imagekit.processors import ResizeToFit
 from markdownfield.models import MarkdownField, RenderedMarkdownField
 from markdownfield.validators import VALIDATOR_STANDARD
 
+from . import dispatch, metrics, profiling, routers
 from .signals import code_post_redeem
 
 
@@ -25,14 +29,137 @@ def validate_code(code):
     Case-insensitive validation of a download code using the following criteria:
     - code matches the pk of an existing DownloadCode object
     - The code's max_uses value is 0 (unlimited) OR its times_used value is less than its max_uses value
-    - The 'published' flag for the work this code is related to is True
+    - The code has not been revoked
+    - The code has no expiry date, or it is in the future
+    - The 'published' flag for the work this code is related to is True (denormalised onto the code as is_active, so
+      this is a single lookup on busker_code_active_upper_idx without joining the batch or work)
+
+    If a read replica is configured (see busker.routers), the code is looked up there first, then on the primary if the
+    replica doesn't have it.
+    """
+    with metrics.timer('busker_validate_code_seconds', result='invalid') as labels, \
+            profiling.section('validate_code'):
+        valid_code = routers.read(lambda: _get_valid_code(code))
+        if valid_code is None:
+            return False
+        labels['result'] = 'valid'
+        return valid_code
+
+
+async def avalidate_code(code):
+    """
+    Async version of validate_code(), for use in async views.
     """
+    with metrics.timer('busker_validate_code_seconds', result='invalid') as labels, \
+            profiling.section('validate_code'):
+        valid_code = await routers.aread(lambda: _aget_valid_code(code))
+        if valid_code is None:
+            return False
+        labels['result'] = 'valid'
+        return valid_code
+
+
+def _get_valid_code(code):
     try:
-        return DownloadCode.objects.get(models.Q(max_uses=0) | models.Q(times_used__lt=models.F('max_uses')),
-                                        pk__iexact=code,
-                                        batch__work__published=True)
-    except DownloadCode.DoesNotExist as e:
-        return False
+        return valid_codes(code).get()
+    except DownloadCode.DoesNotExist:
+        return None
+
+
+async def _aget_valid_code(code):
+    try:
+        return await valid_codes(code).aget()
+    except DownloadCode.DoesNotExist:
+        return None
+
+
+def valid_codes(code):
+    """
+    Returns a queryset of the DownloadCode matching `code` if it is valid (see validate_code()).
+    """
+    # Comparing UPPER(id) with the upper-cased code, rather than using iexact (LIKE on SQLite and MySQL), matches
+    # busker_code_active_upper_idx
+    return (DownloadCode.objects
+            .alias(upper_id=Upper('pk'))
+            .filter(models.Q(max_uses=0) | models.Q(times_used__lt=models.F('max_uses')),
+                    models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now()),
+                    upper_id=str(code).upper(),
+                    revoked=False,
+                    is_active=True)
+            .order_by())
+
+
+def confirmable_codes(code):
+    """
+    Returns a queryset of the DownloadCode with the pk `code` if it can be redeemed from the confirmation page. Unlike
+    valid_codes(), this includes codes whose uses have run out since the page was displayed (see forms.ConfirmForm),
+    but not codes that have been revoked, have expired or whose work is unpublished.
+    """
+    return DownloadCode.objects.filter(models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now()),
+                                       pk=code,
+                                       revoked=False,
+                                       is_active=True)
+
+
+def code_archived(code):
+    """
+    Case-insensitive lookup of a code in the archive (see busker.archive), i.e. one that existed but has already been
+    redeemed or has expired. Returns the ArchivedDownloadCode, or None. Only worth asking once validate_code() has
+    failed.
+    """
+    return ArchivedDownloadCode.objects.filter(pk__iexact=code).first()
+
+
+async def acode_archived(code):
+    return await ArchivedDownloadCode.objects.filter(pk__iexact=code).afirst()
+
+
+def is_expired(expires_at):
+    return expires_at is not None and expires_at <= timezone.now()
+
+
+def random_code():
+    """
+    Returns a random 7-character alphanumeric code, without checking whether it is already in use.
+    """
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
+
+
+def create_codes(batch, count, user=None, chunk_size=1000):
+    """
+    Generates `count` new unique DownloadCode objects for a batch using bulk inserts. Candidate codes are checked for
+    collisions against the database a chunk at a time (one SELECT and one INSERT per chunk rather than per code); if
+    another process claims one of the candidates before the chunk is inserted, that chunk is simply regenerated. Other
+    integrity errors (e.g. a batch or user that doesn't exist) are raised. Returns the number of codes created.
+    """
+    created = 0
+    while created < count:
+        needed = min(chunk_size, count - created)
+        candidates = set()
+        while len(candidates) < needed:
+            candidates.add(random_code())
+        # Archived codes' IDs can't be reused either
+        taken = DownloadCode.objects.filter(pk__in=candidates).order_by().values_list('pk', flat=True).union(
+            ArchivedDownloadCode.objects.filter(pk__in=candidates).order_by().values_list('pk', flat=True))
+        candidates -= set(taken)
+        codes = [DownloadCode(id=code, batch=batch, work_id=batch.work_id, is_active=batch.work.published, user=user,
+                              max_uses=batch.max_uses, expires_at=batch.expires_at)
+                 for code in candidates]
+        try:
+            with transaction.atomic():
+                DownloadCode.objects.bulk_create(codes)
+                BatchStats.record_new_codes(batch.pk, len(codes))
+        except IntegrityError:
+            if _codes_taken(candidates):
+                continue  # Another process claimed one of the candidates
+            raise
+        created += len(codes)
+    return created
+
+
+def _codes_taken(codes):
+    return DownloadCode.objects.filter(pk__in=codes).exists() \
+        or ArchivedDownloadCode.objects.filter(pk__in=codes).exists()
 
 
 def generate_code():
@@ -44,10 +171,9 @@ def generate_code():
     """
     new_code = None
     while new_code is None:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-        try:
-            DownloadCode.objects.get(pk=code)
-        except DownloadCode.DoesNotExist as e:
+        code = random_code()
+        if not DownloadCode.objects.filter(pk=code).exists() \
+                and not ArchivedDownloadCode.objects.filter(pk=code).exists():
             new_code = code
     return new_code
 
@@ -106,6 +232,9 @@ class DownloadableWork(BuskerModel):
 
     class Meta:
         ordering = ('title', 'artist__name',)
+        indexes = [
+            models.Index(fields=['title'], name='busker_work_published_idx', condition=models.Q(published=True)),
+        ]
 
 
 class File(BuskerModel):
@@ -146,6 +275,19 @@ class Batch(BuskerModel):
                                              "value.) "
                                              "(0 = unlimited)",
                                    default=3)
+    expires_at = models.DateTimeField(null=True, blank=True,
+                                      help_text="Optional date after which this batch's codes can no longer be "
+                                                "redeemed. Changing it changes the expiry date of all of the batch's "
+                                                "codes.")
+
+    def add_codes(self, count, user=None):
+        """
+        Appends `count` new DownloadCodes to this batch and increases number_of_codes to match.
+        """
+        created = create_codes(self, count, user=user)
+        Batch.objects.filter(pk=self.pk).update(number_of_codes=models.F('number_of_codes') + created)
+        self.refresh_from_db(fields=['number_of_codes'])
+        return created
 
     def __str__(self):
         return f"{self.label} -- {self.work.title} by {self.work.artist.name}"
@@ -153,6 +295,9 @@ class Batch(BuskerModel):
     class Meta:
         verbose_name_plural = "Batches"
         ordering = ('-created_date', 'work__artist__name', 'work__title')
+        indexes = [
+            models.Index(fields=['-created_date'], name='busker_batch_created_idx'),
+        ]
 
 
 class DownloadCode(BuskerModel):
@@ -161,11 +306,23 @@ class DownloadCode(BuskerModel):
     """
     # TODO validate ID to ensure uppercase and 0-9 only?
     id = models.CharField(primary_key=True, max_length=7, default=generate_code)
-    batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name='codes')
+    # Indexed by busker_code_batch_usage_idx below
+    batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name='codes', db_index=False)
     max_uses = models.IntegerField(default=3, help_text="This is typically initially determined when a Batch is "
                                                         "originally created, but can be overridden.")
     times_used = models.IntegerField(default=0)
     last_used_date = models.DateTimeField(null=True, blank=True)
+    revoked = models.BooleanField(default=False, help_text="Revoked codes can no longer be redeemed, regardless of "
+                                                           "their remaining uses.")
+    expires_at = models.DateTimeField(null=True, blank=True, help_text="Optional date after which this code can no "
+                                                                       "longer be redeemed. Defaults to the batch's.")
+    # Copies of batch.work and batch.work.published, so that codes can be validated without joining those tables. They
+    # are kept in sync when a work is (un)published or a batch moved to another work; see refresh_denormalised().
+    # is_active is also cleared on expired codes by the busker_expire_codes command, to keep them out of the partial
+    # index used for validation.
+    work = models.ForeignKey(DownloadableWork, null=True, editable=False, on_delete=models.CASCADE, related_name='+')
+    is_active = models.BooleanField(default=True, editable=False,
+                                    help_text="Whether this code's work is published and the code hasn't expired.")
 
     @property
     def remaining_uses(self):
@@ -174,6 +331,13 @@ class DownloadCode(BuskerModel):
         """
         return self.max_uses - self.times_used
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so that code_denormalise can tell when a code is moved to another batch
+        instance._loaded_batch_id = instance.__dict__.get('batch_id')
+        return instance
+
     @property
     def redeem_uri(self):
         """
@@ -184,26 +348,410 @@ class DownloadCode(BuskerModel):
 
     def redeem(self, request=None):
         """
-        Increments the times_used() count and sends the code_post_redeem signal.
+        Increments the times_used() count and sends the code_post_redeem signal. The code, its batch's statistics and
+        the webhook outbox (busker's own receivers of the signal) are updated in a single transaction; other receivers
+        are sent the signal once it has been committed.
+        """
+        with transaction.atomic():
+            self.times_used += 1
+            self.last_used_date = timezone.now()
+            self.save()
+            BatchStats.record_redemption(self)
+            with profiling.section('code_post_redeem'):
+                dispatch.send_internal(code_post_redeem, sender=self.__class__, request=request, code=self)
+        with profiling.section('code_post_redeem'):
+            dispatch.send_external(code_post_redeem, sender=self.__class__, request=request, code=self)
+
+    async def aredeem(self, request=None):
+        """
+        Async version of redeem(). The transaction can't span async queries, so redeem() is run in a worker thread.
         """
-        self.times_used += 1
-        self.last_used_date = timezone.now()
-        self.save()
-        code_post_redeem.send(sender=self.__class__, request=request, code=self)
+        await sync_to_async(self.redeem)(request=request)
+
+    @classmethod
+    def refresh_denormalised(cls, codes=None):
+        """
+        Recopies work and is_active from the batches of the given codes (a queryset; default all codes) with a single
+        UPDATE. Only needed after changing batches' works, works' published flags or codes' expiry dates with
+        QuerySet.update(); saving a Batch or DownloadableWork updates its codes automatically.
+        """
+        codes = cls.objects.all() if codes is None else codes
+        batches = Batch.objects.filter(pk=models.OuterRef('batch_id'))
+        return codes.update(work_id=models.Subquery(batches.values('work_id')),
+                            is_active=models.Case(models.When(expires_at__lte=timezone.now(), then=False),
+                                                  default=models.Exists(batches.filter(work__published=True))))
 
     def __str__(self):
         return self.id
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            # Matches valid_codes(): UPPER(id) = the upper-cased code, restricted to codes that can still be redeemed
+            models.Index(Upper('id'), name='busker_code_active_upper_idx', condition=models.Q(is_active=True,
+                                                                                              revoked=False)),
+            # A batch's codes and their usage, for the admin, CSV exports and BatchStats.rebuild(), without reading
+            # the table itself
+            models.Index(fields=['batch', 'times_used', 'max_uses'], name='busker_code_batch_usage_idx'),
+            models.Index(fields=['last_used_date'], name='busker_code_last_used_idx',
+                         condition=models.Q(last_used_date__isnull=False)),
+            # The admin's "revoked" filter; revoked codes are rare, so this stays small
+            models.Index(fields=['id'], name='busker_code_revoked_idx', condition=models.Q(revoked=True)),
+            # For busker_expire_codes
+            models.Index(fields=['expires_at'], name='busker_code_expires_idx',
+                         condition=models.Q(expires_at__isnull=False)),
+        ]
+
+
+class ArchivedDownloadCode(models.Model):
+    """
+    A DownloadCode that can no longer be redeemed, moved out of the DownloadCode table by busker.archive so that it
+    doesn't bloat that table and its indexes. Archived codes are kept for reference (they are shown read-only in the
+    admin, included in CSV exports and counted in BatchStats) and so that users entering them can be told that they
+    have already been redeemed.
+    """
+    id = models.CharField(primary_key=True, max_length=7)
+    batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name='archived_codes')
+    work = models.ForeignKey(DownloadableWork, null=True, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.PROTECT, related_name='+')
+    created_date = models.DateTimeField()
+    modified_date = models.DateTimeField()
+    max_uses = models.IntegerField()
+    times_used = models.IntegerField()
+    last_used_date = models.DateTimeField(null=True, blank=True)
+    revoked = models.BooleanField(default=False)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    archived_date = models.DateTimeField(default=timezone.now)
+
+    #: The fields copied from DownloadCode when a code is archived
+    COPIED_FIELDS = ('id', 'batch_id', 'work_id', 'user_id', 'created_date', 'modified_date', 'max_uses', 'times_used',
+                     'last_used_date', 'revoked', 'expires_at')
+
+    @property
+    def expired(self):
+        return is_expired(self.expires_at)
+
+    def __str__(self):
+        return self.id
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Matches code_archived(): UPPER(id) = UPPER(code)
+            models.Index(Upper('id'), name='busker_archived_upper_idx'),
+        ]
+
+
+class BatchStats(models.Model):
+    """
+    Running redemption totals for a Batch. These are updated incrementally as codes are created and redeemed, so they
+    can be displayed (and sorted on) without scanning the batch's DownloadCodes. Changes made outside of redeem() and
+    code creation, for example editing times_used by hand, are picked up by BatchStats.rebuild() (see the
+    ``busker_rebuild_batch_stats`` management command.)
+    """
+    batch = models.OneToOneField(Batch, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    codes_total = models.IntegerField(default=0, help_text="The number of codes in the batch.")
+    codes_used = models.IntegerField(default=0, help_text="The number of codes redeemed at least once.")
+    redemptions = models.IntegerField(default=0, help_text="The total number of redemptions of all codes in the batch.")
+    codes_exhausted = models.IntegerField(default=0, help_text="The number of codes with no remaining uses.")
+    last_redeemed_date = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def record_redemption(cls, code):
+        """
+        Given a DownloadCode that has just been redeemed, updates its batch's totals with a single UPDATE.
+        """
+        cls.objects.filter(batch_id=code.batch_id).update(**cls._redemption_changes(code))
+
+    @staticmethod
+    def _redemption_changes(code):
+        # A code is counted as exhausted by the redemption that reached its limit, and not again by any made past it
+        exhausted = bool(code.max_uses) and code.times_used - 1 < code.max_uses <= code.times_used
+        return {
+            'redemptions': models.F('redemptions') + 1,
+            'codes_used': models.F('codes_used') + (1 if code.times_used == 1 else 0),
+            'codes_exhausted': models.F('codes_exhausted') + (1 if exhausted else 0),
+            'last_redeemed_date': code.last_used_date,
+        }
+
+    @classmethod
+    def record_new_codes(cls, batch_id, count=1):
+        cls.objects.filter(batch_id=batch_id).update(codes_total=models.F('codes_total') + count)
+
+    @classmethod
+    def rebuild(cls, batches=None):
+        """
+        Recalculates the totals for the given batches (a queryset or list of Batch IDs; default all batches) from their
+        DownloadCodes and ArchivedDownloadCodes, using one aggregate query per table.
+        """
+        batch_ids = Batch.objects.order_by()
+        if batches is not None:
+            batch_ids = batch_ids.filter(pk__in=batches)
+        totals = {}
+        for model in (DownloadCode, ArchivedDownloadCode):
+            codes = model.objects.order_by()
+            if batches is not None:
+                codes = codes.filter(batch__in=batches)
+            for row in codes.values('batch').annotate(
+                codes_total=models.Count('pk'),
+                codes_used=models.Count('pk', filter=models.Q(times_used__gt=0)),
+                redemptions=models.Sum('times_used'),
+                codes_exhausted=models.Count('pk', filter=models.Q(max_uses__gt=0,
+                                                                   times_used__gte=models.F('max_uses'))),
+                last_redeemed_date=models.Max('last_used_date'),
+            ):
+                batch_totals = totals.setdefault(row.pop('batch'), {
+                    'codes_total': 0, 'codes_used': 0, 'redemptions': 0, 'codes_exhausted': 0,
+                    'last_redeemed_date': None,
+                })
+                for field in ('codes_total', 'codes_used', 'redemptions', 'codes_exhausted'):
+                    batch_totals[field] += row[field] or 0
+                if row['last_redeemed_date'] and (batch_totals['last_redeemed_date'] is None
+                                                  or row['last_redeemed_date'] > batch_totals['last_redeemed_date']):
+                    batch_totals['last_redeemed_date'] = row['last_redeemed_date']
+        empty = {'codes_total': 0, 'codes_used': 0, 'redemptions': 0, 'codes_exhausted': 0, 'last_redeemed_date': None}
+        for batch_id in batch_ids.values_list('pk', flat=True).iterator():
+            cls.objects.update_or_create(batch_id=batch_id, defaults=totals.get(batch_id, empty))
+
+    def __str__(self):
+        return f"Stats for {self.batch_id}"
+
+    class Meta:
+        verbose_name_plural = "Batch stats"
+
+
+class UsageEvent(models.Model):
+    """
+    Append-only record of a single code redemption or file download, written in batches by busker.events. The
+    relations to other busker objects are not enforced by the database and are not cleared when those objects are
+    deleted, so the history is kept intact.
+    """
+    REDEMPTION = 'redeem'
+    DOWNLOAD = 'download'
+    EVENT_TYPES = (
+        (REDEMPTION, 'Code redeemed'),
+        (DOWNLOAD, 'File downloaded'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=8, choices=EVENT_TYPES)
+    timestamp = models.DateTimeField(default=timezone.now)
+    work = models.ForeignKey(DownloadableWork, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, related_name='+')
+    batch = models.ForeignKey(Batch, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False,
+                              db_index=False, related_name='+')
+    code = models.ForeignKey(DownloadCode, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, related_name='+')
+    file = models.ForeignKey(File, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, related_name='+')
+    bytes = models.BigIntegerField(default=0, help_text="Bytes served (downloads only)")
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} at {self.timestamp}"
+
+    class Meta:
+        ordering = ('-timestamp',)
+        # Time-range queries are always scoped to a work, batch or file (or to everything, e.g. when rolling up)
+        indexes = [
+            models.Index(fields=['work', 'timestamp'], name='busker_event_work_time_idx'),
+            models.Index(fields=['batch', 'timestamp'], name='busker_event_batch_time_idx'),
+            models.Index(fields=['file', 'timestamp'], name='busker_event_file_time_idx'),
+            models.Index(fields=['timestamp'], name='busker_event_time_idx'),
+        ]
+
+
+class DailyUsage(models.Model):
+    """
+    Base model for the daily usage rollups, which are aggregated from UsageEvents by busker.rollups. As with
+    UsageEvent, relations are not enforced by the database so that rollups outlive the objects they describe.
+    """
+    id = models.BigAutoField(primary_key=True)
+    date = models.DateField()
+    redemptions = models.IntegerField(default=0)
+    downloads = models.IntegerField(default=0)
+    bytes_served = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ('-date',)
+
+
+class DailyWorkUsage(DailyUsage):
+    work = models.ForeignKey(DownloadableWork, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             related_name='+')
+
+    class Meta(DailyUsage.Meta):
+        constraints = [models.UniqueConstraint(fields=['work', 'date'], name='busker_daily_work_usage_unique')]
+        indexes = [models.Index(fields=['date'], name='busker_daily_work_date_idx')]
+
+
+class DailyBatchUsage(DailyUsage):
+    batch = models.ForeignKey(Batch, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                              related_name='+')
+    work = models.ForeignKey(DownloadableWork, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             related_name='+')
+
+    class Meta(DailyUsage.Meta):
+        constraints = [models.UniqueConstraint(fields=['batch', 'date'], name='busker_daily_batch_usage_unique')]
+        indexes = [models.Index(fields=['work', 'date'], name='busker_daily_batch_work_idx')]
+
+
+class DailyFileUsage(DailyUsage):
+    file = models.ForeignKey(File, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+')
+    work = models.ForeignKey(DownloadableWork, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             related_name='+')
+
+    class Meta(DailyUsage.Meta):
+        constraints = [models.UniqueConstraint(fields=['file', 'date'], name='busker_daily_file_usage_unique')]
+        indexes = [models.Index(fields=['work', 'date'], name='busker_daily_file_work_idx')]
+
+
+class RollupWatermark(models.Model):
+    """
+    The ID of the last UsageEvent included in a rollup.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    last_event_id = models.BigIntegerField(default=0)
+    modified_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_event_id}"
+
+
+def webhook_secret():
+    return token_hex(32)
+
+
+class WebhookEndpoint(BuskerModel):
+    """
+    An external URL that is sent code redemption and/or file download events, via the WebhookEvent outbox.
+    """
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=128, default=webhook_secret,
+                              help_text="Used to sign each delivery (see the X-Busker-Signature header).")
+    send_redemptions = models.BooleanField(default=True)
+    send_downloads = models.BooleanField(default=False)
+    active = models.BooleanField(default=True, help_text="Inactive endpoints are not sent new events.")
+    batch_size = models.IntegerField(default=100, help_text="The maximum number of events sent per request.")
+
+    def __str__(self):
+        return self.url
+
+
+class WebhookEvent(models.Model):
+    """
+    An event waiting to be delivered to (or already delivered to) a WebhookEndpoint. Rows are written in the same
+    transaction as the redemption they describe (or before the file is sent, for downloads), and delivered in batches
+    by the busker_deliver_webhooks management command.
+    """
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    DEAD = 'dead'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (DELIVERED, 'Delivered'),
+        (DEAD, 'Failed'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    event_id = models.UUIDField(default=uuid4, editable=False, help_text="Unique ID receivers can use to ignore "
+                                                                         "events delivered more than once.")
+    endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=8, choices=UsageEvent.EVENT_TYPES)
+    payload = models.TextField(help_text="JSON-encoded event data")
+    created_date = models.DateTimeField(default=timezone.now)
+    status = models.CharField(max_length=9, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_date = models.DateTimeField(default=timezone.now)
+    delivered_date = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} for {self.endpoint_id} ({self.get_status_display()})"
+
+    class Meta:
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_date'], name='busker_webhook_due_idx'),
+            models.Index(fields=['endpoint', 'status', 'id'], name='busker_webhook_endpoint_idx'),
+        ]
+
+
+@receiver(post_save, sender=DownloadCode)
+def code_create(sender, instance, **kwargs):
+    """
+    post_save receiver for DownloadCode objects; counts newly-created codes in their batch's BatchStats.
+    """
+    if kwargs['created'] and not kwargs.get('raw'):
+        BatchStats.record_new_codes(instance.batch_id)
+
+
+@receiver(pre_save, sender=DownloadCode)
+def code_denormalise(sender, instance, **kwargs):
+    """
+    pre_save receiver for DownloadCode objects; copies the work, its published flag and the batch's expiry date onto
+    codes created one at a time (create_codes() sets them itself) and onto codes moved to another batch.
+    """
+    if not instance.batch_id or kwargs.get('raw'):
+        return
+    moved = getattr(instance, '_loaded_batch_id', None) not in (None, instance.batch_id)
+    if instance.work_id is None or moved:
+        instance.work = instance.batch.work
+        if instance.expires_at is None:
+            instance.expires_at = instance.batch.expires_at
+        instance.is_active = instance.work.published and not is_expired(instance.expires_at)
+    instance._loaded_batch_id = instance.batch_id
+
+
+@receiver(pre_save, sender=Batch)
+def batch_expiry_changed(sender, instance, **kwargs):
+    """
+    pre_save receiver for Batch objects; notes whether an existing batch's expiry date is being changed, so that
+    batch_create can apply the change to its codes.
+    """
+    instance._expiry_changed = False
+    if not instance._state.adding and not kwargs.get('raw'):
+        previous = Batch.objects.filter(pk=instance.pk).values_list('expires_at', flat=True).first()
+        instance._expiry_changed = previous != instance.expires_at
 
 
 @receiver(post_save, sender=Batch)
 def batch_create(sender, instance, **kwargs):
     """
     post_save receiver for Batch objects; Generates the designated number of DownloadCode objects and attaches them the
-    newly-created batch.
+    newly-created batch. When an existing batch is moved to another work or its expiry date changed, its codes are
+    updated to match.
     """
     if kwargs['created']:
-        for i in range(0, instance.number_of_codes):
-            DownloadCode.objects.create(batch=instance, user=instance.user, max_uses=instance.max_uses)
+        BatchStats.objects.create(batch=instance)
+        create_codes(instance, instance.number_of_codes, user=instance.user)
+    elif not kwargs.get('raw'):
+        is_active = instance.work.published and not is_expired(instance.expires_at)
+        if getattr(instance, '_expiry_changed', False):
+            instance.codes.update(work_id=instance.work_id, expires_at=instance.expires_at, is_active=is_active)
+        else:
+            instance.codes.exclude(work_id=instance.work_id).update(
+                work_id=instance.work_id,
+                is_active=models.Case(models.When(expires_at__lte=timezone.now(), then=False),
+                                      default=models.Value(instance.work.published)))
+
+
+@receiver(post_save, sender=DownloadableWork)
+def work_published(sender, instance, **kwargs):
+    """
+    post_save receiver for DownloadableWork objects; copies the published flag onto the work's (unexpired) codes.
+    """
+    if not kwargs['created'] and not kwargs.get('raw'):
+        codes = DownloadCode.objects.filter(work=instance, is_active=not instance.published)
+        if instance.published:
+            codes = codes.exclude(expires_at__lte=timezone.now())
+        codes.update(is_active=instance.published)
+
+
+@receiver(post_delete, sender=File)
+def file_delete(sender, instance, **kwargs):
+    """
+    post_delete receiver for File objects; deletes the stored file once the deletion has been committed.
+    """
+    if instance.file:
+        transaction.on_commit(lambda: instance.file.delete(save=False))
@@ -0,0 +1,51 @@
+"""
+Contains paginators used by busker's admin changelists.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections, transaction
+from django.utils.functional import cached_property
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Returns the database's own (approximate) row count for a model's table without scanning it, or None if the backend
+    doesn't keep one or it isn't available (for example before the table has been analyzed).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == 'mysql':
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+    elif connection.vendor == 'sqlite':
+        sql = "SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s"
+    else:
+        return None
+    try:
+        # In a savepoint, so that a failed query doesn't break the surrounding transaction on PostgreSQL
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that, for unfiltered querysets, uses the database's table statistics instead of running COUNT(*) over
+    the whole table. Filtered querysets, and tables whose estimate is below the BUSKER_ESTIMATED_COUNT_THRESHOLD
+    setting (default 10000), are still counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimate_row_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate >= getattr(settings, 'BUSKER_ESTIMATED_COUNT_THRESHOLD', 10000):
+                return estimate
+        return super().count
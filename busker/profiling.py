@@ -0,0 +1,218 @@
+"""
+Contains an opt-in, sampling profiler for requests to busker's views.
+
+When BUSKER_PROFILING_ENABLED is True, ProfilingMiddleware profiles a BUSKER_PROFILING_SAMPLE_RATE fraction (default
+0.1) of the requests that resolve to busker's URLs, recording the number of SQL queries and the time spent running
+them, plus the time spent in named sections of the request: validate_code(), template rendering, the session write
+and the receivers of the code_post_redeem and file_pre_download signals. Each profile is logged to the
+busker.profiling logger and kept in an in-process ring buffer of the last BUSKER_PROFILING_BUFFER_SIZE profiles
+(default 100), which superusers can view in the admin.
+
+Other code can be profiled with the profile() context manager, and time attributed to a section of the current
+profile with section(); both cost almost nothing when no profile is active.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('busker_profile', default=None)
+_lock = threading.Lock()
+_recent = deque(maxlen=100)
+
+
+def enabled():
+    return getattr(settings, 'BUSKER_PROFILING_ENABLED', False)
+
+
+def sampled():
+    return random.random() < getattr(settings, 'BUSKER_PROFILING_SAMPLE_RATE', 0.1)
+
+
+class Profile:
+    """
+    The queries and section timings recorded for one request (or other profiled block). Times are in seconds.
+    """
+
+    def __init__(self, name, method=None):
+        self.name = name
+        self.method = method
+        self.status = None
+        self.date = timezone.now()
+        self.duration = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.sections = {}
+        self.discard = False  # Set to True to drop the profile instead of recording it
+
+    def add(self, section_name, seconds):
+        self.sections[section_name] = self.sections.get(section_name, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'method': self.method,
+            'status': self.status,
+            'date': self.date.isoformat(),
+            'duration_ms': _ms(self.duration),
+            'sql_count': self.sql_count,
+            'sql_ms': _ms(self.sql_time),
+            'sections_ms': {name: _ms(seconds) for name, seconds in self.sections.items()},
+        }
+
+    def __str__(self):
+        parts = [f"{self.method} {self.name}" if self.method else self.name]
+        if self.status is not None:
+            parts.append(str(self.status))
+        parts.append(f"{_ms(self.duration)}ms, {self.sql_count} queries in {_ms(self.sql_time)}ms")
+        parts.extend(f"{name} {_ms(seconds)}ms" for name, seconds in self.sections.items())
+        return ', '.join(parts)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class _QueryTimer:
+    """
+    Database execute wrapper that counts and times queries against a Profile.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.profile.sql_count += 1
+            self.profile.sql_time += time.perf_counter() - start
+
+
+def current():
+    """
+    Returns the Profile being recorded in this context, if any.
+    """
+    return _current.get()
+
+
+@contextmanager
+def section(name):
+    """
+    Adds the time spent in the block to the named section of the current profile, if there is one.
+    """
+    active = _current.get()
+    if active is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.add(name, time.perf_counter() - start)
+
+
+def timed(name, func):
+    """
+    Wraps func so that calls to it are timed as the named section of whichever profile is current at the time.
+    """
+    def wrapper(*args, **kwargs):
+        with section(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def profile(name, method=None):
+    """
+    Profiles the block, yielding its Profile. The profile is recorded when the block exits.
+    """
+    active = Profile(name, method)
+    token = _current.set(active)
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(_QueryTimer(active)))
+            yield active
+    finally:
+        active.duration = time.perf_counter() - start
+        _current.reset(token)
+        if not active.discard:
+            record(active)
+
+
+def record(active):
+    """
+    Logs a finished Profile and adds it to the ring buffer.
+    """
+    global _recent
+    size = getattr(settings, 'BUSKER_PROFILING_BUFFER_SIZE', 100)
+    with _lock:
+        if _recent.maxlen != size:
+            _recent = deque(_recent, maxlen=size)
+        _recent.append(active)
+    logger.info("%s", active, extra={'busker_profile': active.as_dict()})
+
+
+def recent():
+    """
+    Returns the profiles in the ring buffer, newest first.
+    """
+    with _lock:
+        return list(reversed(_recent))
+
+
+def clear():
+    with _lock:
+        _recent.clear()
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of the requests to busker's URLs. Add it to MIDDLEWARE above SessionMiddleware so that the
+    session write is included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not enabled() or not sampled():
+            return self.get_response(request)
+        with profile(request.path, request.method) as active:
+            # Only kept once process_view() confirms the request resolved to one of busker's views
+            active.discard = True
+            request.busker_profile = active
+            response = self.get_response(request)
+            active.status = response.status_code
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        active = getattr(request, 'busker_profile', None)
+        if active is None:
+            return None
+        if 'busker' not in request.resolver_match.app_names:
+            return None
+        active.discard = False
+        active.name = request.resolver_match.view_name
+        session = getattr(request, 'session', None)
+        if session is not None:
+            session.save = timed('session', session.save)
+        return None
+
+    def process_template_response(self, request, response):
+        if getattr(request, 'busker_profile', None) is not None:
+            with section('template'):
+                response.render()
+        return response
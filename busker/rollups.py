@@ -0,0 +1,109 @@
+"""
+Contains functions for incrementally aggregating UsageEvents into the daily usage rollup tables (DailyWorkUsage,
+DailyBatchUsage and DailyFileUsage), which the admin usage dashboard reads from.
+
+Rollups are resumable and idempotent: events are processed in order of ID, a chunk at a time, and each chunk's
+increments are committed in the same transaction as the watermark recording the last event included. Re-running after
+an interruption picks up where the last committed chunk left off without counting anything twice.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyBatchUsage, DailyFileUsage, DailyWorkUsage, RollupWatermark, UsageEvent
+
+WATERMARK_NAME = 'daily_usage'
+
+#: The rollup fields that events are added to; any others are set to the value from the latest event
+COUNTERS = ('redemptions', 'downloads', 'bytes_served')
+
+
+def _add(totals, key, event_type, count, bytes_served, **attributes):
+    row = totals.setdefault(key, {'redemptions': 0, 'downloads': 0, 'bytes_served': 0})
+    row.update(attributes)
+    if event_type == UsageEvent.REDEMPTION:
+        row['redemptions'] += count
+    else:
+        row['downloads'] += count
+        row['bytes_served'] += bytes_served or 0
+
+
+def _apply(model, lookup_fields, totals):
+    """
+    Adds each row of totals (keyed by a tuple of the values of the rollup's unique fields) to the matching rollup row,
+    creating it if needed.
+    """
+    for key, values in totals.items():
+        lookup = dict(zip(lookup_fields, key))
+        row, created = model.objects.get_or_create(**lookup, defaults=values)
+        if not created:
+            model.objects.filter(pk=row.pk).update(**{field: F(field) + value if field in COUNTERS else value
+                                                      for field, value in values.items()})
+
+
+def rollup_chunk(watermark, upper_id):
+    """
+    Aggregates the events after the watermark, up to and including upper_id, into the rollup tables and advances the
+    watermark. Must be called inside a transaction.
+    """
+    rows = (UsageEvent.objects
+            .filter(id__gt=watermark.last_event_id, id__lte=upper_id)
+            .order_by()
+            .annotate(day=TruncDate('timestamp'))
+            .values('day', 'event_type', 'work_id', 'batch_id', 'file_id')
+            .annotate(count=Count('id'), bytes_served=Sum('bytes'), latest=Max('id'))
+            # A batch or file that moved to another work is recorded against the work of its latest event
+            .order_by('latest'))
+    works, batches, files = {}, {}, {}
+    for row in rows:
+        args = (row['event_type'], row['count'], row['bytes_served'])
+        if row['work_id'] is not None:
+            _add(works, (row['day'], row['work_id']), *args)
+        if row['batch_id'] is not None:
+            _add(batches, (row['day'], row['batch_id']), *args, work_id=row['work_id'])
+        if row['file_id'] is not None:
+            _add(files, (row['day'], row['file_id']), *args, work_id=row['work_id'])
+    _apply(DailyWorkUsage, ('date', 'work_id'), works)
+    _apply(DailyBatchUsage, ('date', 'batch_id'), batches)
+    _apply(DailyFileUsage, ('date', 'file_id'), files)
+    watermark.last_event_id = upper_id
+    watermark.save()
+
+
+def rollup_usage(chunk_size=10000, settle_seconds=60):
+    """
+    Rolls up every UsageEvent recorded since the last run, a chunk of `chunk_size` events per transaction, and returns
+    the number of events processed.
+
+    Events newer than `settle_seconds` are left for the next run, as are any events after them: buffered events can be
+    written a little after they happen, and a transaction can commit events with lower IDs after one with higher IDs,
+    so the watermark only ever advances past events that have had time to settle.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+            pending = UsageEvent.objects.filter(id__gt=watermark.last_event_id)
+            cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+            unsettled = pending.filter(timestamp__gte=cutoff).aggregate(first=Min('id'))['first']
+            if unsettled is not None:
+                pending = pending.filter(id__lt=unsettled)
+            ids = list(pending.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return processed
+            rollup_chunk(watermark, ids[-1])
+            processed += len(ids)
+
+
+def reset_rollups():
+    """
+    Deletes all of the rollups and resets the watermark, so the next rollup_usage() starts from the first event.
+    """
+    with transaction.atomic():
+        DailyWorkUsage.objects.all().delete()
+        DailyBatchUsage.objects.all().delete()
+        DailyFileUsage.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK_NAME).delete()
@@ -0,0 +1,163 @@
+"""
+Contains a database router that sends busker's read-mostly queries to a read replica.
+
+To use it, add a replica to DATABASES, set BUSKER_REPLICA_DATABASE to its alias and add the router and middleware:
+
+    DATABASE_ROUTERS = ['busker.routers.ReplicaRouter']
+    MIDDLEWARE = ['busker.routers.ReplicaPinMiddleware', ...]
+
+Only reads that busker marks as safe for a replica go to it: validate_code() and rendering the confirmation page and
+file list. Everything else, including the admin and all writes, uses the default database. Replicas can lag behind:
+
+- Once a request has written to a busker table (e.g. by redeeming a code), its later reads of that table use the
+  primary, and the middleware sets a cookie that sends all of the client's reads to the primary for the next
+  BUSKER_REPLICA_PIN_SECONDS seconds (default 10), so they see their own writes.
+- If validate_code() doesn't find a code on the replica (it may have just been created), or the replica can't be
+  reached, it asks the primary instead, and the rest of the request reads from the primary.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+#: Name of the cookie that pins a client's reads to the primary
+PIN_COOKIE = 'busker_primary'
+
+#: Pinning every model, rather than a set of model labels
+ALL = frozenset({'*'})
+
+_use_replica = ContextVar('busker_use_replica', default=False)
+_pinned = ContextVar('busker_pinned', default=frozenset())
+
+
+def replica_alias():
+    """
+    Returns the alias of the configured replica database, or None if there isn't one.
+    """
+    alias = getattr(settings, 'BUSKER_REPLICA_DATABASE', None)
+    return alias if alias and alias in connections.databases else None
+
+
+@contextmanager
+def use_replica():
+    """
+    Sends busker's reads inside the block to the replica (unless they are pinned to the primary.)
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def pin(label=None):
+    """
+    Pins the rest of this request's reads of the given model (by label; default all models) to the primary.
+    """
+    pins = _pinned.get()
+    if pins is not ALL:
+        _pinned.set(ALL if label is None else pins | {label})
+
+
+def pinned():
+    return _pinned.get()
+
+
+def reset():
+    _use_replica.set(False)
+    _pinned.set(frozenset())
+
+
+def _replica_for(model=None):
+    if not _use_replica.get() or model is not None and model._meta.app_label != 'busker':
+        return None
+    pins = _pinned.get()
+    if pins is ALL or model is not None and model._meta.label in pins:
+        return None
+    return replica_alias()
+
+
+def read(func):
+    """
+    Returns func(), called with reads going to the replica. If it returns None or the replica fails, it is called again
+    against the primary, and the rest of the request is pinned to the primary.
+    """
+    with use_replica():
+        if _replica_for() is None:
+            return func()
+        try:
+            result = func()
+        except DatabaseError:
+            logger.warning("Read from replica %s failed; using the primary", replica_alias(), exc_info=True)
+            result = None
+        if result is None:
+            pin()
+            result = func()
+        return result
+
+
+async def aread(func):
+    """
+    Async version of read(), for a coroutine function func.
+    """
+    with use_replica():
+        if _replica_for() is None:
+            return await func()
+        try:
+            result = await func()
+        except DatabaseError:
+            logger.warning("Read from replica %s failed; using the primary", replica_alias(), exc_info=True)
+            result = None
+        if result is None:
+            pin()
+            result = await func()
+        return result
+
+
+class ReplicaRouter:
+    """
+    Routes busker's replica-safe reads to BUSKER_REPLICA_DATABASE, and pins models to the primary once they have been
+    written to.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _replica_for(model)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'busker':
+            pin(model._meta.label)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica has the same data as the primary, so objects read from either can be related
+        aliases = {'default', replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaPinMiddleware:
+    """
+    Pins reads to the primary for clients that have recently written to busker's tables, and starts each request with
+    a clean slate.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reset()
+        if request.COOKIES.get(PIN_COOKIE):
+            pin()
+        try:
+            response = self.get_response(request)
+            if pinned() and not request.COOKIES.get(PIN_COOKIE):
+                response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'BUSKER_REPLICA_PIN_SECONDS', 10),
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            reset()
@@ -0,0 +1,88 @@
+"""
+Contains get_or_load(), which coalesces concurrent cache misses for the same key so that only one of them loads the
+value.
+
+Within a process, the first caller to miss a key loads it and the others wait for its result, without holding any lock
+shared with other keys. Across processes, the first to add a lock key to the cache loads the value, and the others
+poll the cache for it for up to BUSKER_SINGLE_FLIGHT_WAIT seconds (default 5) before giving up and loading it
+themselves, so that a slow or failed load doesn't hold everyone else up for long.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+#: Loads in progress in this process, by key
+_flights = {}
+_flights_lock = threading.Lock()
+
+#: How often to check the cache while another process loads a value
+POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    """
+    A load in progress, which other callers for the same key wait for.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+def get_or_load(cache, key, load, is_current=lambda value: value is not None, timeout=None):
+    """
+    Returns the cached value for key if is_current(value), otherwise calls load(), caches the result for timeout
+    seconds and returns it, making sure that only one of the callers that miss the key at the same time calls load().
+    """
+    value = cache.get(key)
+    if is_current(value):
+        return value
+    with _flights_lock:
+        flight = _flights.get(key)
+        loading = flight is None
+        if loading:
+            flight = _flights[key] = _Flight()
+    if not loading:
+        flight.done.wait()
+        if not flight.failed:
+            return flight.value
+        # The load failed; try again ourselves rather than sharing its exception
+        return get_or_load(cache, key, load, is_current, timeout)
+    try:
+        flight.value = _load(cache, key, load, is_current, timeout)
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.value
+
+
+def _load(cache, key, load, is_current, timeout):
+    value = cache.get(key)  # Another thread may have just loaded it
+    if is_current(value):
+        return value
+    lock_key = f"{key}:loading"
+    wait = getattr(settings, 'BUSKER_SINGLE_FLIGHT_WAIT', 5)
+    locked = cache.add(lock_key, 1, timeout=max(1, wait))
+    if not locked:
+        metrics.inc('busker_single_flight_waits_total')
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            value = cache.get(key)
+            if is_current(value):
+                return value
+    try:
+        value = load()
+        cache.set(key, value, timeout)
+    finally:
+        if locked:  # The lock key may belong to the other process we gave up waiting for
+            cache.delete(lock_key)
+    return value
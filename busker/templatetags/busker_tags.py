@@ -0,0 +1,34 @@
+"""
+Template tags for the cached page fragments in busker.fragments.
+"""
+from django import template
+from django.utils.safestring import mark_safe
+
+from .. import fragments
+
+register = template.Library()
+
+
+@register.simple_tag
+def busker_work_thumbnail(work):
+    """
+    Renders the work's thumbnail, if it has an image.
+    """
+    return fragments.render('work_thumbnail', work)
+
+
+@register.simple_tag
+def busker_batch_message(batch):
+    """
+    Renders the batch's public message, if it has one.
+    """
+    return fragments.render('batch_message', batch)
+
+
+@register.simple_tag(takes_context=True)
+def busker_file_list(context, work):
+    """
+    Renders the table rows listing the work's files, with download links for the current session.
+    """
+    token = context['request'].session.get('busker_download_token', '')
+    return mark_safe(fragments.render('file_list', work).replace(fragments.TOKEN_PLACEHOLDER, token))
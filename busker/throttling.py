@@ -0,0 +1,81 @@
+"""
+Contains a cache-backed rate limiter for the code redemption endpoints, to slow down attempts to guess codes.
+
+Throttling is enabled by setting BUSKER_THROTTLE_ENABLED to True. Each code lookup (opening a redeem link, submitting
+the redeem form or confirming a redemption) then counts against two limits, each a (requests, seconds) tuple:
+
+- BUSKER_THROTTLE_IP_RATE (default 30 requests per 60 seconds) per client IP address, as reported by get_client_ip()
+- BUSKER_THROTTLE_PREFIX_RATE (default 60 requests per 60 seconds) per code prefix, the first
+  BUSKER_THROTTLE_PREFIX_LENGTH characters (default 3) of the code looked up, which slows down attacks spread across
+  many IP addresses
+
+Requests over either limit get a plain 429 response before the database is queried. Counts are kept in the
+BUSKER_THROTTLE_CACHE cache (default 'default') using a sliding window approximated from two fixed windows, so the
+cache must be shared by all of the server's processes (e.g. Redis or Memcached) for the limits to apply site-wide.
+"""
+import math
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from . import metrics
+from .util import get_client_ip
+
+
+def enabled():
+    return getattr(settings, 'BUSKER_THROTTLE_ENABLED', False)
+
+
+def hit(key, limit, period, now=None):
+    """
+    Counts a request against a sliding window limit of `limit` requests per `period` seconds. Returns None if the
+    request is allowed, or the number of seconds until it would be.
+
+    The count is the number of requests in the current fixed window plus a share of those in the previous window
+    proportional to how much of it still overlaps the sliding window.
+    """
+    cache = caches[getattr(settings, 'BUSKER_THROTTLE_CACHE', 'default')]
+    now = time.time() if now is None else now
+    window, position = divmod(now, period)
+    current_key, previous_key = f"busker:throttle:{key}:{int(window)}", f"busker:throttle:{key}:{int(window) - 1}"
+    cache.add(current_key, 0, timeout=period * 2)
+    try:
+        current = cache.incr(current_key)
+    except ValueError:  # Expired between add() and incr()
+        cache.set(current_key, 1, timeout=period * 2)
+        current = 1
+    previous = cache.get(previous_key, 0)
+    remaining = 1 - position / period
+    if current + previous * remaining <= limit:
+        return None
+    return max(1, math.ceil(period * remaining))
+
+
+def code_prefix(code):
+    length = getattr(settings, 'BUSKER_THROTTLE_PREFIX_LENGTH', 3)
+    return re.sub(r'[^A-Z0-9]', '', str(code).upper())[:length]
+
+
+def check(request, code=None):
+    """
+    Counts a code lookup by this request's client (and for this code's prefix, if given). Returns a 429 response if
+    either limit has been exceeded, otherwise None.
+    """
+    if not enabled():
+        return None
+    limits = [('ip', get_client_ip(request), getattr(settings, 'BUSKER_THROTTLE_IP_RATE', (30, 60)))]
+    prefix = code_prefix(code) if code else ''
+    if prefix:
+        limits.append(('prefix', prefix, getattr(settings, 'BUSKER_THROTTLE_PREFIX_RATE', (60, 60))))
+    for scope, value, (limit, period) in limits:
+        retry_after = hit(f"{scope}:{value}", limit, period)
+        if retry_after is not None:
+            metrics.inc('busker_throttled_requests_total', scope=scope)
+            response = HttpResponse("Too many attempts. Please wait a moment and try again.", status=429,
+                                    content_type='text/plain')
+            response['Retry-After'] = retry_after
+            return response
+    return None
@@ -1,10 +1,19 @@
 """
 Contains various utility functions used by the busker app.
 """
+import atexit
+import copy
+import json
+import logging
+import queue
+from datetime import datetime, timezone as dt_timezone
 from logging import INFO
+from logging.handlers import QueueHandler, QueueListener
+from django.conf import settings
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.utils import timezone
+from . import profiling
 
 
 def get_client_ip(request):
@@ -19,7 +28,7 @@ def get_client_ip(request):
     return ip
 
 
-def log_activity(logger, obj, message, request, level=INFO):
+def log_activity(logger, obj, message, request, level=INFO, latency=None):
     """
     Logs busker-related activity in a consistent format, with the following information separated by tabs:
     - date + time (in common log format)
@@ -30,12 +39,31 @@ def log_activity(logger, obj, message, request, level=INFO):
     - client user agent
 
     *In the case of DownloadCode objects, the ID and object-as-string will be the same.
+
+    If the BUSKER_ACTIVITY_LOG_FORMAT setting is 'json', the same information (plus `latency`, the time in seconds
+    the request has taken so far, if given) is instead attached to the log record as a dict in its `busker_activity`
+    attribute, to be formatted by ActivityJSONFormatter. Nothing is formatted if the logger isn't enabled for `level`.
     """
+    if not logger.isEnabledFor(level):
+        return
+
     try:
         user_agent = request.META['HTTP_USER_AGENT']
     except KeyError:
         user_agent = 'Unavailable'
 
+    if getattr(settings, 'BUSKER_ACTIVITY_LOG_FORMAT', 'text') == 'json':
+        activity = {
+            'message': message,
+            'object': str(obj),
+            'object_id': str(obj.pk),
+            'client_ip': get_client_ip(request),
+            'user_agent': user_agent,
+            'latency_ms': None if latency is None else round(latency * 1000, 3),
+        }
+        logger.log(level, message, extra={'busker_activity': activity})
+        return
+
     logger.log(
         level,
         f"[{timezone.now().strftime('%d/%b/%Y:%H:%M:%S')}]\t{message}\t{str(obj)}\t{obj.pk}\t"
@@ -48,4 +76,68 @@ def error_page(request, status, title, message):
     Given an HTTP status code, page title, and error message, returns a rendered HttpResponse object.
     """
     context = {'status': status, 'title': title, 'message': message}
-    return HttpResponse(render(request, 'busker/error.html', context=context), status=status)
+    with profiling.section('template'):
+        return HttpResponse(render(request, 'busker/error.html', context=context), status=status)
+
+
+class ActivityJSONFormatter(logging.Formatter):
+    """
+    Formats log records as single-line JSON objects (JSON lines). Records logged by log_activity() in 'json' mode
+    include all of their activity fields; other records just include their message.
+    """
+
+    def format(self, record):
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, dt_timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+        }
+        activity = getattr(record, 'busker_activity', None)
+        if activity is not None:
+            data.update(activity)
+        else:
+            data['message'] = record.getMessage()
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+class ActivityQueueHandler(QueueHandler):
+    """
+    A QueueHandler that enqueues records as-is; unlike the standard library's QueueHandler it doesn't format the
+    message before enqueueing it, so all formatting happens on the QueueListener's thread.
+    """
+
+    def prepare(self, record):
+        return copy.copy(record)
+
+
+class ActivityQueueListener(QueueListener):
+    """
+    A QueueListener that can safely be stopped more than once.
+    """
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def start_activity_log_listener(logger_name='busker.views'):
+    """
+    Moves the handlers attached to the named logger onto a QueueListener running in a background thread and replaces
+    them with an ActivityQueueHandler, so that slow handlers (files, network log collectors, etc.) no longer hold up
+    requests. Returns the started listener, which is stopped (and its queue drained) at exit. Called from
+    BuskerConfig.ready() when the BUSKER_ACTIVITY_LOG_ASYNC setting is True.
+    """
+    logger = logging.getLogger(logger_name)
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, ActivityQueueHandler)]
+    if not handlers:
+        return None
+    records = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(ActivityQueueHandler(records))
+    listener = ActivityQueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,13 +1,17 @@
 import logging
 import os
+import time
+from functools import partial
 from secrets import token_hex
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from django.views.generic import View, FormView
-import magic
+from . import admission, dispatch, fragments, metrics, profiling, routers, throttling
 from .forms import RedeemCodeForm, ConfirmForm
-from .models import DownloadCode, File, validate_code
+from .models import DownloadCode, File, code_archived, confirmable_codes, validate_code
 from .signals import file_pre_download
 from .util import error_page, log_activity
 
@@ -22,15 +26,35 @@ class RedeemView(FormView):
     form_class = ConfirmForm
     code = None
 
+    def dispatch(self, request, *args, **kwargs):
+        self.started = time.perf_counter()
+        throttled = throttling.check(request, kwargs['download_code'])
+        if throttled:
+            return throttled
+        metrics.inc('busker_redeem_requests_total', method=request.method)
+        with metrics.timer('busker_redeem_request_seconds', method=request.method):
+            # Confirming a code continues a redemption that's already under way, so it has priority over new visitors
+            return admission.admit(request, 'redeem', partial(super().dispatch, request, *args, **kwargs),
+                                   priority=request.method == 'POST')
+
     def get(self, *args, **kwargs):
         """
         Validates the code provided as URL argument
         """
         self.code = validate_code(kwargs['download_code'])
         if not self.code:  # TODO instead of 404, use messages to display error and redirect to the redeem form view
+            metrics.inc('busker_invalid_codes_total', source='redeem_view')
+            archived = code_archived(kwargs['download_code'])
+            if archived and archived.expired:
+                return error_page(self.request, 404, "Code Expired", f"The code {kwargs['download_code']} has expired.")
+            if archived:
+                return error_page(self.request, 404, "Code Already Redeemed",
+                                  f"The code {kwargs['download_code']} has already been redeemed.")
             return error_page(self.request, 404, "Invalid Code",
                               f"The code {kwargs['download_code']} has already been redeemed or is not valid.")
-        return self.render_to_response(self.get_context_data())
+        # The confirmation page only reads, so it can be rendered from the replica (if there is one)
+        with routers.use_replica():
+            return self.render_to_response(self.get_context_data()).render()
 
     def get_initial(self):
         initial = super().get_initial()
@@ -46,21 +70,34 @@ class RedeemView(FormView):
         """
         Once the form has been submitted, increment the usage count and display the list of downloadable files.
         """
-        code = DownloadCode.objects.get(id=form.cleaned_data['code'], batch__work__published=True)
+        try:
+            code = confirmable_codes(form.cleaned_data['code']).select_related('batch', 'work__artist').get()
+        except DownloadCode.DoesNotExist:  # e.g. revoked since the form was displayed
+            return error_page(self.request, 404, "Invalid Code",
+                              f"The code {form.cleaned_data['code']} is no longer valid.")
         code.redeem(request=self.request)
         # Save a token in the session which will subsequently be used to validate download links:
         self.request.session['busker_download_token'] = token_hex(16)
+        # ...and the code, so that downloads can be attributed to it
+        self.request.session['busker_download_code'] = code.pk
+        self.request.session['busker_download_batch'] = str(code.batch_id)
         self.request.session.modified = True
-        log_activity(logger, code, "Code Redeemed", self.request)
+        log_activity(logger, code, "Code Redeemed", self.request, latency=time.perf_counter() - self.started)
         context = self.get_context_data()
         context['code'] = code
-        return render(self.request, 'busker/file_list.html', context=context)
+        # Redeeming the code has pinned the tables it wrote to to the primary, so only the files come from the replica
+        with routers.use_replica(), profiling.section('template'):
+            return render(self.request, 'busker/file_list.html', context=context)
 
 
 class DownloadView(View):
     """
     Handles the actual downloading of files.
     """
+    def dispatch(self, request, *args, **kwargs):
+        self.started = time.perf_counter()
+        return admission.admit(request, 'download', partial(super().dispatch, request, *args, **kwargs))
+
     def get(self, request, *args, **kwargs):
         if 'busker_download_token' not in request.session \
                 or request.GET.get('t') != request.session['busker_download_token']:
@@ -70,17 +107,35 @@ class DownloadView(View):
             file = File.objects.get(id=kwargs['file_id'])
         except File.DoesNotExist:
             return error_page(self.request, 404, "No Such File", "The file you requested does not exist.")
-        log_activity(logger, file, "File Downloaded", self.request)
+        log_activity(logger, file, "File Downloaded", self.request, latency=time.perf_counter() - self.started)
 
-        mime = magic.Magic(mime=True)
+        size, content_type = fragments.file_metadata(file)
         filename = os.path.basename(file.file.path)
-        file_pre_download.send(sender=self.__class__, request=self.request, file=file)
-        response = HttpResponse(file.file, content_type=mime.from_file(file.file.path))
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Length'] = file.file.size
+        with profiling.section('file_pre_download'):
+            dispatch.send(file_pre_download, sender=self.__class__, request=self.request, file=file)
+        # FileResponse streams the file in blocks rather than reading all of it into memory
+        response = FileResponse(file.file.open('rb'), as_attachment=True, filename=filename,
+                                content_type=content_type)
+        metrics.inc('busker_download_requests_total', work=file.work_id)
+        metrics.inc('busker_download_bytes_total', size, work=file.work_id)
         return response
 
 
+class MetricsView(View):
+    """
+    Exposes busker's metrics in the Prometheus text format. Returns 404 unless BUSKER_METRICS_ENABLED is True; if
+    BUSKER_METRICS_TOKEN is set, requests must include an `Authorization: Bearer [token]` header.
+    """
+    def get(self, request, *args, **kwargs):
+        if not metrics.enabled():
+            raise Http404
+        token = getattr(settings, 'BUSKER_METRICS_TOKEN', None)
+        if token and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f"Bearer {token}"):
+            return HttpResponse("Unauthorized", status=401, content_type='text/plain')
+        return HttpResponse(metrics.render_prometheus(metrics.collect()),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class RedeemFormView(FormView):
     """
     Simple form for manual entry of a code. Does not validate anything on submission; validation happens in RedeemView
@@ -89,6 +144,9 @@ class RedeemFormView(FormView):
     template_name = 'busker/redeem_form.html'
     entered_code = None
 
+    def post(self, request, *args, **kwargs):
+        return throttling.check(request, request.POST.get('code')) or super().post(request, *args, **kwargs)
+
     def form_valid(self, form):
         self.entered_code = form.cleaned_data['code']
         return super().form_valid(form)
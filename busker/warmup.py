@@ -0,0 +1,43 @@
+"""
+Contains functions for filling busker's caches for a work or batch ahead of time, e.g. just before a release is
+announced, so that the first visitors don't all miss the caches at once.
+
+Warming a work generates its thumbnail and caches its rendered fragments and the metadata of its files (see
+busker.fragments); warming a batch caches its public message and warms its work. Values are written to the shared
+cache, from which each server's in-process cache fills up on first use.
+"""
+from . import fragments
+from .models import Batch, DownloadableWork
+
+
+def warm_work(work):
+    """
+    Warms the caches for a work. Returns the number of thumbnails, fragments and files warmed, as a dict.
+    """
+    counts = {'thumbnails': 0, 'fragments': 0, 'files': 0}
+    if work.image:
+        work.thumbnail.generate()
+        counts['thumbnails'] += 1
+    for name in ('work_thumbnail', 'file_list'):
+        fragments.render(name, work)
+        counts['fragments'] += 1
+    for file in work.files.all():
+        fragments.file_metadata(file)
+        counts['files'] += 1
+    return counts
+
+
+def warm(works=(), batches=()):
+    """
+    Warms the caches for the given works and batches (querysets or lists of IDs), and the batches' works. Returns the
+    total number of thumbnails, fragments and files warmed, as a dict.
+    """
+    counts = {'thumbnails': 0, 'fragments': 0, 'files': 0}
+    batches = Batch.objects.filter(pk__in=batches)
+    for batch in batches:
+        fragments.render('batch_message', batch)
+        counts['fragments'] += 1
+    for work in DownloadableWork.objects.filter(pk__in=[*works, *batches.values_list('work_id', flat=True)]):
+        for key, count in warm_work(work).items():
+            counts[key] += count
+    return counts
@@ -0,0 +1,194 @@
+"""
+Contains busker's webhook outbox and delivery worker.
+
+When a code is redeemed or a file downloaded, a WebhookEvent is written for each active WebhookEndpoint subscribed to
+that kind of event (in the same transaction as the redemption itself, or before a download is sent), so no HTTP
+requests are made while handling the user's request and no events are lost if the process dies. The
+busker_deliver_webhooks management command then POSTs pending events to each endpoint in batches of up to the
+endpoint's batch_size, as a JSON object of the form:
+
+    {"events": [{"id": "<event UUID>", "type": "code.redeemed", "date": "...", ...}, ...]}
+
+Each request is signed with the endpoint's secret: the X-Busker-Signature header is "sha256=" followed by the hex
+HMAC-SHA256 of "<X-Busker-Timestamp header>.<request body>". A batch is delivered when the endpoint responds with any
+2xx status. Otherwise every event in it is retried with exponential backoff (BUSKER_WEBHOOK_RETRY_DELAY seconds,
+default 30, doubling with each attempt up to six hours) until BUSKER_WEBHOOK_MAX_ATTEMPTS attempts (default 8) have
+failed, after which it is marked as failed (dead-lettered) and can be retried from the admin.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import dispatch
+from .models import UsageEvent, WebhookEndpoint, WebhookEvent
+from .signals import code_post_redeem, file_pre_download
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+EVENT_NAMES = {
+    UsageEvent.REDEMPTION: 'code.redeemed',
+    UsageEvent.DOWNLOAD: 'file.downloaded',
+}
+
+
+def enqueue(event_type, data):
+    """
+    Writes a WebhookEvent with the given data for every active endpoint subscribed to event_type. Returns the number
+    of events written.
+    """
+    endpoints = WebhookEndpoint.objects.filter(active=True)
+    if event_type == UsageEvent.REDEMPTION:
+        endpoints = endpoints.filter(send_redemptions=True)
+    else:
+        endpoints = endpoints.filter(send_downloads=True)
+    now = timezone.now()
+    payload = json.dumps({'type': EVENT_NAMES[event_type], 'date': now.isoformat(), **data})
+    events = [WebhookEvent(endpoint_id=endpoint_id, event_type=event_type, payload=payload, created_date=now,
+                           next_attempt_date=now)
+              for endpoint_id in endpoints.values_list('pk', flat=True)]
+    WebhookEvent.objects.bulk_create(events)
+    return len(events)
+
+
+@dispatch.receiver(code_post_redeem)
+def code_redeemed(sender, code, **kwargs):
+    enqueue(UsageEvent.REDEMPTION, {
+        'code': code.pk,
+        'batch': str(code.batch_id),
+        'work': str(code.work_id),
+        'times_used': code.times_used,
+        'max_uses': code.max_uses,
+    })
+
+
+@dispatch.receiver(file_pre_download)
+def file_downloaded(sender, file, request=None, **kwargs):
+    session = getattr(request, 'session', {})
+    enqueue(UsageEvent.DOWNLOAD, {
+        'file': str(file.pk),
+        'work': str(file.work_id),
+        'code': session.get('busker_download_code'),
+        'batch': session.get('busker_download_batch'),
+        'bytes': file.file.size,
+    })
+
+
+def sign(secret, timestamp, body):
+    return 'sha256=' + hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+
+def retry_delay(attempts):
+    """
+    Returns the number of seconds to wait before the next attempt, after `attempts` failed attempts: exponential
+    backoff with up to 10% jitter, so that retries from a batch of failures don't all arrive at once.
+    """
+    delay = min(getattr(settings, 'BUSKER_WEBHOOK_RETRY_DELAY', 30) * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return delay * random.uniform(1, 1.1)
+
+
+def post(endpoint, events):
+    """
+    POSTs a batch of events to an endpoint. Returns None on success, or a description of the error.
+    """
+    body = json.dumps({'events': [{'id': str(event.event_id), **json.loads(event.payload)} for event in events]})
+    body = body.encode()
+    timestamp = str(int(time.time()))
+    request = urllib.request.Request(endpoint.url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'User-Agent': 'django-busker',
+        'X-Busker-Timestamp': timestamp,
+        'X-Busker-Signature': sign(endpoint.secret, timestamp, body),
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=getattr(settings, 'BUSKER_WEBHOOK_TIMEOUT', 10)) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        return f"HTTP {e.code}"
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return str(getattr(e, 'reason', e))
+    return None
+
+
+def claim(endpoint):
+    """
+    Claims up to endpoint.batch_size of its due events, by pushing their next attempt date past the time a delivery
+    can take. Other workers skip claimed events; if this worker dies, they become due again once the claim expires.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'BUSKER_WEBHOOK_TIMEOUT', 10) * 3)
+    with transaction.atomic():
+        events = list(WebhookEvent.objects
+                      .select_for_update(skip_locked=True)
+                      .filter(endpoint=endpoint, status=WebhookEvent.PENDING, next_attempt_date__lte=now)
+                      .order_by('id')[:endpoint.batch_size])
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(next_attempt_date=now + lease)
+    return events
+
+
+def deliver_batch(endpoint, events):
+    """
+    Sends a batch of claimed events to an endpoint and records the outcome. Returns True if it was delivered.
+    """
+    error = post(endpoint, events)
+    now = timezone.now()
+    if error is None:
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            status=WebhookEvent.DELIVERED, delivered_date=now, attempts=F('attempts') + 1, last_error='')
+        return True
+    logger.warning("Webhook delivery of %d events to %s failed: %s", len(events), endpoint.url, error)
+    max_attempts = getattr(settings, 'BUSKER_WEBHOOK_MAX_ATTEMPTS', 8)
+    dead = 0
+    for event in events:
+        event.attempts += 1
+        event.last_error = error
+        if event.attempts >= max_attempts:
+            event.status = WebhookEvent.DEAD
+            dead += 1
+        else:
+            event.next_attempt_date = now + timedelta(seconds=retry_delay(event.attempts))
+    WebhookEvent.objects.bulk_update(events, ['attempts', 'last_error', 'status', 'next_attempt_date'])
+    if dead:
+        logger.error("Gave up on %d webhook events for %s after %d attempts", dead, endpoint.url, max_attempts)
+    return False
+
+
+def deliver_webhooks():
+    """
+    Delivers every due event, a batch at a time for each endpoint. An endpoint whose batch fails is not tried again
+    until the next run. Returns a (delivered, failed) tuple of event counts.
+    """
+    delivered = failed = 0
+    endpoints = WebhookEndpoint.objects.filter(
+        pk__in=WebhookEvent.objects.filter(status=WebhookEvent.PENDING, next_attempt_date__lte=timezone.now())
+        .values('endpoint'))
+    for endpoint in endpoints:
+        while True:
+            events = claim(endpoint)
+            if not events:
+                break
+            if deliver_batch(endpoint, events):
+                delivered += len(events)
+            else:
+                failed += len(events)
+                break
+    return delivered, failed
+
+
+def retry(events):
+    """
+    Makes the given events (e.g. failed ones) due for delivery again, with a fresh set of attempts.
+    """
+    return events.update(status=WebhookEvent.PENDING, attempts=0, next_attempt_date=timezone.now())
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+import os
+from shutil import rmtree
+import sys
+import django
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    django.setup()
+    from benchmarks.suite import main
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        status = main(sys.argv[1:])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        rmtree(settings.MEDIA_ROOT)
+    sys.exit(status)
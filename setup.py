@@ -4,9 +4,12 @@ setup(
     install_requires=[
         'python-magic>=0.4.24',
         'Pillow>=9.0.0',
-        'Django>=3.0',
+        'Django>=3.2',
         'django-markdownfield>=0.10.0',
         'django-queryset-csv>=1.1.0',
         'django-imagekit>=4.1',
-    ]
+    ],
+    extras_require={
+        'cards': ['qrcode>=7.0'],
+    },
 )
@@ -82,7 +82,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Only used by tests.test_routers, as a stand-in read replica (a separate database, so that replication lag can be
+    # simulated by writing to just one of them)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',
+    },
 }
 
 
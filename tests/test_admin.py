@@ -1,18 +1,25 @@
 import os
+from datetime import timedelta
 from random import randint
 import tempfile
+from unittest import mock
 
 from PIL import Image
 from django.contrib.admin.sites import AdminSite
 from django.contrib.auth.models import User
 from django.core.files import File
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.test.client import RequestFactory
 from django.urls import reverse
+from django.utils import timezone
 
-from busker.admin import BatchAdmin, DownloadCodeAdmin
-from busker.models import Artist, File as BuskerFile, DownloadCode, DownloadableWork, Batch, work_file_path, work_image_path, \
-    validate_code, generate_code
+from busker.admin import BatchAdmin, DownloadCodeAdmin, DownloadableWorkAdmin
+from busker.archive import expire_codes
+from busker.paginators import EstimatedCountPaginator, estimate_row_count
+from busker.models import Artist, File as BuskerFile, DownloadCode, DownloadableWork, Batch, BatchStats, \
+    work_file_path, work_image_path, validate_code, generate_code, ArchivedDownloadCode
 from busker.util import get_client_ip, error_page
 
 
@@ -64,6 +71,76 @@ class BatchAdminTestCase(TestCase):
         batch_2 = Batch.objects.create(work=work, label="test", public_message="")
         self.assertFalse(batch_admin.work_published(instance=batch_2))
 
+    def test_batch_admin_stats(self):
+        batch_admin = BatchAdmin(model=Batch, admin_site=AdminSite())
+        self.batch.codes.first().redeem()
+        batch = Batch.objects.select_related('stats').get(pk=self.batch.pk)
+        self.assertEqual(batch_admin.codes_total(batch), 10)
+        self.assertEqual(batch_admin.codes_used(batch), 1)
+        self.assertEqual(batch_admin.redemptions(batch), 1)
+        self.assertEqual(batch_admin.codes_exhausted(batch), 0)
+
+        BatchStats.objects.filter(batch=self.batch).delete()
+        batch = Batch.objects.select_related('stats').get(pk=self.batch.pk)
+        self.assertIsNone(batch_admin.codes_total(batch))
+
+    def test_stats_columns_sortable(self):
+        for url in (reverse('admin:busker_batch_changelist'), reverse('admin:busker_downloadablework_changelist')):
+            for column in range(2, 8):
+                response = self.client.get(url, {'o': f'-{column}'})
+                self.assertEqual(response.status_code, 200)
+
+    def test_batch_bulk_code_actions(self):
+        """
+        Bulk actions on the batch changelist apply to every code in the selected batches.
+        """
+        other_batch = Batch.objects.create(work=self.work, label="Not selected", public_message="", number_of_codes=2)
+        url = reverse('admin:busker_batch_changelist')
+        data = {'action': 'set_max_uses', 'value': 7, '_selected_action': [self.batch.pk]}
+        self.client.post(url, data)
+        self.assertEqual(set(self.batch.codes.values_list('max_uses', flat=True)), {7})
+        self.assertEqual(set(other_batch.codes.values_list('max_uses', flat=True)), {3})
+
+        self.batch.codes.first().redeem()
+        self.client.post(url, {'action': 'reset_times_used', '_selected_action': [self.batch.pk]})
+        self.assertEqual(set(self.batch.codes.values_list('times_used', flat=True)), {0})
+        self.assertEqual(BatchStats.objects.get(batch=self.batch).codes_used, 0)
+
+        self.client.post(url, {'action': 'revoke_codes', '_selected_action': [self.batch.pk]})
+        self.assertFalse(validate_code(self.batch.codes.first().pk))
+        self.assertTrue(validate_code(other_batch.codes.first().pk))
+
+    def test_batch_add_codes_action(self):
+        url = reverse('admin:busker_batch_changelist')
+        self.client.post(url, {'action': 'add_codes', 'value': 4, '_selected_action': [self.batch.pk]})
+        self.assertEqual(self.batch.codes.count(), 14)
+        self.assertEqual(Batch.objects.get(pk=self.batch.pk).number_of_codes, 14)
+
+    def test_work_admin_stats(self):
+        work_admin = DownloadableWorkAdmin(model=DownloadableWork, admin_site=AdminSite())
+        Batch.objects.create(work=self.work, label="Second batch", public_message="", number_of_codes=5)
+        self.batch.codes.first().redeem()
+        work = work_admin.get_queryset(request=None).get(pk=self.work.pk)
+        self.assertEqual(work_admin.codes_total(work), 15)
+        self.assertEqual(work_admin.redemptions(work), 1)
+        self.assertIsNotNone(work_admin.last_redeemed_date(work))
+
+    def test_batch_changelist_query_count(self):
+        """
+        The number of queries run by the batch changelist should not grow with the number of batches displayed.
+        """
+        url = reverse('admin:busker_batch_changelist')
+        with CaptureQueriesContext(connection) as initial:
+            self.client.get(url)
+        for i in range(0, 5):
+            artist = Artist.objects.create(name=f"Artist {i}")
+            work = DownloadableWork.objects.create(title=f"Work {i}", artist=artist)
+            Batch.objects.create(work=work, label=f"Batch {i}", public_message="", number_of_codes=1)
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(url)
+        self.assertContains(response, "Work 4 by Artist 4")
+        self.assertEqual(len(initial), len(more))
+
     def test_batch_admin_download_as_csv(self):
         """
         Tests that the 'Download CSV' batch admin option returns CSV data.
@@ -130,6 +207,73 @@ class DownloadCodeAdminTestCase(TestCase):
         code2 = DownloadCode.objects.create(batch=unpub_batch)
         self.assertFalse(code_admin.work_published(instance=code2))
 
+        # An expired code still shows the status of its work
+        code3 = DownloadCode.objects.create(batch=self.batch, expires_at=timezone.now() - timedelta(days=2))
+        expire_codes(min_age_days=1)
+        code3.refresh_from_db()
+        self.assertFalse(code3.is_active)
+        self.assertTrue(code_admin.work_published(instance=code3))
+
+    def test_code_bulk_actions(self):
+        url = reverse('admin:busker_downloadcode_changelist')
+        unlimited = DownloadCode.objects.create(batch=self.batch, max_uses=0)
+        selected = list(self.batch.codes.exclude(pk=unlimited.pk).values_list('pk', flat=True)[:3]) + [unlimited.pk]
+
+        self.client.post(url, {'action': 'increase_max_uses', 'value': 2, '_selected_action': selected})
+        self.assertEqual(DownloadCode.objects.get(pk=selected[0]).max_uses, 5)
+        self.assertEqual(DownloadCode.objects.get(pk=unlimited.pk).max_uses, 0,
+                         "Increasing max uses should leave unlimited codes unlimited")
+        self.assertEqual(DownloadCode.objects.filter(max_uses=5).count(), 3)
+
+        self.client.post(url, {'action': 'revoke_codes', '_selected_action': selected})
+        self.assertEqual(DownloadCode.objects.filter(revoked=True).count(), 4)
+        self.assertFalse(validate_code(selected[0]))
+        self.client.post(url, {'action': 'restore_codes', '_selected_action': selected[:1]})
+        self.assertEqual(validate_code(selected[0]).pk, selected[0])
+
+    def test_code_bulk_action_requires_value(self):
+        url = reverse('admin:busker_downloadcode_changelist')
+        code = self.batch.codes.first()
+        response = self.client.post(url, {'action': 'set_max_uses', 'value': '', '_selected_action': [code.pk]},
+                                    follow=True)
+        self.assertContains(response, "Please enter a value")
+        self.assertEqual(DownloadCode.objects.get(pk=code.pk).max_uses, 3)
+
+    def test_code_admin_change_rebuilds_stats(self):
+        code = self.batch.codes.first()
+        url = reverse('admin:busker_downloadcode_change', args=[code.pk])
+        data = {'id': code.pk, 'batch': self.batch.pk, 'max_uses': 1, 'times_used': 1}
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        stats = BatchStats.objects.get(batch=self.batch)
+        self.assertEqual((stats.codes_used, stats.codes_exhausted, stats.redemptions), (1, 1, 1))
+
+        other_batch = Batch.objects.create(work=self.work, label="Other Batch", public_message="", number_of_codes=1)
+        self.client.post(url, dict(data, batch=other_batch.pk))
+        stats = BatchStats.objects.get(batch=self.batch)
+        self.assertEqual((stats.codes_total, stats.codes_used, stats.codes_exhausted, stats.redemptions), (9, 0, 0, 0))
+        stats = BatchStats.objects.get(batch=other_batch)
+        self.assertEqual((stats.codes_total, stats.codes_used, stats.codes_exhausted, stats.redemptions), (2, 1, 1, 1))
+
+        self.client.post(reverse('admin:busker_downloadcode_delete', args=[code.pk]), {'post': 'yes'})
+        self.assertEqual(BatchStats.objects.get(batch=other_batch).codes_total, 1)
+
+    def test_code_changelist_query_count(self):
+        """
+        The number of queries run by the code changelist should not grow with the number of codes displayed.
+        """
+        url = reverse('admin:busker_downloadcode_changelist')
+        with CaptureQueriesContext(connection) as initial:
+            self.client.get(url)
+        for i in range(0, 5):
+            artist = Artist.objects.create(name=f"Artist {i}")
+            work = DownloadableWork.objects.create(title=f"Work {i}", artist=artist)
+            Batch.objects.create(work=work, label=f"Batch {i}", public_message="", number_of_codes=5)
+        with CaptureQueriesContext(connection) as more:
+            response = self.client.get(url)
+        self.assertContains(response, "Work 4 by Artist 4")
+        self.assertEqual(len(initial), len(more))
+
     def test_code_admin_download_as_csv(self):
         """
         Tests that the 'Download CSV' batch admin option returns CSV data.
@@ -147,3 +291,51 @@ class DownloadCodeAdminTestCase(TestCase):
         self.assertEqual(response.get('Content-Disposition'), 'attachment; filename=downloadcode_export.csv;')
 
 
+class EstimatedCountPaginatorTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Paginator Test Batch", public_message="",
+                                          number_of_codes=25)
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def test_estimate_row_count(self):
+        self.analyze()
+        self.assertEqual(estimate_row_count(DownloadCode), 25)
+        # No statistics for an empty table
+        self.assertIsNone(estimate_row_count(ArchivedDownloadCode))
+
+    def test_estimate_row_count_vendors(self):
+        for vendor, table in (('postgresql', 'pg_class'), ('mysql', 'information_schema.tables')):
+            with mock.patch.object(connection, 'vendor', vendor), CaptureQueriesContext(connection) as queries:
+                # These queries fail on SQLite, which is taken as there being no estimate...
+                self.assertIsNone(estimate_row_count(DownloadCode))
+            self.assertTrue(any(table in query['sql'] for query in queries))
+            # ...without breaking the test's transaction
+            self.assertEqual(DownloadCode.objects.count(), 25)
+        with mock.patch.object(connection, 'vendor', 'oracle'), self.assertNumQueries(0):
+            self.assertIsNone(estimate_row_count(DownloadCode))
+
+    @override_settings(BUSKER_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_unfiltered_uses_estimate(self):
+        self.analyze()
+        DownloadCode.objects.create(batch=self.batch)  # Not reflected in the table statistics until re-analyzed
+        paginator = EstimatedCountPaginator(DownloadCode.objects.all(), 10)
+        self.assertEqual(paginator.count, 25)
+
+    @override_settings(BUSKER_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_filtered_counts_exactly(self):
+        self.analyze()
+        DownloadCode.objects.create(batch=self.batch, times_used=1)
+        paginator = EstimatedCountPaginator(DownloadCode.objects.filter(batch=self.batch), 10)
+        self.assertEqual(paginator.count, 26)
+
+    def test_below_threshold_counts_exactly(self):
+        self.analyze()
+        DownloadCode.objects.create(batch=self.batch)
+        paginator = EstimatedCountPaginator(DownloadCode.objects.all(), 10)
+        self.assertEqual(paginator.count, 26)
@@ -0,0 +1,113 @@
+from secrets import token_hex
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from busker import admission
+from busker.models import Artist, DownloadableWork, Batch, File as BuskerFile
+
+
+@override_settings(BUSKER_ADMISSION_ENABLED=True, BUSKER_ADMISSION_LIMITS={'redeem': 5, 'download': 1})
+class AdmissionTestCase(TestCase):
+    """
+    Tests for busker.admission
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Admission Test Batch", public_message="",
+                                          number_of_codes=1, max_uses=5)
+        self.code = self.batch.codes.first()
+        self.file = BuskerFile(work=self.work, description="Teeth")
+        self.file.file.save(name="teeth.txt", content=ContentFile(b"busker"))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_acquire(self):
+        # 20% of the limit of 5 is kept for priority requests
+        self.assertEqual((admission.limit('redeem'), admission.limit('redeem', priority=True)), (4, 5))
+        self.assertTrue(all(admission.acquire('redeem') for i in range(4)))
+        self.assertFalse(admission.acquire('redeem'))
+        self.assertTrue(admission.acquire('redeem', priority=True))
+        self.assertFalse(admission.acquire('redeem', priority=True))
+        self.assertEqual(admission.in_progress('redeem'), 5)
+        admission.release('redeem')
+        self.assertEqual(admission.in_progress('redeem'), 4)
+        # A count reset while requests are in progress doesn't go negative
+        cache.set(admission.count_key('redeem'), 0)
+        admission.release('redeem')
+        self.assertEqual(admission.in_progress('redeem'), 0)
+        cache.delete(admission.count_key('redeem'))
+        admission.release('redeem')
+
+    @override_settings(BUSKER_ADMISSION_COUNT_TIMEOUT=60)
+    def test_acquire_refreshes_timeout(self):
+        with mock.patch.object(cache, 'touch', wraps=cache.touch) as touch:
+            admission.acquire('redeem')
+            admission.acquire('redeem')
+        self.assertEqual(touch.call_args_list, [mock.call(admission.count_key('redeem'), 60)] * 2)
+        self.assertEqual(admission.in_progress('redeem'), 2)
+
+    def test_acquire_after_expiry(self):
+        def expire(key):
+            # The count expires between adding and incrementing it
+            cache.delete(key)
+            raise ValueError
+
+        with mock.patch.object(cache, 'incr', side_effect=expire):
+            self.assertTrue(admission.acquire('redeem'))
+        self.assertEqual(admission.in_progress('redeem'), 1)
+
+    def test_released_on_error(self):
+        def get_response():
+            self.assertEqual(admission.in_progress('redeem'), 1)
+            raise RuntimeError("view failed")
+
+        with self.assertRaises(RuntimeError):
+            admission.admit(None, 'redeem', get_response)
+        self.assertEqual(admission.in_progress('redeem'), 0)
+
+    def test_redeem(self):
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(admission.in_progress('redeem'), 0)
+        for i in range(4):
+            admission.acquire('redeem')
+        response = self.client.get(url)
+        self.assertContains(response, "Please Wait", status_code=503)
+        self.assertContains(response, '<meta http-equiv="refresh" content="5">', status_code=503)
+        self.assertEqual(response['Retry-After'], '5')
+        # Confirming the code has priority
+        response = self.client.post(url, data={'code': self.code.pk})
+        self.assertContains(response, "teeth.txt")
+        self.assertEqual(admission.in_progress('redeem'), 4)
+
+    def test_download(self):
+        token = token_hex(16)
+        session = self.client.session
+        session['busker_download_token'] = token
+        session.save()
+        url = reverse('busker:download', kwargs={'file_id': self.file.pk}) + f"?t={token}"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # The download counts until the file has been sent
+        self.assertEqual(admission.in_progress('download'), 1)
+        self.assertEqual(self.client.get(url).status_code, 503)
+        self.assertEqual(b''.join(response.streaming_content), b"busker")
+        self.assertEqual(admission.in_progress('download'), 0)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    @override_settings(BUSKER_ADMISSION_ENABLED=False)
+    def test_disabled(self):
+        for i in range(5):
+            admission.acquire('redeem', priority=True)
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        self.assertEqual(self.client.get(url).status_code, 200)
@@ -0,0 +1,164 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from busker import archive
+from busker.forms import EXPIRED_CODE_MESSAGE, REDEEMED_CODE_MESSAGE, RedeemCodeForm
+from busker.formatters import format_codes_csv
+from busker.models import Artist, ArchivedDownloadCode, Batch, BatchStats, DownloadableWork, DownloadCode, \
+    code_archived, create_codes, validate_code
+
+
+class ArchiveTestCase(TestCase):
+    """
+    Tests for the busker.archive module
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Archive Test Batch", public_message="",
+                                          number_of_codes=5, max_uses=1)
+        self.codes = list(self.batch.codes.all())
+        for code in self.codes[:3]:
+            code.redeem()
+        # Two of the exhausted codes were last used long enough ago to be archived
+        DownloadCode.objects.filter(pk__in=[code.pk for code in self.codes[:2]]).update(
+            last_used_date=timezone.now() - timedelta(days=60))
+
+    def test_archive_codes(self):
+        self.assertEqual(archive.archive_codes(chunk_size=1), 2)
+        self.assertEqual(set(ArchivedDownloadCode.objects.values_list('pk', flat=True)),
+                         {code.pk for code in self.codes[:2]})
+        archived = ArchivedDownloadCode.objects.get(pk=self.codes[0].pk)
+        self.assertEqual((archived.batch, archived.work, archived.times_used, archived.max_uses),
+                         (self.batch, self.work, 1, 1))
+        self.assertEqual(self.batch.codes.count(), 3)
+        self.assertEqual(archive.archive_codes(), 0)
+
+    def test_stats_include_archive(self):
+        archive.archive_codes()
+        BatchStats.rebuild([self.batch.pk])
+        stats = BatchStats.objects.get(batch=self.batch)
+        self.assertEqual((stats.codes_total, stats.codes_used, stats.redemptions, stats.codes_exhausted), (5, 3, 3, 3))
+
+    def test_archived_code_messages(self):
+        archive.archive_codes()
+        code = self.codes[0].pk
+        self.assertFalse(validate_code(code))
+        self.assertTrue(code_archived(code.lower()))
+        self.assertFalse(code_archived('NOTCODE'))
+        form = RedeemCodeForm({'code': code})
+        self.assertEqual(form.errors['code'], [REDEEMED_CODE_MESSAGE])
+        response = self.client.get(reverse('busker:redeem', kwargs={'download_code': code}))
+        self.assertContains(response, f"The code {code} has already been redeemed.", status_code=404)
+
+    def test_new_codes_skip_archived(self):
+        archive.archive_codes()
+        archived = set(ArchivedDownloadCode.objects.values_list('pk', flat=True))
+        candidates = iter(list(archived) + ['NEW0001'])
+        with mock.patch('busker.models.random_code', side_effect=lambda: next(candidates)):
+            self.assertEqual(create_codes(self.batch, 1), 1)
+        self.assertTrue(DownloadCode.objects.filter(pk='NEW0001').exists())
+
+    def test_csv_includes_archive(self):
+        archive.archive_codes()
+        response = format_codes_csv(DownloadCode.objects.filter(batch=self.batch),
+                                    archived=ArchivedDownloadCode.objects.filter(batch=self.batch))
+        content = b''.join(response.streaming_content if response.streaming else [response.content]).decode()
+        self.assertEqual(len(content.strip().splitlines()), 6)
+        for code in self.codes:
+            self.assertIn(code.pk, content)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('busker_archive_codes', '--min-age', '0', stdout=out)
+        self.assertIn("Archived 3 codes.", out.getvalue())
+
+    def test_admin(self):
+        archive.archive_codes()
+        self.client.force_login(User.objects.create_superuser(username='test', password='test'))
+        response = self.client.get(reverse('admin:busker_archiveddownloadcode_changelist'))
+        self.assertContains(response, self.codes[0].pk)
+        url = reverse('admin:busker_archiveddownloadcode_change', args=[self.codes[0].pk])
+        self.assertNotContains(self.client.get(url), 'name="_save"')
+
+
+class ExpiryTestCase(TestCase):
+    """
+    Tests for code expiry dates and the busker_expire_codes command
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Expiry Test Batch", public_message="",
+                                          number_of_codes=3, expires_at=timezone.now() + timedelta(days=1))
+        self.code = self.batch.codes.first()
+
+    def expire_batch(self):
+        self.batch.expires_at = timezone.now() - timedelta(days=1)
+        self.batch.save()
+
+    def test_codes_inherit_batch_expiry(self):
+        self.assertEqual(set(self.batch.codes.values_list('expires_at', flat=True)), {self.batch.expires_at})
+        self.assertEqual(DownloadCode.objects.create(batch=self.batch).expires_at, self.batch.expires_at)
+        self.assertEqual(validate_code(self.code.pk), self.code)
+
+    def test_expired_code_invalid(self):
+        DownloadCode.objects.filter(pk=self.code.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(validate_code(self.code.pk))
+        self.assertTrue(validate_code(self.batch.codes.last().pk))
+
+    def test_batch_expiry_change(self):
+        self.expire_batch()
+        self.assertEqual(set(self.batch.codes.values_list('expires_at', 'is_active')), {(self.batch.expires_at, False)})
+        self.batch.expires_at = None
+        self.batch.save()
+        self.assertEqual(set(self.batch.codes.values_list('expires_at', 'is_active')), {(None, True)})
+
+    def test_code_override_kept(self):
+        DownloadCode.objects.filter(pk=self.code.pk).update(expires_at=None)
+        self.batch.label = "Renamed"
+        self.batch.save()
+        self.assertIsNone(DownloadCode.objects.get(pk=self.code.pk).expires_at)
+
+    def test_publish_skips_expired(self):
+        DownloadCode.objects.filter(pk=self.code.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.work.published = False
+        self.work.save()
+        self.work.published = True
+        self.work.save()
+        self.assertFalse(DownloadCode.objects.get(pk=self.code.pk).is_active)
+        self.assertEqual(self.batch.codes.filter(is_active=True).count(), 2)
+
+    def test_expire_codes(self):
+        DownloadCode.objects.filter(batch=self.batch).update(expires_at=timezone.now() - timedelta(seconds=1))
+        # Recently expired codes are left alone for a while
+        self.assertEqual(archive.expire_codes(), 0)
+        self.assertEqual(archive.expire_codes(chunk_size=2, min_age_days=0), 3)
+        self.assertFalse(self.batch.codes.filter(is_active=True).exists())
+        self.assertEqual(archive.expire_codes(), 0)
+
+    def test_expire_command_archive(self):
+        DownloadCode.objects.filter(pk=self.code.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('busker_expire_codes', '--archive', '--min-age', '0', stdout=out)
+        self.assertIn("Archived 1 expired code.", out.getvalue())
+        self.assertTrue(code_archived(self.code.pk).expired)
+        response = self.client.get(reverse('busker:redeem', kwargs={'download_code': self.code.pk}))
+        self.assertContains(response, "has expired", status_code=404)
+        self.assertEqual(RedeemCodeForm({'code': self.code.pk}).errors['code'], [EXPIRED_CODE_MESSAGE])
+
+    def test_confirm_deactivated_code(self):
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        self.client.get(url)
+        DownloadCode.objects.filter(pk=self.code.pk).update(is_active=False)
+        response = self.client.post(url, data={'code': self.code.pk})
+        self.assertContains(response, "is no longer valid", status_code=404)
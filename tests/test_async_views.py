@@ -0,0 +1,134 @@
+from secrets import token_hex
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import include, path, reverse
+
+from busker import admission
+from busker.models import Artist, File as BuskerFile, DownloadableWork, Batch, DownloadCode, BatchStats
+
+urlpatterns = [
+    path('busker-async/', include('busker.async_urls', namespace='busker')),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsTestCase(TestCase):
+    """
+    Tests for the views in busker.async_views
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Async Test Batch", public_message="",
+                                          number_of_codes=2, max_uses=2)
+        self.code = self.batch.codes.first()
+        self.busker_file = BuskerFile(work=self.work, description="Test file")
+        self.busker_file.file.save(name="async.txt", content=ContentFile(b"0123456789" * 60000))
+
+    async def login_with_token(self):
+        token = token_hex(16)
+        session = await sync_to_async(lambda: self.async_client.session)()
+        session['busker_download_token'] = token
+        await sync_to_async(session.save)()
+        self.async_client.cookies['sessionid'] = session.session_key
+        return token
+
+    async def test_redeem_get(self):
+        response = await self.async_client.get(reverse('busker:redeem', kwargs={'download_code': self.code.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Dancing Teeth")
+        self.assertContains(response, "This code has 2 uses left.")
+
+    async def test_redeem_get_invalid(self):
+        response = await self.async_client.get(reverse('busker:redeem', kwargs={'download_code': 'NOTCODE'}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_redeem_post(self):
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        response = await self.async_client.post(url, data={'code': self.code.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "async")
+        code = await DownloadCode.objects.aget(pk=self.code.pk)
+        self.assertEqual(code.times_used, 1)
+        stats = await BatchStats.objects.aget(batch=self.batch)
+        self.assertEqual((stats.redemptions, stats.codes_used), (1, 1))
+        session = await sync_to_async(lambda: dict(self.async_client.session))()
+        self.assertEqual(session['busker_download_code'], self.code.pk)
+        self.assertIn('busker_download_token', session)
+
+    async def test_redeem_post_deactivated(self):
+        await DownloadCode.objects.filter(pk=self.code.pk).aupdate(is_active=False)
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        response = await self.async_client.post(url, data={'code': self.code.pk})
+        self.assertContains(response, "is no longer valid", status_code=404)
+
+    async def test_redeem_post_revoked(self):
+        await DownloadCode.objects.filter(pk=self.code.pk).aupdate(revoked=True)
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        response = await self.async_client.post(url, data={'code': self.code.pk})
+        self.assertContains(response, "is no longer valid", status_code=404)
+
+    async def test_redeem_form(self):
+        url = reverse('busker:redeem_form')
+        self.assertEqual((await self.async_client.get(url)).status_code, 200)
+        response = await self.async_client.post(url, data={'code': self.code.pk.lower()})
+        self.assertRedirects(response, reverse('busker:redeem', kwargs={'download_code': self.code.pk.lower()}),
+                             fetch_redirect_response=False)
+        response = await self.async_client.post(url, data={'code': 'NOTCODE'})
+        self.assertContains(response, "not valid")
+
+    async def test_download(self):
+        token = await self.login_with_token()
+        url = reverse('busker:download', kwargs={'file_id': self.busker_file.pk}) + f"?t={token}"
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], '600000')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{self.busker_file.filename}"')
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), b"0123456789" * 60000)
+
+    async def test_download_unauthorized(self):
+        url = reverse('busker:download', kwargs={'file_id': self.busker_file.pk})
+        self.assertEqual((await self.async_client.get(url + '?t=bogus')).status_code, 401)
+        token = await self.login_with_token()
+        url = reverse('busker:download', kwargs={'file_id': '00000000-0000-0000-0000-000000000000'})
+        self.assertEqual((await self.async_client.get(url + f"?t={token}")).status_code, 404)
+
+    @override_settings(BUSKER_THROTTLE_ENABLED=True, BUSKER_THROTTLE_IP_RATE=(1, 60))
+    async def test_throttled(self):
+        await sync_to_async(cache.clear)()
+        url = reverse('busker:redeem', kwargs={'download_code': 'NOTCODE'})
+        self.assertEqual((await self.async_client.get(url)).status_code, 404)
+        self.assertEqual((await self.async_client.get(url)).status_code, 429)
+        response = await self.async_client.post(reverse('busker:redeem_form'), data={'code': 'NOTCODE'})
+        self.assertEqual(response.status_code, 429)
+        await sync_to_async(cache.clear)()
+
+    @override_settings(BUSKER_ADMISSION_ENABLED=True, BUSKER_ADMISSION_LIMITS={'redeem': 5, 'download': 1})
+    async def test_admission(self):
+        await sync_to_async(cache.clear)()
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        for i in range(4):
+            await sync_to_async(admission.acquire)('redeem')
+        self.assertEqual((await self.async_client.get(url)).status_code, 503)
+        self.assertEqual((await self.async_client.post(url, data={'code': self.code.pk})).status_code, 200)
+        self.assertEqual(await sync_to_async(admission.in_progress)('redeem'), 4)
+        await sync_to_async(cache.clear)()
+
+    @override_settings(BUSKER_ADMISSION_ENABLED=True)
+    async def test_admission_released_on_error(self):
+        await sync_to_async(cache.clear)()
+
+        async def get_response():
+            self.assertEqual(await sync_to_async(admission.in_progress)('redeem'), 1)
+            raise RuntimeError("view failed")
+
+        with self.assertRaises(RuntimeError):
+            await admission.aadmit(None, 'redeem', get_response)
+        self.assertEqual(await sync_to_async(admission.in_progress)('redeem'), 0)
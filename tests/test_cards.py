@@ -0,0 +1,95 @@
+import io
+import zipfile
+from unittest import mock, skipIf
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from busker import cards
+from busker.models import Artist, DownloadableWork, Batch
+
+
+@skipIf(cards.qrcode is None, "The optional qrcode package is not installed")
+@override_settings(BUSKER_BASE_URL='https://example.com/')
+class CardsTestCase(TestCase):
+    """
+    Tests for the busker.cards module
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Card Test Batch", public_message="",
+                                          number_of_codes=14)
+
+    def test_redeem_url_template(self):
+        template = cards.redeem_url_template()
+        self.assertEqual(cards.build_redeem_url(template, 'ABC1234'),
+                         'https://example.com/busker-test/redeem/ABC1234/')
+        self.assertTrue(cards.redeem_url_template('http://other.test').startswith('http://other.test/busker-test/'))
+
+    @override_settings(BUSKER_BASE_URL=None)
+    def test_missing_base_url(self):
+        with self.assertRaises(ImproperlyConfigured):
+            cards.redeem_url_template()
+
+    def test_render_png_zip(self):
+        name, count = cards.render_batch_cards(self.batch, card_format='png', workers=0)
+        self.assertEqual(count, self.batch.codes.count())
+        with default_storage.open(name) as f, zipfile.ZipFile(f) as archive:
+            names = archive.namelist()
+            self.assertEqual(sorted(names), sorted(f"{code.id}.png" for code in self.batch.codes.all()))
+            image = Image.open(io.BytesIO(archive.read(names[0])))
+            self.assertEqual(image.size, (750, 750))
+
+    def test_render_pdf_sheets(self):
+        """
+        14 cards at 12 per page = 2 pages; with one page per file that's 2 PDF files.
+        """
+        name, count = cards.render_batch_cards(self.batch, card_format='pdf', workers=2, pages_per_file=1)
+        self.assertEqual(count, 14)
+        with default_storage.open(name) as f, zipfile.ZipFile(f) as archive:
+            self.assertEqual(archive.namelist(), ['cards-0001.pdf', 'cards-0002.pdf'])
+            self.assertTrue(archive.read('cards-0001.pdf').startswith(b'%PDF'))
+
+    @override_settings(BUSKER_CARD_WORKERS=1)
+    def test_render_in_process_pool(self):
+        name, count = cards.render_batch_cards(self.batch, card_format='png')
+        self.assertEqual(count, 14)
+        with default_storage.open(name) as f, zipfile.ZipFile(f) as archive:
+            self.assertEqual(len(archive.namelist()), 14)
+
+    def test_render_pdf_in_process(self):
+        name, count = cards.render_batch_cards(self.batch, card_format='pdf', workers=0)
+        with default_storage.open(name) as f, zipfile.ZipFile(f) as archive:
+            self.assertEqual(archive.namelist(), ['cards-0001.pdf'])
+
+    def test_ordered_map(self):
+        # More jobs than may be pending at once, which still come back in order
+        self.assertEqual(list(cards._ordered_map(abs, range(0, -10, -1), workers=2, max_pending=3)), list(range(10)))
+
+    def test_qrcode_missing(self):
+        with mock.patch.object(cards, 'qrcode', None):
+            with self.assertRaises(ImproperlyConfigured):
+                cards.render_card_image('ABC1234', 'https://example.com/')
+            with self.assertRaises(ImproperlyConfigured):
+                cards.render_batch_cards(self.batch, workers=0)
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            cards.render_batch_cards(self.batch, card_format='gif')
+
+    def test_render_cards_command(self):
+        out = io.StringIO()
+        call_command('busker_render_cards', str(self.batch.id), '--format', 'png', '--workers', '0',
+                     '--output', 'busker/cards/command-test.zip', stdout=out)
+        self.assertIn(f"Saved {self.batch.codes.count()} cards", out.getvalue())
+        self.assertIn('busker/cards/command-test.zip', out.getvalue())
+        self.assertTrue(default_storage.exists('busker/cards/command-test.zip'))
+
+    def test_render_cards_command_missing_batch(self):
+        with self.assertRaises(CommandError):
+            call_command('busker_render_cards', 'bogus')
@@ -0,0 +1,108 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from busker import deletion
+from busker.models import Artist, ArchivedDownloadCode, Batch, BatchStats, DownloadableWork, DownloadCode, \
+    File as BuskerFile
+
+
+class DeletionTestCase(TestCase):
+    """
+    Tests for the busker.deletion module and the admin's use of it
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Deletion Test Batch", public_message="",
+                                          number_of_codes=25)
+        self.other_batch = Batch.objects.create(work=self.work, label="Other Batch", public_message="",
+                                                number_of_codes=5)
+        code = self.batch.codes.first()
+        ArchivedDownloadCode.objects.create(**{field: getattr(code, field)
+                                               for field in ArchivedDownloadCode.COPIED_FIELDS})
+        code.delete()
+
+    def test_delete_codes_chunked(self):
+        # Per chunk: SELECT the IDs, DELETE them
+        with self.assertNumQueries(2 * 3 + 2 * 1 + 2):
+            self.assertEqual(deletion.delete_codes([self.batch.pk], chunk_size=10), 25)
+        self.assertEqual(self.other_batch.codes.count(), 5)
+
+    def test_delete_batches(self):
+        self.assertIsNone(deletion.delete_batches([self.batch.pk]))
+        self.assertFalse(Batch.objects.filter(pk=self.batch.pk).exists())
+        self.assertFalse(BatchStats.objects.filter(batch=self.batch.pk).exists())
+        self.assertEqual(DownloadCode.objects.count(), 5)
+        self.assertEqual(ArchivedDownloadCode.objects.count(), 0)
+
+    def test_delete_works(self):
+        busker_file = BuskerFile(work=self.work, description="")
+        busker_file.file.save(name="deletion.txt", content=ContentFile(b"x"))
+        storage, name = busker_file.file.storage, busker_file.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.delete_works(DownloadableWork.objects.all())
+        self.assertEqual((Batch.objects.count(), DownloadCode.objects.count(), BuskerFile.objects.count()), (0, 0, 0))
+        self.assertFalse(storage.exists(name))
+
+    def test_admin_confirmation_summary(self):
+        self.client.force_login(User.objects.create_superuser(username='test', password='test'))
+        url = reverse('admin:busker_batch_delete', args=[self.batch.pk])
+        response = self.client.get(url)
+        self.assertContains(response, "Download codes: 24")
+        self.assertContains(response, "Archived download codes: 1")
+        self.assertNotContains(response, self.batch.codes.last().pk)
+        self.client.post(url, {'post': 'yes'})
+        self.assertFalse(Batch.objects.filter(pk=self.batch.pk).exists())
+
+        response = self.client.post(reverse('admin:busker_downloadablework_changelist'), {
+            'action': 'delete_selected', '_selected_action': [self.work.pk]})
+        self.assertContains(response, "Download codes: 5")
+        self.client.post(reverse('admin:busker_downloadablework_changelist'), {
+            'action': 'delete_selected', '_selected_action': [self.work.pk], 'post': 'yes'})
+        self.assertFalse(DownloadCode.objects.exists())
+
+
+@override_settings(BUSKER_BACKGROUND_DELETE_THRESHOLD=20)
+class BackgroundDeletionTestCase(TransactionTestCase):
+    """
+    Background deletions need the deleting transaction to commit before they start, and their own connection
+    """
+
+    def setUp(self):
+        self.work = DownloadableWork.objects.create(artist=Artist.objects.create(name="Conrad Poohs"),
+                                                    title="Dancing Teeth")
+        self.batch = Batch.objects.create(work=self.work, label="Large Batch", public_message="", number_of_codes=25)
+        self.small_batch = Batch.objects.create(work=self.work, label="Small Batch", public_message="",
+                                                number_of_codes=5)
+
+    def test_background(self):
+        with transaction.atomic():
+            thread = deletion.delete_batches([self.batch.pk])
+            self.assertFalse(thread.is_alive())
+        thread.join()
+        self.assertFalse(Batch.objects.filter(pk=self.batch.pk).exists())
+        self.assertEqual(DownloadCode.objects.count(), 5)
+        self.assertIsNone(deletion.delete_batches([self.small_batch.pk]))
+
+    def test_background_works(self):
+        other_work = DownloadableWork.objects.create(artist=self.work.artist, title="Magicians")
+        Batch.objects.create(work=other_work, label="Other Large Batch", public_message="", number_of_codes=25)
+        thread = deletion.delete_works([self.work.pk])
+        thread.join()
+        self.assertEqual(list(DownloadableWork.objects.all()), [other_work])
+        # Explicitly deleting in the foreground overrides the threshold
+        self.assertIsNone(deletion.delete_works([other_work.pk], background=False))
+        self.assertFalse(DownloadCode.objects.exists())
+
+    def test_background_failure(self):
+        with mock.patch.object(deletion, 'delete_codes', side_effect=DatabaseError("database is locked")), \
+                self.assertLogs('busker.deletion', 'ERROR') as logs:
+            deletion.delete_batches([self.small_batch.pk], background=True).join()
+        self.assertIn("Background deletion of 1 batches failed", logs.output[0])
+        self.assertEqual(DownloadCode.objects.filter(batch=self.small_batch).count(), 5)
@@ -0,0 +1,116 @@
+import threading
+
+from django.core.files.base import ContentFile
+from django.dispatch import Signal
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from busker import dispatch
+from busker.models import Artist, File as BuskerFile, DownloadableWork, Batch, WebhookEndpoint, WebhookEvent
+from busker.signals import code_post_redeem, file_pre_download
+
+
+class DispatchTestCase(TestCase):
+    """
+    Tests for the busker.dispatch module
+    """
+
+    def setUp(self):
+        self.signal = Signal()
+        self.received = []
+        self.signal.connect(self.receiver, weak=False)
+
+    def tearDown(self):
+        dispatch.dispatcher.stop()
+
+    def receiver(self, sender, **kwargs):
+        self.received.append((threading.current_thread().name, kwargs))
+        return 'ok'
+
+    def test_sync_by_default(self):
+        self.assertEqual(dispatch.send(self.signal, sender=None, value=1), [(self.receiver, 'ok')])
+        self.assertEqual(self.received, [(threading.current_thread().name, {'signal': self.signal, 'value': 1})])
+
+    def test_sync_raises(self):
+        self.signal.connect(self.failing_receiver, weak=False)
+        with self.assertRaises(RuntimeError):
+            dispatch.send(self.signal, sender=None)
+
+    def failing_receiver(self, sender, **kwargs):
+        raise RuntimeError("Receiver failed")
+
+    @override_settings(BUSKER_SIGNAL_DISPATCH='thread')
+    def test_thread_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(dispatch.send(self.signal, sender=None, value=1), [])
+        self.assertEqual(self.received, [])
+        for callback in callbacks:
+            callback()
+        dispatch.dispatcher.join()
+        self.assertEqual(len(self.received), 1)
+        self.assertTrue(self.received[0][0].startswith('busker-dispatch-'))
+
+    @override_settings(BUSKER_SIGNAL_DISPATCH='thread')
+    def test_thread_failures_logged(self):
+        self.signal.connect(self.failing_receiver, weak=False)
+        with self.assertLogs('busker.dispatch', 'ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                dispatch.send(self.signal, sender=None)
+            dispatch.dispatcher.join()
+        self.assertIn("Receiver failed", logs.output[0])
+        self.assertEqual(len(self.received), 1)
+
+    @override_settings(BUSKER_SIGNAL_DISPATCH='thread', BUSKER_SIGNAL_WORKERS=1, BUSKER_SIGNAL_QUEUE_SIZE=1)
+    def test_backpressure(self):
+        """
+        When the queue is full, signals are delivered synchronously instead
+        """
+        release = threading.Event()
+        self.signal.connect(lambda sender, value, **kwargs: value == 1 and release.wait(5), weak=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch.send(self.signal, sender=None, value=1)  # Taken by the worker, which then blocks
+        while dispatch.dispatcher._queue.qsize():
+            pass
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch.send(self.signal, sender=None, value=2)  # Queued
+        with self.assertLogs('busker.dispatch', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            dispatch.send(self.signal, sender=None, value=3)  # Queue full; sent here
+        release.set()
+        self.assertIn((threading.current_thread().name, {'signal': self.signal, 'value': 3}), self.received)
+        dispatch.dispatcher.join()
+        self.assertEqual(len(self.received), 3)
+
+    @override_settings(BUSKER_SIGNAL_DISPATCH='thread')
+    def test_busker_signals(self):
+        artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        work = DownloadableWork.objects.create(artist=artist, title="Dancing Teeth", published=True)
+        batch = Batch.objects.create(work=work, label="Dispatch Test Batch", public_message="", number_of_codes=1)
+        busker_file = BuskerFile(work=work, description="")
+        busker_file.file.save(name="dispatch.txt", content=ContentFile(b"x"))
+        code_post_redeem.connect(self.receiver, weak=False)
+        file_pre_download.connect(self.receiver, weak=False)
+        try:
+            code = batch.codes.first()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('busker:redeem', kwargs={'download_code': code.pk}), data={'code': code.pk})
+                token = self.client.session['busker_download_token']
+                self.client.get(reverse('busker:download', kwargs={'file_id': busker_file.pk}) + f"?t={token}")
+            dispatch.dispatcher.join()
+        finally:
+            code_post_redeem.disconnect(self.receiver)
+            file_pre_download.disconnect(self.receiver)
+        self.assertEqual({kwargs['signal'] for _, kwargs in self.received}, {code_post_redeem, file_pre_download})
+
+    @override_settings(BUSKER_SIGNAL_DISPATCH='thread')
+    def test_internal_receivers_sync(self):
+        """
+        busker's own receivers (e.g. the webhook outbox) run in the sending thread even in thread mode
+        """
+        WebhookEndpoint.objects.create(url="https://example.com/hook", secret="s")
+        artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        work = DownloadableWork.objects.create(artist=artist, title="Dancing Teeth", published=True)
+        batch = Batch.objects.create(work=work, label="Dispatch Test Batch", public_message="", number_of_codes=1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            batch.codes.first().redeem()
+            self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(len(callbacks), 1)  # Only the signal to other receivers is deferred
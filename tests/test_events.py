@@ -0,0 +1,129 @@
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, transaction
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from busker import events
+from busker.models import Artist, File as BuskerFile, DownloadableWork, Batch, DownloadCode, UsageEvent
+
+
+@override_settings(BUSKER_EVENTS_ENABLED=True, BUSKER_EVENT_BUFFER_SIZE=3, BUSKER_EVENT_FLUSH_INTERVAL=60000)
+class EventBufferTestCase(TransactionTestCase):
+    """
+    Tests for the busker.events module. Events are written by a worker thread with its own connection, once the
+    transactions they were recorded in have been committed.
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Events Test Batch", public_message="",
+                                          number_of_codes=5)
+        self.buffer = events.EventBuffer()
+
+    def tearDown(self):
+        for buffer in (self.buffer, events.buffer):
+            buffer.flush()
+            self.join(buffer)
+
+    def join(self, buffer):
+        worker = buffer._worker
+        if worker is not None:
+            worker.join(5)
+            self.assertFalse(worker.is_alive())
+
+    def event(self):
+        return UsageEvent(event_type=UsageEvent.REDEMPTION, work_id=self.work.pk, batch_id=self.batch.pk)
+
+    def test_flush_when_full(self):
+        with self.assertNumQueries(0):  # Not in this thread, at least
+            self.buffer.add(self.event())
+            self.buffer.add(self.event())
+            self.assertEqual(len(self.buffer), 2)
+            self.assertTrue(self.buffer._worker.is_alive())
+            self.buffer.add(self.event())
+        self.join(self.buffer)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertIsNone(self.buffer._worker)
+        self.assertEqual(UsageEvent.objects.count(), 3)
+
+    @override_settings(BUSKER_EVENT_FLUSH_INTERVAL=50)
+    def test_flush_when_due(self):
+        self.buffer.add(self.event())
+        self.join(self.buffer)
+        self.assertEqual(UsageEvent.objects.count(), 1)
+
+    def test_worker_stopped_on_flush(self):
+        self.buffer.add(self.event())
+        worker = self.buffer._worker
+        self.assertTrue(worker.is_alive())
+        self.assertEqual(self.buffer.flush(), 1)
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertIsNone(self.buffer._worker)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_flush_error(self):
+        self.buffer.add(self.event())
+        with mock.patch.object(UsageEvent.objects, 'bulk_create', side_effect=DatabaseError("disk full")), \
+                self.assertLogs('busker.events', 'ERROR') as logs:
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertIn("Could not save 1 busker usage events", logs.output[0])
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_failed_write_keeps_redemption(self):
+        """
+        Events are written outside of the redemption's transaction, so failing to write them doesn't undo it
+        """
+        code = self.batch.codes.first()
+        with mock.patch.object(UsageEvent.objects, 'bulk_create', side_effect=DatabaseError("disk full")), \
+                self.assertLogs('busker.events', 'ERROR'):
+            code.redeem()
+            code.redeem()
+            code.redeem()
+            self.join(events.buffer)
+        self.assertEqual(DownloadCode.objects.get(pk=code.pk).times_used, 3)
+
+    def test_rolled_back_redemption(self):
+        code = self.batch.codes.first()
+        with self.assertRaises(ValueError), transaction.atomic():
+            code.redeem()
+            raise ValueError
+        self.assertEqual(len(events.buffer), 0)
+
+    @override_settings(BUSKER_EVENTS_ENABLED=False)
+    def test_disabled(self):
+        self.batch.codes.first().redeem()
+        self.assertEqual(len(events.buffer), 0)
+
+    @override_settings(BUSKER_EVENT_BUFFER_SIZE=1)
+    def test_redeem_and_download_events(self):
+        """
+        Redeeming a code and downloading a file record events attributed to the work, batch and code
+        """
+        busker_file = BuskerFile(work=self.work, description="")
+        busker_file.file.save(name="events.txt", content=ContentFile(b"x" * 42))
+        code = self.batch.codes.first()
+        self.client.post(reverse('busker:redeem', kwargs={'download_code': code.pk}), data={'code': code.pk})
+        self.join(events.buffer)
+        redemption = UsageEvent.objects.get(event_type=UsageEvent.REDEMPTION)
+        self.assertEqual((redemption.work_id, redemption.batch_id, redemption.code_id),
+                         (self.work.pk, self.batch.pk, code.pk))
+
+        token = self.client.session['busker_download_token']
+        self.client.get(reverse('busker:download', kwargs={'file_id': busker_file.pk}) + f"?t={token}")
+        self.join(events.buffer)
+        download = UsageEvent.objects.get(event_type=UsageEvent.DOWNLOAD)
+        self.assertEqual((download.work_id, download.batch_id, download.code_id, download.file_id, download.bytes),
+                         (self.work.pk, self.batch.pk, code.pk, busker_file.pk, 42))
+
+    def test_history_kept_after_delete(self):
+        code = self.batch.codes.first()
+        self.buffer.add(UsageEvent(event_type=UsageEvent.REDEMPTION, work_id=self.work.pk, batch_id=self.batch.pk,
+                                   code_id=code.pk))
+        self.buffer.flush()
+        work_id, code_id = self.work.pk, code.pk
+        self.work.delete()
+        self.assertEqual(UsageEvent.objects.filter(work_id=work_id, code_id=code_id).count(), 1)
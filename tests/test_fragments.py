@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from busker import fragments
+from busker.models import Artist, DownloadableWork, Batch, File as BuskerFile
+
+
+class FragmentCacheTestCase(TestCase):
+    """
+    Tests for the cached page fragments in busker.fragments
+    """
+
+    def setUp(self):
+        cache.clear()
+        fragments.local_cache.clear()
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Fragment Test Batch",
+                                          public_message="Thanks for *listening*", number_of_codes=1, max_uses=2)
+        self.code = self.batch.codes.first()
+        self.file = self.add_file("teeth.mp3")
+
+    def tearDown(self):
+        cache.clear()
+
+    def add_file(self, name):
+        busker_file = BuskerFile(work=self.work, description=f"Description of {name}")
+        busker_file.file.save(name=name, content=ContentFile(b"busker"))
+        return busker_file
+
+    def test_render_cached(self):
+        with self.assertNumQueries(1):
+            html = fragments.render('file_list', self.work)
+        self.assertIn("teeth.mp3", html)
+        self.assertIn(f"?t={fragments.TOKEN_PLACEHOLDER}", html)
+        with self.assertNumQueries(0):
+            self.assertEqual(fragments.render('file_list', self.work), html)
+        self.assertIn("<em>listening</em>", fragments.render('batch_message', self.batch))
+
+    def test_invalidation(self):
+        fragments.render('file_list', self.work)
+        other = self.add_file("gums.mp3")
+        self.assertIn("gums.mp3", fragments.render('file_list', self.work))
+        other.delete()
+        self.assertNotIn("gums.mp3", fragments.render('file_list', self.work))
+
+        self.assertIn("listening", fragments.render('batch_message', self.batch))
+        self.batch.public_message = "Thanks for *buying*"
+        self.batch.save()
+        self.assertIn("<em>buying</em>", fragments.render('batch_message', self.batch))
+
+        self.work.delete()
+        self.assertIsNone(cache.get(fragments.fragment_key('file_list', self.work.pk)))
+        self.assertIsNone(cache.get(fragments.fragment_key('batch_message', self.batch.pk)))
+
+    def test_stale_entry(self):
+        # e.g. written by another process before this one saw the change
+        key = fragments.fragment_key('batch_message', self.batch.pk)
+        cache.set(key, (self.batch.modified_date - timedelta(seconds=1), "stale"))
+        self.assertIn("listening", fragments.render('batch_message', self.batch))
+        self.assertEqual(cache.get(key)[0][0], self.batch.modified_date)
+
+    @override_settings(BUSKER_FRAGMENT_CACHE=None)
+    def test_disabled(self):
+        fragments.render('file_list', self.work)
+        with self.assertNumQueries(1):
+            fragments.render('file_list', self.work)
+
+    def test_views(self):
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        self.assertContains(self.client.get(url), "<em>listening</em>")
+        response = self.client.post(url, data={'code': self.code.pk})
+        token = self.client.session['busker_download_token']
+        self.assertContains(response, f"{reverse('busker:download', args=[self.file.pk])}?t={token}")
+        self.assertNotContains(response, fragments.TOKEN_PLACEHOLDER)
+        # The cached list is shared by other sessions, with their own tokens
+        self.client.cookies.clear()
+        response = self.client.post(url, data={'code': self.code.pk})
+        self.assertNotEqual(self.client.session['busker_download_token'], token)
+        self.assertContains(response, f"?t={self.client.session['busker_download_token']}")
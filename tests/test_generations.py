@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+
+from busker import fragments, generations
+from busker.models import Artist, DownloadableWork, Batch, File as BuskerFile
+
+
+class GenerationsTestCase(TestCase):
+    """
+    Tests for busker.generations
+    """
+
+    def setUp(self):
+        cache.clear()
+        fragments.local_cache.clear()
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+
+    def tearDown(self):
+        cache.clear()
+        fragments.local_cache.clear()
+
+    def test_bump(self):
+        generation = generations.get(DownloadableWork, self.work.pk)
+        self.assertEqual(generations.get(DownloadableWork, self.work.pk), generation)
+        self.assertNotEqual(generations.get(Batch, self.work.pk), generation)
+        generations.bump(DownloadableWork, [self.work.pk])
+        self.assertEqual(generations.get(DownloadableWork, self.work.pk), generation + 1)
+        # An evicted counter doesn't start again from an old generation:
+        cache.delete(generations.generation_key(DownloadableWork, self.work.pk))
+        self.assertGreater(generations.get(DownloadableWork, self.work.pk), generation + 1)
+        # Nor does bumping a missing counter
+        generation = generations.get(DownloadableWork, self.work.pk)
+        cache.delete(generations.generation_key(DownloadableWork, self.work.pk))
+        generations.bump(DownloadableWork, [self.work.pk])
+        self.assertGreater(generations.get(DownloadableWork, self.work.pk), generation)
+
+    def test_local_cache(self):
+        local = generations.LocalCache(max_size=2)
+        local.set('a', 1, "A")
+        local.set('b', 1, "B")
+        self.assertEqual(local.get('a', 1), "A")
+        self.assertIsNone(local.get('b', 2))
+        self.assertIsNone(local.get('b', 1))  # Stale entries are dropped
+        local.set('b', 2, "B")
+        local.set('c', 2, "C")
+        self.assertIsNone(local.get('a', 1))  # The least recently used
+        self.assertEqual((local.get('b', 2), local.get('c', 2)), ("B", "C"))
+
+    def test_fragments_invalidated_across_processes(self):
+        busker_file = BuskerFile(work=self.work, description="Teeth")
+        busker_file.file.save(name="teeth.mp3", content=ContentFile(b"busker"))
+        self.assertIn("teeth.mp3", fragments.render('file_list', self.work))
+        with self.assertNumQueries(0):
+            fragments.render('file_list', self.work)
+        # Another process changes the work's files (simulated by not sending signals here) and bumps its generation:
+        BuskerFile.objects.filter(pk=busker_file.pk).update(description="Gums")
+        self.assertNotIn("Gums", fragments.render('file_list', self.work))
+        generations.bump(DownloadableWork, [self.work.pk])
+        self.assertIn("Gums", fragments.render('file_list', self.work))
+
+    @override_settings(BUSKER_LOCAL_CACHE_SIZE=1)
+    def test_local_cache_size(self):
+        fragments.render('file_list', self.work)
+        fragments.render('work_thumbnail', self.work)
+        self.assertEqual(len(fragments.local_cache.entries), 1)
@@ -0,0 +1,161 @@
+import json
+import os
+import tempfile
+import threading
+from secrets import token_hex
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from busker import metrics
+from busker.models import Artist, File as BuskerFile, DownloadableWork, Batch, validate_code
+
+
+class RegistryTestCase(TestCase):
+    """
+    Tests for the busker.metrics registry and Prometheus formatting
+    """
+
+    def setUp(self):
+        self.registry = metrics.Registry(buckets=(0.1, 1.0))
+
+    def test_counter(self):
+        self.registry.inc('busker_redeem_requests_total', method='GET')
+        self.registry.inc('busker_redeem_requests_total', 2, method='GET')
+        self.registry.inc('busker_redeem_requests_total', method='POST')
+        counters = self.registry.snapshot()['counters']['busker_redeem_requests_total']
+        self.assertEqual(counters, {'method="GET"': 3, 'method="POST"': 1})
+
+    def test_histogram(self):
+        for value in (0.05, 0.5, 0.5, 5):
+            self.registry.observe('busker_redeem_request_seconds', value, method='GET')
+        histogram = self.registry.snapshot()['histograms']['busker_redeem_request_seconds']['method="GET"']
+        self.assertEqual(histogram['buckets'], [1, 2])
+        self.assertEqual(histogram['count'], 4)
+        self.assertAlmostEqual(histogram['sum'], 6.05)
+
+    def test_render_prometheus(self):
+        self.registry.inc('busker_download_bytes_total', 1024, work='abc')
+        self.registry.observe('busker_validate_code_seconds', 0.05, result='valid')
+        self.registry.observe('busker_validate_code_seconds', 0.5, result='valid')
+        text = metrics.render_prometheus(self.registry.snapshot())
+        self.assertIn('# TYPE busker_download_bytes_total counter', text)
+        self.assertIn('busker_download_bytes_total{work="abc"} 1024', text)
+        self.assertIn('busker_validate_code_seconds_bucket{result="valid",le="0.1"} 1', text)
+        self.assertIn('busker_validate_code_seconds_bucket{result="valid",le="1.0"} 2', text)
+        self.assertIn('busker_validate_code_seconds_bucket{result="valid",le="+Inf"} 2', text)
+        self.assertIn('busker_validate_code_seconds_count{result="valid"} 2', text)
+
+    def test_label_escaping(self):
+        self.registry.inc('busker_invalid_codes_total', source='say "hi"\n')
+        self.assertIn('source="say \\"hi\\"\\n"', self.registry.snapshot()['counters']['busker_invalid_codes_total'])
+
+    def test_merge(self):
+        other = metrics.Registry(buckets=(0.1, 1.0))
+        self.registry.inc('busker_download_requests_total', work='a')
+        other.inc('busker_download_requests_total', work='a')
+        other.inc('busker_download_requests_total', work='b')
+        self.registry.observe('busker_redeem_request_seconds', 0.05)
+        other.observe('busker_redeem_request_seconds', 0.5)
+        merged = metrics.merge([self.registry.snapshot(), other.snapshot()])
+        self.assertEqual(merged['counters']['busker_download_requests_total'], {'work="a"': 2, 'work="b"': 1})
+        self.assertEqual(merged['histograms']['busker_redeem_request_seconds']['']['count'], 2)
+
+    def test_collect_across_processes(self):
+        """
+        Snapshots written by other processes to BUSKER_METRICS_DIR are included in collect()
+        """
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(BUSKER_METRICS_DIR=directory, BUSKER_METRICS_ENABLED=True):
+            other = metrics.Registry()
+            other.inc('busker_invalid_codes_total', 5, source='redeem_view')
+            with open(os.path.join(directory, 'busker-metrics-other.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+            metrics.registry.reset()
+            metrics.inc('busker_invalid_codes_total', source='redeem_view')
+            collected = metrics.collect()
+            self.assertEqual(collected['counters']['busker_invalid_codes_total'], {'source="redeem_view"': 6})
+            self.assertIn(f"busker-metrics-{metrics.registry.process_id}.json", os.listdir(directory))
+
+    def test_flush_errors(self):
+        """
+        Concurrent flushes don't collide, and errors writing the file are logged rather than raised
+        """
+        with tempfile.TemporaryDirectory() as directory, override_settings(BUSKER_METRICS_DIR=directory):
+            threads = [threading.Thread(target=self.registry.flush) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(os.listdir(directory), [f"busker-metrics-{self.registry.process_id}.json"])
+        with override_settings(BUSKER_METRICS_DIR=os.path.join(directory, 'missing')), \
+                self.assertLogs('busker.metrics', 'ERROR'):
+            self.registry.flush()
+
+
+@override_settings(BUSKER_METRICS_ENABLED=True)
+class MetricsInstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Metrics Test Batch", public_message="",
+                                          number_of_codes=2)
+        self.busker_file = BuskerFile(work=self.work, description="")
+        self.busker_file.file.save(name="metrics.txt", content=ContentFile(b"x" * 100))
+
+    def tearDown(self):
+        metrics.registry.reset()
+
+    def counters(self, name):
+        return metrics.registry.snapshot()['counters'].get(name, {})
+
+    def test_validate_code(self):
+        validate_code(self.batch.codes.first().pk)
+        validate_code('NOTACODE')
+        histograms = metrics.registry.snapshot()['histograms']['busker_validate_code_seconds']
+        self.assertEqual(histograms['result="valid"']['count'], 1)
+        self.assertEqual(histograms['result="invalid"']['count'], 1)
+
+    def test_redeem_view(self):
+        code = self.batch.codes.first()
+        self.client.get(reverse('busker:redeem', kwargs={'download_code': code.pk}))
+        self.client.get(reverse('busker:redeem', kwargs={'download_code': 'NOTACODE'}))
+        self.client.post(reverse('busker:redeem', kwargs={'download_code': code.pk}), data={'code': code.pk})
+        self.client.post(reverse('busker:redeem_form'), data={'code': 'NOTCODE'})
+        self.assertEqual(self.counters('busker_redeem_requests_total'), {'method="GET"': 2, 'method="POST"': 1})
+        self.assertEqual(self.counters('busker_invalid_codes_total'),
+                         {'source="redeem_view"': 1, 'source="redeem_form"': 1})
+        histograms = metrics.registry.snapshot()['histograms']['busker_redeem_request_seconds']
+        self.assertEqual(histograms['method="GET"']['count'], 2)
+
+    def test_download_view(self):
+        token = token_hex(16)
+        session = self.client.session
+        session['busker_download_token'] = token
+        session.save()
+        self.client.get(reverse('busker:download', kwargs={'file_id': self.busker_file.id}) + f"?t={token}")
+        self.assertEqual(self.counters('busker_download_requests_total'), {f'work="{self.work.pk}"': 1})
+        self.assertEqual(self.counters('busker_download_bytes_total'), {f'work="{self.work.pk}"': 100})
+
+    @override_settings(BUSKER_METRICS_ENABLED=False)
+    def test_disabled(self):
+        validate_code(self.batch.codes.first().pk)
+        self.assertEqual(metrics.registry.snapshot()['histograms'], {})
+        response = self.client.get(reverse('busker:metrics'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_view(self):
+        self.client.get(reverse('busker:redeem', kwargs={'download_code': 'NOTACODE'}))
+        response = self.client.get(reverse('busker:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(response, 'busker_invalid_codes_total{source="redeem_view"} 1')
+
+    @override_settings(BUSKER_METRICS_TOKEN='s3cret')
+    def test_metrics_view_token(self):
+        self.assertEqual(self.client.get(reverse('busker:metrics')).status_code, 401)
+        response = self.client.get(reverse('busker:metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,116 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from busker import profiling
+from busker.models import Artist, DownloadableWork, Batch, BatchStats, DownloadCode
+
+PROFILED_MIDDLEWARE = ['busker.profiling.ProfilingMiddleware'] + settings.MIDDLEWARE
+
+
+@override_settings(BUSKER_PROFILING_ENABLED=True, BUSKER_PROFILING_SAMPLE_RATE=1, MIDDLEWARE=PROFILED_MIDDLEWARE)
+class ProfilingTestCase(TestCase):
+    """
+    Tests for the busker.profiling module
+    """
+
+    def setUp(self):
+        profiling.clear()
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Profiling Test Batch", public_message="",
+                                          number_of_codes=2)
+
+    def tearDown(self):
+        profiling.clear()
+
+    def test_profile_block(self):
+        with profiling.profile('test') as profile:
+            DownloadCode.objects.count()
+            with profiling.section('work'):
+                DownloadCode.objects.count()
+            with profiling.section('work'):
+                pass
+        self.assertEqual(profile.sql_count, 2)
+        self.assertGreater(profile.sql_time, 0)
+        self.assertEqual(list(profile.sections), ['work'])
+        self.assertIsNotNone(profile.duration)
+        self.assertEqual(profiling.recent(), [profile])
+        self.assertIsNone(profiling.current())
+
+    def test_section_without_profile(self):
+        with profiling.section('work'):
+            pass
+        self.assertEqual(profiling.recent(), [])
+
+    def test_redeem(self):
+        code = self.batch.codes.first()
+        with self.assertLogs('busker.profiling', 'INFO') as logs:
+            self.client.get(reverse('busker:redeem', kwargs={'download_code': code.pk}))
+            self.client.post(reverse('busker:redeem', kwargs={'download_code': code.pk}), data={'code': code.pk})
+        post, get = profiling.recent()
+        self.assertEqual((get.name, get.method, get.status), ('busker:redeem', 'GET', 200))
+        self.assertIn('validate_code', get.sections)
+        self.assertIn('template', get.sections)
+        self.assertGreater(get.sql_count, 0)
+        self.assertEqual(post.method, 'POST')
+        for name in ('code_post_redeem', 'session', 'template'):
+            self.assertIn(name, post.sections)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(logs.records[0].busker_profile['name'], 'busker:redeem')
+
+    def test_receivers_section(self):
+        """
+        Saving the code and its batch's stats isn't counted as time spent in the signal's receivers
+        """
+        code = self.batch.codes.first()
+
+        def slow_record_redemption(code):
+            time.sleep(0.2)
+
+        with mock.patch.object(BatchStats, 'record_redemption', slow_record_redemption), \
+                self.assertLogs('busker.profiling', 'INFO'):
+            self.client.post(reverse('busker:redeem', kwargs={'download_code': code.pk}), data={'code': code.pk})
+        self.assertLess(profiling.recent()[0].sections['code_post_redeem'], 0.2)
+
+    def test_only_busker_urls(self):
+        self.client.get(reverse('admin:index'))
+        self.client.get('/no-such-page/')
+        self.assertEqual(profiling.recent(), [])
+
+    def test_sampling(self):
+        with mock.patch('busker.profiling.random.random', return_value=0.5):
+            with override_settings(BUSKER_PROFILING_SAMPLE_RATE=0.25):
+                self.client.get(reverse('busker:redeem_form'))
+            self.assertEqual(len(profiling.recent()), 0)
+            with override_settings(BUSKER_PROFILING_SAMPLE_RATE=0.75):
+                self.client.get(reverse('busker:redeem_form'))
+            self.assertEqual(len(profiling.recent()), 1)
+
+    @override_settings(BUSKER_PROFILING_BUFFER_SIZE=2)
+    def test_ring_buffer(self):
+        for name in ('one', 'two', 'three'):
+            with profiling.profile(name):
+                pass
+        self.assertEqual([profile.name for profile in profiling.recent()], ['three', 'two'])
+
+    @override_settings(BUSKER_PROFILING_ENABLED=False)
+    def test_disabled(self):
+        self.client.get(reverse('busker:redeem_form'))
+        self.assertEqual(profiling.recent(), [])
+
+    def test_admin_view(self):
+        self.client.get(reverse('busker:redeem_form'))
+        url = reverse('admin:busker_downloadcode_profiles')
+        staff = User.objects.create_user(username='staff', password='test', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser(username='test', password='test'))
+        response = self.client.get(url)
+        self.assertContains(response, 'busker:redeem_form')
+        self.assertContains(self.client.get(reverse('admin:busker_downloadcode_changelist')), url)
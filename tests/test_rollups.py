@@ -0,0 +1,164 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from busker import rollups
+from busker.models import Artist, DownloadableWork, Batch, File as BuskerFile, UsageEvent, DailyWorkUsage, \
+    DailyBatchUsage, DailyFileUsage, RollupWatermark
+
+
+class RollupTestCase(TestCase):
+    """
+    Tests for the busker.rollups module
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Rollup Test Batch", public_message="",
+                                          number_of_codes=1)
+        self.file = BuskerFile.objects.create(work=self.work, description="", file='rollup.txt')
+        self.yesterday = timezone.now() - timedelta(days=1)
+
+    def event(self, event_type=UsageEvent.DOWNLOAD, timestamp=None, **kwargs):
+        fields = {'work_id': self.work.pk, 'batch_id': self.batch.pk}
+        if event_type == UsageEvent.DOWNLOAD:
+            fields.update(file_id=self.file.pk, bytes=100)
+        fields.update(kwargs)
+        return UsageEvent.objects.create(event_type=event_type, timestamp=timestamp or self.yesterday, **fields)
+
+    def test_rollup(self):
+        self.event(UsageEvent.REDEMPTION)
+        self.event()
+        self.event()
+        self.event(timestamp=self.yesterday - timedelta(days=1))
+        self.assertEqual(rollups.rollup_usage(), 4)
+
+        day = timezone.localdate(self.yesterday)
+        work_usage = DailyWorkUsage.objects.get(work=self.work, date=day)
+        self.assertEqual((work_usage.redemptions, work_usage.downloads, work_usage.bytes_served), (1, 2, 200))
+        batch_usage = DailyBatchUsage.objects.get(batch=self.batch, date=day)
+        self.assertEqual((batch_usage.redemptions, batch_usage.downloads, batch_usage.work_id), (1, 2, self.work.pk))
+        file_usage = DailyFileUsage.objects.get(file=self.file, date=day)
+        self.assertEqual((file_usage.redemptions, file_usage.downloads), (0, 2))
+        self.assertEqual(DailyWorkUsage.objects.count(), 2)
+
+    def test_incremental_and_idempotent(self):
+        self.event()
+        rollups.rollup_usage()
+        self.assertEqual(rollups.rollup_usage(), 0)
+        self.event()
+        self.assertEqual(rollups.rollup_usage(), 1)
+        self.assertEqual(DailyWorkUsage.objects.get().downloads, 2)
+        self.assertEqual(RollupWatermark.objects.get().last_event_id, UsageEvent.objects.latest('id').id)
+
+    def test_chunks(self):
+        for _ in range(5):
+            self.event()
+        with mock.patch('busker.rollups.rollup_chunk', wraps=rollups.rollup_chunk) as rollup_chunk:
+            self.assertEqual(rollups.rollup_usage(chunk_size=2), 5)
+        self.assertEqual(rollup_chunk.call_count, 3)
+        self.assertEqual(DailyFileUsage.objects.get().downloads, 5)
+
+    def test_resume_after_failure(self):
+        """
+        A chunk that fails is rolled back along with its watermark, so nothing is counted twice on the next run
+        """
+        for _ in range(4):
+            self.event()
+        apply = rollups._apply
+        calls = []
+
+        def fail_in_second_chunk(*args):
+            calls.append(args)
+            if len(calls) > 3:
+                raise RuntimeError
+            apply(*args)
+
+        with mock.patch('busker.rollups._apply', side_effect=fail_in_second_chunk):
+            with self.assertRaises(RuntimeError):
+                rollups.rollup_usage(chunk_size=2)
+        self.assertEqual(DailyWorkUsage.objects.get().downloads, 2)
+        self.assertEqual(rollups.rollup_usage(chunk_size=2), 2)
+        self.assertEqual(DailyWorkUsage.objects.get().downloads, 4)
+        self.assertEqual(DailyBatchUsage.objects.get().downloads, 4)
+
+    def test_settle_window(self):
+        """
+        Recent events, and any events after them, are left for a later run
+        """
+        settled = self.event()
+        self.event(timestamp=timezone.now())
+        self.event()
+        self.assertEqual(rollups.rollup_usage(settle_seconds=60), 1)
+        self.assertEqual(RollupWatermark.objects.get().last_event_id, settled.id)
+        self.assertEqual(rollups.rollup_usage(settle_seconds=0), 2)
+
+    def test_moved_to_another_work(self):
+        """
+        A batch or file moved to another work is rolled up under its (unique) batch or file and date, against the work
+        of its latest event
+        """
+        other_work = DownloadableWork.objects.create(artist=self.artist, title="Other Work", published=True)
+        self.event()
+        rollups.rollup_usage()
+        self.event(work_id=other_work.pk)
+        self.assertEqual(rollups.rollup_usage(), 1)
+        self.event(work_id=self.work.pk)
+        self.event(work_id=other_work.pk)
+        self.assertEqual(rollups.rollup_usage(), 2)
+        batch_usage = DailyBatchUsage.objects.get(batch=self.batch)
+        self.assertEqual((batch_usage.downloads, batch_usage.work_id), (4, other_work.pk))
+        file_usage = DailyFileUsage.objects.get(file=self.file)
+        self.assertEqual((file_usage.downloads, file_usage.work_id), (4, other_work.pk))
+        self.assertEqual(sorted(DailyWorkUsage.objects.values_list('downloads', flat=True)), [2, 2])
+
+    def test_deleted_objects(self):
+        self.event()
+        work_id = self.work.pk
+        self.work.delete()
+        rollups.rollup_usage()
+        self.assertEqual(DailyWorkUsage.objects.get(work_id=work_id).downloads, 1)
+
+    def test_command_rebuild(self):
+        self.event()
+        out = StringIO()
+        call_command('busker_rollup_usage', stdout=out)
+        self.assertIn("Rolled up 1 usage event.", out.getvalue())
+        call_command('busker_rollup_usage', '--rebuild', stdout=out)
+        self.assertEqual(DailyWorkUsage.objects.get().downloads, 1)
+
+    def test_dashboard(self):
+        self.event(UsageEvent.REDEMPTION)
+        self.event()
+        self.event(timestamp=timezone.now() - timedelta(days=60))
+        rollups.rollup_usage()
+        self.client.force_login(User.objects.create_superuser(username='test', password='test'))
+        url = reverse('admin:busker_downloadablework_usage')
+
+        # Only the rollup tables are read for the totals, never the events
+        with mock.patch.object(UsageEvent.objects, 'get_queryset', side_effect=AssertionError):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['summary'], {'redemptions': 1, 'downloads': 1, 'bytes_served': 100})
+        self.assertEqual(response.context['top_works'][0]['object'], self.work)
+        self.assertEqual(response.context['top_files'][0]['downloads'], 1)
+
+        response = self.client.get(url, {'days': 90, 'work': self.work.pk})
+        self.assertEqual(response.context['work'], self.work)
+        self.assertIsNone(response.context['top_works'])
+        self.assertEqual(response.context['summary']['downloads'], 2)
+        self.assertEqual(len(response.context['daily']), 2)
+
+        changelist = self.client.get(reverse('admin:busker_downloadablework_changelist'))
+        self.assertContains(changelist, url)
+
+    def test_dashboard_requires_staff(self):
+        response = self.client.get(reverse('admin:busker_downloadablework_usage'))
+        self.assertEqual(response.status_code, 302)
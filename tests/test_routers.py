@@ -0,0 +1,151 @@
+from django.db import DatabaseError, router
+from django.test import TestCase, modify_settings, override_settings
+from django.urls import reverse
+
+from busker import routers
+from busker.models import Artist, DownloadableWork, Batch, DownloadCode, File, validate_code
+
+
+@override_settings(DATABASE_ROUTERS=['busker.routers.ReplicaRouter'], BUSKER_REPLICA_DATABASE='replica')
+@modify_settings(MIDDLEWARE={'prepend': 'busker.routers.ReplicaPinMiddleware'})
+class ReplicaRouterTestCase(TestCase):
+    """
+    Tests for busker.routers. The 'replica' database isn't a real replica, so data is copied to it explicitly, and
+    replication lag is simulated by changing or creating data on only one of the databases.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Replica Test Batch", public_message="",
+                                          number_of_codes=2, max_uses=2)
+        self.code, self.other_code = self.batch.codes.order_by('pk')
+        routers.reset()  # Forget the tables written to above
+
+    def tearDown(self):
+        routers.reset()
+
+    def replicate(self, *codes):
+        """
+        Copies the test objects and the given codes to the replica, without sending any signals.
+        """
+        for model, objects in ((Artist, [self.artist]), (DownloadableWork, [self.work]), (Batch, [self.batch]),
+                               (DownloadCode, codes)):
+            model.objects.using('replica').bulk_create(objects)
+
+    def test_validate_code_uses_replica(self):
+        self.replicate(self.code)
+        code = validate_code(self.code.pk)
+        self.assertEqual(code, self.code)
+        self.assertEqual(code._state.db, 'replica')
+        self.assertEqual(routers.pinned(), frozenset())
+
+    def test_validate_code_falls_back_to_primary(self):
+        self.replicate(self.code)
+        # Not yet on the replica:
+        code = validate_code(self.other_code.pk)
+        self.assertEqual(code, self.other_code)
+        self.assertEqual(code._state.db, 'default')
+        self.assertIs(routers.pinned(), routers.ALL)
+        # Not on either:
+        routers.reset()
+        self.assertFalse(validate_code('NOTCODE'))
+
+    def test_replica_failure(self):
+        calls = []
+
+        def func():
+            calls.append(router.db_for_read(DownloadCode))
+            if len(calls) == 1:
+                raise DatabaseError("replica unavailable")
+            return 'result'
+
+        with self.assertLogs('busker.routers', 'WARNING'):
+            self.assertEqual(routers.read(func), 'result')
+        self.assertEqual(calls, ['replica', 'default'])
+
+    async def test_areplica_failure(self):
+        calls = []
+
+        async def func():
+            calls.append(router.db_for_read(DownloadCode))
+            if len(calls) == 1:
+                raise DatabaseError("replica unavailable")
+            return 'result'
+
+        with self.assertLogs('busker.routers', 'WARNING'):
+            self.assertEqual(await routers.aread(func), 'result')
+        self.assertEqual(calls, ['replica', 'default'])
+        self.assertIs(routers.pinned(), routers.ALL)
+
+    async def test_aread(self):
+        calls = []
+
+        async def func():
+            calls.append(router.db_for_read(DownloadCode))
+            return 'result' if len(calls) != 2 else None
+
+        self.assertEqual(await routers.aread(func), 'result')
+        self.assertEqual(calls, ['replica'])
+        self.assertEqual(routers.pinned(), frozenset())
+        # Falls back to the primary when the replica returns None:
+        self.assertEqual(await routers.aread(func), 'result')
+        self.assertEqual(calls, ['replica', 'replica', 'default'])
+        self.assertIs(routers.pinned(), routers.ALL)
+
+    def test_allow_relation(self):
+        self.replicate(self.code)
+        replica_code = DownloadCode.objects.using('replica').get(pk=self.code.pk)
+        self.assertTrue(router.allow_relation(self.batch, replica_code))
+        # Objects from other databases are left to the other routers
+        other_code = DownloadCode(batch=self.batch)
+        other_code._state.db = 'other'
+        self.assertIsNone(routers.ReplicaRouter().allow_relation(self.batch, other_code))
+        self.assertFalse(router.allow_relation(self.batch, other_code))
+
+    def test_writes_pin_to_primary(self):
+        with routers.use_replica():
+            self.assertEqual(router.db_for_read(DownloadCode), 'replica')
+            self.code.redeem()
+            self.assertEqual(router.db_for_read(DownloadCode), 'default')
+            self.assertEqual(router.db_for_read(File), 'replica')
+            # Non-busker models are never routed
+            self.assertEqual(router.db_for_read(Artist._meta.apps.get_model('auth', 'User')), 'default')
+        self.assertEqual(router.db_for_read(File), 'default')
+
+    def test_pin_all_kept(self):
+        with routers.use_replica():
+            routers.pin()
+            router.db_for_write(File)
+            self.assertIs(routers.pinned(), routers.ALL)
+            self.assertEqual(router.db_for_read(Batch), 'default')
+
+    @override_settings(BUSKER_REPLICA_DATABASE=None)
+    def test_unconfigured(self):
+        self.replicate(self.code)
+        self.assertEqual(validate_code(self.code.pk)._state.db, 'default')
+        with routers.use_replica():
+            self.assertEqual(router.db_for_read(DownloadCode), 'default')
+
+    def test_views(self):
+        self.replicate(self.code)
+        DownloadCode.objects.using('replica').filter(pk=self.code.pk).update(times_used=1)
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        # Read from the (lagging) replica:
+        self.assertContains(self.client.get(url), "This code has 1 use left.")
+        self.assertNotIn(routers.PIN_COOKIE, self.client.cookies)
+        # Redeeming the code sets the cookie that pins later requests to the primary:
+        response = self.client.post(url, data={'code': self.code.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 10)
+        self.assertContains(self.client.get(url), "This code has 1 use left.")
+        self.assertEqual(DownloadCode.objects.get(pk=self.code.pk).times_used, 1)
+        # Make the databases differ; pinned clients read the primary until the cookie expires:
+        DownloadCode.objects.filter(pk=self.code.pk).update(times_used=0)
+        self.assertContains(self.client.get(url), "This code has 2 uses left.")
+        del self.client.cookies[routers.PIN_COOKIE]
+        self.assertContains(self.client.get(url), "This code has 1 use left.")
+        # Codes not yet on the replica are found on the primary:
+        url = reverse('busker:redeem', kwargs={'download_code': self.other_code.pk})
+        self.assertContains(self.client.get(url), "This code has 2 uses left.")
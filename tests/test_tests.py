@@ -1,15 +1,19 @@
 import os
+from io import StringIO
+from unittest import mock
 from random import randint
 import tempfile
 
 from PIL import Image
 from django.core.files import File
+from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.urls import reverse
 
-from busker.models import Artist, File as BuskerFile, DownloadCode, DownloadableWork, Batch, work_file_path, work_image_path, \
-    validate_code, generate_code
+from busker.models import Artist, File as BuskerFile, DownloadCode, DownloadableWork, Batch, BatchStats, \
+    work_file_path, work_image_path, validate_code, generate_code, create_codes, valid_codes
 from busker.util import get_client_ip, error_page
 
 
@@ -136,3 +140,171 @@ class BuskerTestCase(TestCase):
         code = DownloadCode.objects.create(batch=self.batch)
         self.assertEqual(code.redeem_uri, reverse('busker:redeem', kwargs={'download_code': code.id}))
         code.delete()
+
+
+class BatchStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Stats Test Batch", public_message="",
+                                          number_of_codes=5, max_uses=2)
+
+    def assertStats(self, **expected):
+        stats = BatchStats.objects.get(batch=self.batch)
+        for field, value in expected.items():
+            self.assertEqual(getattr(stats, field), value, f"BatchStats.{field} should be {value}")
+
+    def test_codes_created(self):
+        self.assertStats(codes_total=5, codes_used=0, redemptions=0, codes_exhausted=0, last_redeemed_date=None)
+        DownloadCode.objects.create(batch=self.batch)
+        self.assertStats(codes_total=6)
+
+    def test_redeem(self):
+        code = self.batch.codes.first()
+        code.redeem()
+        self.assertStats(codes_used=1, redemptions=1, codes_exhausted=0, last_redeemed_date=code.last_used_date)
+        code.redeem()
+        self.assertStats(codes_used=1, redemptions=2, codes_exhausted=1)
+        self.batch.codes.last().redeem()
+        self.assertStats(codes_used=2, redemptions=3, codes_exhausted=1)
+        # Redemptions past the limit (the confirmation form doesn't check it) don't count the code again
+        code.redeem()
+        self.assertStats(codes_used=2, redemptions=4, codes_exhausted=1)
+
+    def test_rebuild(self):
+        code = self.batch.codes.first()
+        code.redeem()
+        DownloadCode.objects.filter(pk=code.pk).update(times_used=2)  # Bypasses the incremental update
+        BatchStats.objects.filter(batch=self.batch).delete()
+        BatchStats.rebuild()
+        self.assertStats(codes_total=5, codes_used=1, redemptions=2, codes_exhausted=1,
+                         last_redeemed_date=code.last_used_date)
+
+    def test_rebuild_empty_batch(self):
+        self.batch.codes.all().delete()
+        BatchStats.rebuild([self.batch.pk])
+        self.assertStats(codes_total=0, codes_used=0, redemptions=0, codes_exhausted=0, last_redeemed_date=None)
+
+    def test_rebuild_command(self):
+        DownloadCode.objects.create(batch=self.batch, times_used=1, max_uses=1)
+        BatchStats.objects.filter(batch=self.batch).update(codes_total=0)
+        call_command('busker_rebuild_batch_stats', str(self.batch.pk), stdout=StringIO())
+        self.assertStats(codes_total=6, codes_used=1, redemptions=1, codes_exhausted=1)
+
+
+class CreateCodesTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Create Codes Test Batch", public_message="",
+                                          number_of_codes=20, max_uses=5)
+
+    def test_batch_create(self):
+        self.assertEqual(self.batch.codes.count(), 20)
+        self.assertEqual(set(self.batch.codes.values_list('max_uses', flat=True)), {5})
+        self.assertEqual(BatchStats.objects.get(batch=self.batch).codes_total, 20)
+
+    def test_create_codes_chunked(self):
+        # Per chunk: collision check, savepoint, INSERT, BatchStats UPDATE, release savepoint
+        with self.assertNumQueries(5 * 4):
+            self.assertEqual(create_codes(self.batch, 35, chunk_size=10), 35)
+        self.assertEqual(self.batch.codes.count(), 55)
+
+    def test_create_codes_collision(self):
+        """
+        Candidates that already exist in the database are discarded and replaced.
+        """
+        existing = self.batch.codes.first().pk
+        candidates = iter([existing, 'NEW0001', 'NEW0002'])
+        with mock.patch('busker.models.random_code', side_effect=lambda: next(candidates)):
+            self.assertEqual(create_codes(self.batch, 2), 2)
+        self.assertEqual(DownloadCode.objects.filter(pk__in=['NEW0001', 'NEW0002'], batch=self.batch).count(), 2)
+
+    def test_create_codes_integrity_error(self):
+        """
+        Integrity errors that aren't caused by another process claiming a candidate are raised rather than retried.
+        """
+        bulk_create = mock.Mock(side_effect=IntegrityError("bad FK"))
+        with mock.patch.object(DownloadCode.objects, 'bulk_create', bulk_create), self.assertRaises(IntegrityError):
+            create_codes(self.batch, 2)
+        self.assertEqual(bulk_create.call_count, 1)
+
+    def test_add_codes(self):
+        self.assertEqual(self.batch.add_codes(5), 5)
+        self.assertEqual(self.batch.number_of_codes, 25)
+        self.assertEqual(Batch.objects.get(pk=self.batch.pk).number_of_codes, 25)
+        self.assertEqual(self.batch.codes.count(), 25)
+        self.assertEqual(BatchStats.objects.get(batch=self.batch).codes_total, 25)
+
+    def test_add_codes_command(self):
+        out = StringIO()
+        call_command('busker_add_codes', str(self.batch.pk), '3', stdout=out)
+        self.assertIn("now has 23 codes", out.getvalue())
+        self.assertEqual(self.batch.codes.count(), 23)
+
+
+class DenormalisedWorkTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Denormalised Test Batch", public_message="",
+                                          number_of_codes=3)
+
+    def assertCodes(self, work, is_active):
+        self.assertEqual(set(self.batch.codes.values_list('work', 'is_active')), {(work.pk, is_active)})
+
+    def test_new_codes(self):
+        self.assertCodes(self.work, True)
+        DownloadCode.objects.create(batch=self.batch)
+        self.batch.add_codes(2)
+        self.assertCodes(self.work, True)
+
+    def test_validate_code_single_table(self):
+        code = self.batch.codes.first()
+        with self.assertNumQueries(1) as context:
+            self.assertEqual(validate_code(code.pk.lower()), code)
+        self.assertNotIn('busker_batch', context.captured_queries[0]['sql'])
+
+    def test_validate_code_uses_index(self):
+        self.assertIn('busker_code_active_upper_idx', valid_codes(self.batch.codes.first().pk.lower()).explain())
+
+    def test_unpublish_work(self):
+        code = self.batch.codes.first()
+        self.work.published = False
+        self.work.save()
+        self.assertCodes(self.work, False)
+        self.assertFalse(validate_code(code.pk))
+        self.work.published = True
+        self.work.save()
+        self.assertCodes(self.work, True)
+
+    def test_move_batch(self):
+        other = DownloadableWork.objects.create(artist=self.artist, title="Unreleased", published=False)
+        self.batch.work = other
+        self.batch.save()
+        self.assertCodes(other, False)
+
+    def test_move_code(self):
+        """
+        Saving a code with a different batch copies the new batch's work, outside the admin too
+        """
+        other = DownloadableWork.objects.create(artist=self.artist, title="Unreleased", published=False)
+        other_batch = Batch.objects.create(work=other, label="Other Batch", public_message="", number_of_codes=0)
+        code = self.batch.codes.first()
+        code.batch = other_batch
+        code.save()
+        code = DownloadCode.objects.get(pk=code.pk)
+        self.assertEqual((code.work_id, code.is_active), (other.pk, False))
+        code.batch = self.batch
+        code.save()
+        self.assertEqual(DownloadCode.objects.filter(pk=code.pk, work=self.work, is_active=True).count(), 1)
+
+    def test_refresh_denormalised(self):
+        other = DownloadableWork.objects.create(artist=self.artist, title="Unreleased", published=False)
+        Batch.objects.filter(pk=self.batch.pk).update(work=other)  # Bypasses the post_save receiver
+        self.assertCodes(self.work, True)
+        self.assertEqual(DownloadCode.refresh_denormalised(self.batch.codes.all()), 3)
+        self.assertCodes(other, False)
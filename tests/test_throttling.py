@@ -0,0 +1,68 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from busker import metrics, throttling
+from busker.models import Artist, DownloadableWork, Batch
+
+
+@override_settings(BUSKER_THROTTLE_ENABLED=True, BUSKER_THROTTLE_IP_RATE=(3, 60), BUSKER_THROTTLE_PREFIX_RATE=(5, 60),
+                   BUSKER_METRICS_ENABLED=True)
+class ThrottlingTestCase(TestCase):
+    """
+    Tests for the busker.throttling module
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        work = DownloadableWork.objects.create(artist=artist, title="Dancing Teeth", published=True)
+        self.code = Batch.objects.create(work=work, label="Throttle Test Batch", public_message="",
+                                         number_of_codes=1).codes.first()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_sliding_window(self):
+        self.assertIsNone(throttling.hit('test', 2, 60, now=600))
+        self.assertIsNone(throttling.hit('test', 2, 60, now=610))
+        self.assertEqual(throttling.hit('test', 2, 60, now=615), 45)
+        # Two thirds of the way through the next window, a third of the previous window's 3 requests still count
+        self.assertIsNone(throttling.hit('test', 2, 60, now=700))
+        self.assertEqual(throttling.hit('test', 2, 60, now=701), 19)
+        # Two windows later, nothing carries over
+        self.assertIsNone(throttling.hit('test', 2, 60, now=900))
+
+    def test_code_prefix(self):
+        self.assertEqual(throttling.code_prefix('ab-c1234'), 'ABC')
+        self.assertEqual(throttling.code_prefix(' '), '')
+
+    def test_ip_limit(self):
+        url = reverse('busker:redeem', kwargs={'download_code': self.code.pk})
+        for i in range(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        # Other clients are unaffected
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        counters = metrics.registry.snapshot()['counters']['busker_throttled_requests_total']
+        self.assertEqual(counters, {'scope="ip"': 1})
+
+    def test_prefix_limit(self):
+        for i in range(5):
+            self.client.post(reverse('busker:redeem_form'), {'code': 'XYZ0000%d' % i}, REMOTE_ADDR=f'10.0.0.{i}')
+        response = self.client.post(reverse('busker:redeem_form'), {'code': 'xyz99999'}, REMOTE_ADDR='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        counters = metrics.registry.snapshot()['counters']['busker_throttled_requests_total']
+        self.assertEqual(counters, {'scope="prefix"': 1})
+        response = self.client.post(reverse('busker:redeem_form'), {'code': '12399999'}, REMOTE_ADDR='10.0.1.1')
+        self.assertNotEqual(response.status_code, 429)
+
+    @override_settings(BUSKER_THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        url = reverse('busker:redeem', kwargs={'download_code': 'NOTCODE'})
+        for i in range(5):
+            self.assertEqual(self.client.get(url).status_code, 404)
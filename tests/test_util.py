@@ -1,13 +1,16 @@
+import json
 import logging
+import threading
 from uuid import uuid4
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.test.client import RequestFactory
 from django.urls import reverse
 from django.utils.html import escape
 
 from busker.models import DownloadCode
-from busker.util import get_client_ip, error_page, log_activity
+from busker.util import get_client_ip, error_page, log_activity, ActivityJSONFormatter, ActivityQueueHandler, \
+    start_activity_log_listener
 
 
 class UtilTestCase(TestCase):
@@ -57,4 +60,72 @@ class UtilTestCase(TestCase):
         code = DownloadCode()
 
         with self.assertLogs() as cm:
-            log_activity(logger, code, "This is a test log entry", request, logging.INFO)
\ No newline at end of file
+            log_activity(logger, code, "This is a test log entry", request, logging.INFO)
+
+    def test_log_activity_disabled_level(self):
+        """
+        Nothing should be logged (or formatted) if the logger isn't enabled for the level
+        """
+        request = self.factory.get(reverse('busker:redeem_form'))
+        logger = logging.getLogger(__name__)
+
+        with self.assertLogs(logger, logging.WARNING) as cm:
+            log_activity(logger, DownloadCode(), "This is a test log entry", request, logging.INFO)
+            logger.warning("(assertLogs requires at least one entry)")
+        self.assertEqual(len(cm.records), 1)
+
+    @override_settings(BUSKER_ACTIVITY_LOG_FORMAT='json')
+    def test_log_activity_json(self):
+        request = self.factory.get(reverse('busker:redeem_form'), HTTP_USER_AGENT=__name__,
+                                   REMOTE_ADDR='123.145.167.189')
+        logger = logging.getLogger(__name__)
+        code = DownloadCode(id='ABC1234')
+
+        with self.assertLogs(logger) as cm:
+            log_activity(logger, code, "Code Redeemed", request, logging.INFO, latency=0.0125)
+        data = json.loads(ActivityJSONFormatter().format(cm.records[0]))
+        self.assertEqual(data['message'], "Code Redeemed")
+        self.assertEqual(data['object'], 'ABC1234')
+        self.assertEqual(data['object_id'], 'ABC1234')
+        self.assertEqual(data['client_ip'], '123.145.167.189')
+        self.assertEqual(data['user_agent'], __name__)
+        self.assertEqual(data['latency_ms'], 12.5)
+        self.assertEqual(data['level'], 'INFO')
+        self.assertIn('timestamp', data)
+
+    def test_json_formatter_plain_record(self):
+        record = logging.makeLogRecord({'msg': "hello %s", 'args': ('world',), 'levelname': 'INFO'})
+        self.assertEqual(json.loads(ActivityJSONFormatter().format(record))['message'], "hello world")
+
+    @override_settings(BUSKER_ACTIVITY_LOG_FORMAT='json')
+    def test_activity_log_listener(self):
+        """
+        Handlers are moved to a background thread, which does the formatting
+        """
+        formatted = []
+
+        class CollectingHandler(logging.Handler):
+            def emit(self, record):
+                formatted.append((threading.current_thread(), self.format(record)))
+
+        logger = logging.getLogger(f"{__name__}.listener")
+        handler = CollectingHandler()
+        handler.setFormatter(ActivityJSONFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            listener = start_activity_log_listener(logger.name)
+            self.assertEqual(len(logger.handlers), 1)
+            self.assertIsInstance(logger.handlers[0], ActivityQueueHandler)
+            request = self.factory.get(reverse('busker:redeem_form'))
+            log_activity(logger, DownloadCode(id='ABC1234'), "Code Redeemed", request)
+            listener.stop()
+        finally:
+            logger.handlers = []
+        self.assertEqual(len(formatted), 1)
+        self.assertIsNot(formatted[0][0], threading.current_thread())
+        self.assertEqual(json.loads(formatted[0][1])['object_id'], 'ABC1234')
+
+    def test_activity_log_listener_no_handlers(self):
+        self.assertIsNone(start_activity_log_listener(f"{__name__}.no_handlers"))
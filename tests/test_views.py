@@ -1,5 +1,6 @@
 import os
 import tempfile
+from datetime import timedelta
 from secrets import token_hex
 from uuid import uuid4
 
@@ -8,6 +9,7 @@ from django.core.files import File
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.urls import reverse
+from django.utils import timezone
 
 from busker.models import Artist, File as BuskerFile, DownloadableWork, Batch
 from busker.models import DownloadCode, generate_code
@@ -64,7 +66,7 @@ class RedeemViewTest(TestCase):
         """
         Test the redeem URL with a valid code; should respond with the confirm form
         """
-        code = self.batch.codes.first()
+        code = self.batch.codes.exclude(pk=self.used_code.pk).first()
         response = self.client.get(reverse('busker:redeem', kwargs={'download_code': code.id}),
                                    HTTP_USER_AGENT=__name__)
         # TODO support i18n for button label
@@ -88,7 +90,7 @@ class RedeemViewTest(TestCase):
     def test_redeem_confirm_valid(self):
         """
         Test that clicking 'confirm' from the redeem view displays the expected list of files. There is currently no
-        cleaning or validation on the confirm form, thus no corresponding 'invalid' test.
+        cleaning or validation on the confirm form; see test_redeem_confirm_invalid for the codes the view rejects.
         """
         code = self.batch.codes.first()
         data = {'code': code.id, 'submit': 'Continue'}  # TODO make sure 'Continue button' is i18n friendly
@@ -99,6 +101,23 @@ class RedeemViewTest(TestCase):
             self.assertContains(response, file.filename)
         self.assertTrue('busker_download_token' in self.client.session)
 
+    def test_redeem_confirm_invalid(self):
+        """
+        Test that confirming a revoked, expired or unpublished code responds with 404, while a code whose uses ran out
+        after the confirm form was displayed can still be redeemed.
+        """
+        revoked, expired = self.batch.codes.exclude(pk=self.used_code.pk)[:2]
+        DownloadCode.objects.filter(pk=revoked.pk).update(revoked=True)
+        DownloadCode.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        for code in (revoked, expired, self.unpub_code):
+            response = self.client.post(reverse('busker:redeem', kwargs={'download_code': code.id}),
+                                        data={'code': code.id})
+            self.assertContains(response, "is no longer valid", status_code=404)
+            self.assertEqual(DownloadCode.objects.get(pk=code.pk).times_used, 0)
+        response = self.client.post(reverse('busker:redeem', kwargs={'download_code': self.used_code.id}),
+                                    data={'code': self.used_code.id})
+        self.assertEqual(response.status_code, 200)
+
 
 class RedeemFormViewTest(TestCase):
 
@@ -233,6 +252,9 @@ class DownloadViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get('Content-Type'), 'image/png')
         self.assertEqual(response.get('Content-Disposition'), f'attachment; filename="{self.busker_file.filename}"')
+        self.assertTrue(response.streaming)  # Not read into memory
+        with self.busker_file.file.open('rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
 
     def test_invalid_token(self):
         """
@@ -0,0 +1,138 @@
+import threading
+import time
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from busker import fragments, singleflight
+from busker.models import Artist, DownloadableWork, Batch, File as BuskerFile
+
+
+class WarmupTestCase(TestCase):
+    """
+    Tests for busker.warmup and the busker_warm_cache management command
+    """
+
+    def setUp(self):
+        cache.clear()
+        fragments.local_cache.clear()
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Warmup Test Batch", public_message="Hello",
+                                          number_of_codes=1, max_uses=2)
+        self.file = BuskerFile(work=self.work, description="Teeth")
+        self.file.file.save(name="teeth.txt", content=ContentFile(b"busker"))
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        fragments.local_cache.clear()
+
+    def test_command(self):
+        out = StringIO()
+        call_command('busker_warm_cache', batch=[str(self.batch.pk)], stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Warmed 3 fragments, 0 thumbnails and 1 file.")
+        fragments.local_cache.clear()  # As if in another process
+        with self.assertNumQueries(0):
+            fragments.render('file_list', self.work)
+            fragments.render('batch_message', self.batch)
+            self.assertEqual(fragments.file_metadata(self.file), (6, 'text/plain'))
+
+        out = StringIO()
+        call_command('busker_warm_cache', work=[str(self.work.pk)], stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Warmed 2 fragments, 0 thumbnails and 1 file.")
+
+    def test_command_errors(self):
+        with self.assertRaises(CommandError):
+            call_command('busker_warm_cache')
+        with self.assertRaises(CommandError):
+            call_command('busker_warm_cache', work=['bogus'])
+
+
+@override_settings(BUSKER_SINGLE_FLIGHT_WAIT=2)
+class SingleFlightTestCase(SimpleTestCase):
+    """
+    Tests for busker.singleflight
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_threads_coalesced(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.1)
+            return "value"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(singleflight.get_or_load(cache, 'key', load)))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(loads), 1)
+
+    def test_waits_for_other_process(self):
+        cache.add('key:loading', 1)  # Another process is loading the value...
+        threading.Timer(0.1, lambda: cache.set('key', "theirs")).start()
+        self.assertEqual(singleflight.get_or_load(cache, 'key', lambda: "ours"), "theirs")
+
+    @override_settings(BUSKER_SINGLE_FLIGHT_WAIT=0.1)
+    def test_gives_up_waiting(self):
+        cache.add('key:loading', 1)  # ...but never finishes
+        self.assertEqual(singleflight.get_or_load(cache, 'key', lambda: "ours"), "ours")
+        self.assertEqual(cache.get('key'), "ours")
+        # The other process's lock is left for it to release
+        self.assertEqual(cache.get('key:loading'), 1)
+
+    def test_other_keys_not_blocked(self):
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_load():
+            started.set()
+            finish.wait(2)
+            return "slow"
+
+        thread = threading.Thread(target=singleflight.get_or_load, args=(cache, 'slow', slow_load))
+        thread.start()
+        started.wait(2)
+        self.assertEqual(singleflight.get_or_load(cache, 'fast', lambda: "fast"), "fast")
+        finish.set()
+        thread.join()
+        self.assertEqual(cache.get('slow'), "slow")
+
+    def test_failed_load(self):
+        started, finish = threading.Event(), threading.Event()
+
+        def failing_load():
+            started.set()
+            finish.wait(2)
+            raise ValueError("load failed")
+
+        errors = []
+
+        def first():
+            try:
+                singleflight.get_or_load(cache, 'key', failing_load)
+            except ValueError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        started.wait(2)
+        threading.Timer(0.1, finish.set).start()
+        # Waits for the first load, then loads the value itself when that fails
+        self.assertEqual(singleflight.get_or_load(cache, 'key', lambda: "value"), "value")
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertIsNone(cache.get('key:loading'))
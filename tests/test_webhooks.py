@@ -0,0 +1,174 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from busker import webhooks
+from busker.models import Artist, DownloadableWork, Batch, BatchStats, WebhookEndpoint, WebhookEvent, UsageEvent
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """
+    Local stand-in for a webhook endpoint, which records the requests it receives and responds with `status`.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.status = 200
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(handler):
+                body = handler.rfile.read(int(handler.headers['Content-Length']))
+                self.requests.append((dict(handler.headers), body))
+                handler.send_response(self.status)
+                handler.end_headers()
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/hook/"
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@override_settings(BUSKER_WEBHOOK_TIMEOUT=2)
+class WebhookTestCase(TestCase):
+    """
+    Tests for the busker.webhooks module
+    """
+
+    def setUp(self):
+        self.receiver = WebhookReceiver()
+        self.endpoint = WebhookEndpoint.objects.create(url=self.receiver.url, batch_size=2)
+        self.artist = Artist.objects.create(name="Conrad Poohs", url="https://magicians.band")
+        self.work = DownloadableWork.objects.create(artist=self.artist, title="Dancing Teeth", published=True)
+        self.batch = Batch.objects.create(work=self.work, label="Webhook Test Batch", public_message="",
+                                          number_of_codes=5)
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def redeem(self, count=1):
+        for code in self.batch.codes.all()[:count]:
+            code.redeem()
+
+    def test_outbox(self):
+        """
+        Redeeming a code writes an event for each subscribed endpoint, without making any requests
+        """
+        WebhookEndpoint.objects.create(url=self.receiver.url, active=False)
+        WebhookEndpoint.objects.create(url=self.receiver.url, send_redemptions=False, send_downloads=True)
+        code = self.batch.codes.first()
+        code.redeem()
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.endpoint, event.event_type, event.status), (self.endpoint, UsageEvent.REDEMPTION,
+                                                                            WebhookEvent.PENDING))
+        payload = json.loads(event.payload)
+        self.assertEqual((payload['type'], payload['code'], payload['work']), ('code.redeemed', code.pk,
+                                                                               str(self.work.pk)))
+
+    @override_settings(BUSKER_SIGNAL_DISPATCH='thread')
+    def test_outbox_same_transaction(self):
+        """
+        The redemption is rolled back if its outbox rows can't be written, even when signals are sent in the background
+        """
+        code = self.batch.codes.first()
+        with mock.patch.object(WebhookEvent.objects, 'bulk_create', side_effect=DatabaseError("outbox")), \
+                self.assertRaises(DatabaseError):
+            code.redeem()
+        code.refresh_from_db()
+        self.assertEqual(code.times_used, 0)
+        self.assertEqual(BatchStats.objects.get(batch=self.batch).redemptions, 0)
+        self.assertEqual(self.receiver.requests, [])
+
+    def test_deliver_in_batches(self):
+        self.redeem(3)
+        self.assertEqual(webhooks.deliver_webhooks(), (3, 0))
+        self.assertEqual([len(json.loads(body)['events']) for _, body in self.receiver.requests], [2, 1])
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.DELIVERED, attempts=1).count(), 3)
+        self.assertEqual(webhooks.deliver_webhooks(), (0, 0))
+
+    def test_signature(self):
+        self.redeem()
+        webhooks.deliver_webhooks()
+        headers, body = self.receiver.requests[0]
+        self.assertEqual(headers['X-Busker-Signature'],
+                         webhooks.sign(self.endpoint.secret, headers['X-Busker-Timestamp'], body))
+        event = WebhookEvent.objects.get()
+        self.assertEqual(json.loads(body)['events'][0]['id'], str(event.event_id))
+
+    @override_settings(BUSKER_WEBHOOK_RETRY_DELAY=10, BUSKER_WEBHOOK_MAX_ATTEMPTS=3)
+    def test_retry_and_dead_letter(self):
+        self.redeem()
+        self.receiver.status = 500
+        with self.assertLogs('busker.webhooks', 'WARNING') as logs:
+            self.assertEqual(webhooks.deliver_webhooks(), (0, 1))
+        self.assertIn("HTTP 500", logs.output[0])
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.last_error), (WebhookEvent.PENDING, 1, "HTTP 500"))
+        self.assertGreaterEqual(event.next_attempt_date, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(webhooks.deliver_webhooks(), (0, 0))  # Not due yet
+
+        with self.assertLogs('busker.webhooks', 'WARNING') as logs:
+            for attempt in (2, 3):
+                WebhookEvent.objects.update(next_attempt_date=timezone.now())
+                webhooks.deliver_webhooks()
+        self.assertIn("Gave up on 1 webhook events", logs.output[-1])
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.DEAD, 3))
+
+        WebhookEvent.objects.update(next_attempt_date=timezone.now())
+        self.assertEqual(webhooks.deliver_webhooks(), (0, 0))
+        self.receiver.status = 204
+        webhooks.retry(WebhookEvent.objects.all())
+        self.assertEqual(webhooks.deliver_webhooks(), (1, 0))
+
+    def test_retry_delay(self):
+        with override_settings(BUSKER_WEBHOOK_RETRY_DELAY=30):
+            self.assertTrue(30 <= webhooks.retry_delay(1) <= 33)
+            self.assertTrue(120 <= webhooks.retry_delay(3) <= 132)
+            self.assertLessEqual(webhooks.retry_delay(30), webhooks.MAX_RETRY_DELAY * 1.1)
+
+    def test_unreachable_endpoint(self):
+        self.redeem()
+        self.receiver.stop()
+        with self.assertLogs('busker.webhooks', 'WARNING'):
+            self.assertEqual(webhooks.deliver_webhooks(), (0, 1))
+        self.assertTrue(WebhookEvent.objects.get().last_error)
+        self.receiver = WebhookReceiver()  # For tearDown
+
+    def test_claimed_events_skipped(self):
+        self.redeem()
+        self.assertEqual(len(webhooks.claim(self.endpoint)), 1)
+        self.assertEqual(webhooks.claim(self.endpoint), [])
+
+    def test_command(self):
+        self.redeem(2)
+        out = StringIO()
+        call_command('busker_deliver_webhooks', stdout=out)
+        self.assertIn("Delivered 2 webhook events; 0 failed.", out.getvalue())
+
+    def test_admin_retry_action(self):
+        self.redeem()
+        WebhookEvent.objects.update(status=WebhookEvent.DEAD, attempts=8)
+        self.client.force_login(User.objects.create_superuser(username='test', password='test'))
+        self.assertEqual(self.client.get(reverse('admin:busker_webhookendpoint_changelist')).status_code, 200)
+        self.client.post(reverse('admin:busker_webhookevent_changelist'), {
+            'action': 'retry_events',
+            '_selected_action': list(WebhookEvent.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.PENDING)